@@ -6,6 +6,9 @@ import os # <--- Added import os
 from flask import Flask, jsonify # Import jsonify for error handling
 from .config import settings
 from .modules.logger import app_logger
+from .modules.validation import ValidatingRequest, UploadValidationError
+from .modules.staging import StagingQuotaExceeded
+from .modules.assets import asset_pipeline
 
 def create_app():
     """
@@ -25,9 +28,25 @@ def create_app():
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'a-very-secret-key-in-prod') # Use env var or default
     app.config['DEBUG'] = settings.DEBUG
 
-    app_logger.info(f"Flask App Name: {app.name}")
-    app_logger.info(f"Debug Mode: {app.config['DEBUG']}")
-    app_logger.info(f"Max Content Length: {app.config['MAX_CONTENT_LENGTH']}")
+    # Validate file parts (type, size, magic bytes) while the form is parsed
+    app.request_class = ValidatingRequest
+
+    # Minified, fingerprinted, precompressed static files (plain /static URLs in debug mode)
+    if settings.ASSETS_ENABLED and not settings.DEBUG:
+        asset_pipeline.build()
+    app.add_template_global(asset_pipeline.url, 'asset_url')
+
+    @app.cli.command('build-assets')
+    def build_assets():
+        """Write the built static assets and their .gz/.br variants to ASSET_BUILD_DIR."""
+        asset_pipeline.build()
+        asset_pipeline.write()
+        for source, target in sorted(asset_pipeline.manifest.items()):
+            print(f"{source} -> {target}")
+
+    app_logger.info("Flask App Name: {}", app.name)
+    app_logger.info("Debug Mode: {}", app.config['DEBUG'])
+    app_logger.info("Max Content Length: {}", app.config['MAX_CONTENT_LENGTH'])
 
     # --- Register Blueprints --- #
     try:
@@ -35,7 +54,7 @@ def create_app():
         app.register_blueprint(main_bp)
         app_logger.info("Registered 'main' blueprint.")
     except ImportError as e:
-        app_logger.error(f"Failed to import or register blueprint: {e}", exc_info=True)
+        app_logger.error("Failed to import or register blueprint: {}", e, exc_info=True)
         # Depending on severity, you might want to raise an exception or exit
 
     # --- Global Error Handlers --- #
@@ -44,7 +63,7 @@ def create_app():
 
     @app.errorhandler(404)
     def not_found_error(error):
-        app_logger.warning(f"404 Not Found: {error}")
+        app_logger.warning("404 Not Found: {}", error)
         # Optionally render an error template
         # from flask import render_template
         # return render_template('error.html', error_title="الصفحة غير موجودة", error_message="لم نتمكن من العثور على الصفحة التي طلبتها.", app_name=settings.APP_NAME), 404
@@ -52,22 +71,40 @@ def create_app():
 
     @app.errorhandler(413)
     def request_entity_too_large(error):
-        app_logger.warning(f"413 Request Entity Too Large: {error}")
+        app_logger.warning("413 Request Entity Too Large: {}", error)
         return jsonify({
             "status": "error",
             "message": f"الملف كبير جداً. الحد الأقصى هو {settings.MAX_CONTENT_LENGTH // (1024*1024)} ميجابايت." # File too large
         }), 413
 
+    @app.errorhandler(UploadValidationError)
+    def upload_rejected(error):
+        app_logger.warning("Rejected upload: {}", error.reason or error.message)
+        response = jsonify({"status": "error", "message": error.message})
+        response.status_code = error.status_code
+        # The rest of the body is never read, so the connection cannot be reused
+        response.headers['Connection'] = 'close'
+        return response
+
+    @app.errorhandler(StagingQuotaExceeded)
+    def staging_full(error):
+        response = jsonify({"status": "error", "message": error.message})
+        response.status_code = error.status_code
+        response.headers['Retry-After'] = str(error.retry_after)
+        # The upload body is left unread
+        response.headers['Connection'] = 'close'
+        return response
+
     @app.errorhandler(500)
     def internal_error(error):
-        app_logger.error(f"500 Internal Server Error: {error}", exc_info=True) # Log traceback for 500s
+        app_logger.error("500 Internal Server Error: {}", error, exc_info=True) # Log traceback for 500s
         return jsonify({"status": "error", "message": "خطأ داخلي في الخادم"}), 500 # Internal server error
 
     @app.errorhandler(Exception)
     def handle_exception(e):
         # Catch-all for any unhandled exceptions
         # Log the exception details
-        app_logger.critical(f"Unhandled Exception: {e}", exc_info=True)
+        app_logger.critical("Unhandled Exception: {}", e, exc_info=True)
         # Return a generic 500 error response
         # Avoid exposing detailed error messages to the client in production
         if settings.DEBUG:
@@ -77,6 +114,6 @@ def create_app():
              return jsonify({"status": "error", "message": "حدث خطأ غير متوقع"}), 500 # An unexpected error occurred
 
     # Log application startup
-    app_logger.info(f"Application '{settings.APP_NAME}' created and configured.")
+    app_logger.info("Application '{}' created and configured.", settings.APP_NAME)
     
     return app
@@ -0,0 +1,234 @@
+"""
+ASGI entry point.
+Serves POST /upload natively on the event loop (incremental multipart parsing
+forwarded to DDownload through aiohttp) and delegates every other route to
+the Flask application created by create_app().
+
+Run with, for example:
+    uvicorn --factory app.asgi:create_asgi_app --host 0.0.0.0 --port 5000
+"""
+import json
+import math
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.utils import secure_filename
+from . import create_app
+from .config import settings
+from .modules.http_client import http_client
+from .modules.logger import app_logger
+from .modules.metrics import error_status
+from .modules.progress import progress_tracker
+from .modules.ratelimit import rate_limiter, RateLimitExceeded
+from .modules.staging import staging_area
+from .modules.storage import run_blocking
+from .modules.streaming import AsyncMultipartStreamReader, MultipartStreamError, RequestTooLarge
+from .modules.uploader import uploader
+from .modules.validation import upload_validator, UploadValidationError
+
+
+async def _send_json(send, payload: dict, status: int = 200, headers: list = None) -> None:
+    """Send a complete JSON response over an ASGI channel."""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _body_reader(receive, limit: int):
+    """
+    Wrap an ASGI ``receive`` channel as a coroutine returning body chunks.
+
+    Returns ``b""`` once the body is complete and enforces ``limit`` on the
+    number of bytes received, since chunked requests carry no Content-Length.
+    """
+    state = {"received": 0, "done": False}
+
+    async def read() -> bytes:
+        if state["done"]:
+            return b""
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise MultipartStreamError("Client disconnected during upload")
+        chunk = message.get("body", b"")
+        state["received"] += len(chunk)
+        if state["received"] > limit:
+            raise RequestTooLarge()
+        if not message.get("more_body", False):
+            state["done"] = True
+        return chunk
+
+    return read
+
+
+async def upload_endpoint(scope, receive, send) -> None:
+    """
+    Handle POST /upload without leaving the event loop.
+
+    Applies the same per-client rate limits as the Flask upload routes and
+    mirrors the JSON responses of the Flask ``/upload`` route.
+    """
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    if not settings.RATE_LIMIT_ENABLED:
+        await _handle_upload(headers, receive, send)
+        return
+
+    client = rate_limiter.client_key((scope.get("client") or ("",))[0], headers.get("x-forwarded-for"))
+    content_length = headers.get("content-length")
+    declared = int(content_length) if content_length and content_length.isdigit() else None
+    if rate_limiter.requires_length(declared, "chunked" in headers.get("transfer-encoding", "").lower()):
+        await _send_json(send, {
+            "status": "error",
+            "message": "يجب تحديد حجم الطلب" # The request size must be declared
+        }, 411, [(b"connection", b"close")])
+        return
+    try:
+        # The limiter may keep its state in SQLite: checked off the event loop
+        await run_blocking(rate_limiter.admit, client, declared or 0, 1, True)
+    except RateLimitExceeded as e:
+        await _send_json(send, {
+            "status": "error",
+            "message": "طلبات رفع كثيرة، الرجاء المحاولة بعد قليل" # Too many uploads, please retry shortly
+        }, 429, [
+            (b"retry-after", str(max(1, math.ceil(e.retry_after))).encode("latin-1")),
+            (b"connection", b"close"),
+        ])
+        return
+    try:
+        await _handle_upload(headers, receive, send)
+    finally:
+        await run_blocking(rate_limiter.release, client)
+
+
+async def _handle_upload(headers: dict, receive, send) -> None:
+    """Parse, validate and forward one upload (the body of upload_endpoint)."""
+    too_large = {
+        "status": "error",
+        "message": f"الملف كبير جداً. الحد الأقصى هو {settings.MAX_CONTENT_LENGTH // (1024*1024)} ميجابايت." # File too large
+    }
+
+    # 1. Reject oversized bodies up front when the size is declared
+    content_length = headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_CONTENT_LENGTH:
+        app_logger.warning("413 Request Entity Too Large: declared {} bytes", content_length)
+        await _send_json(send, too_large, 413)
+        return
+
+    # 2. Find the file part in the incoming multipart stream
+    try:
+        boundary = AsyncMultipartStreamReader.parse_boundary(headers.get("content-type"))
+        reader = AsyncMultipartStreamReader(_body_reader(receive, settings.MAX_CONTENT_LENGTH), boundary)
+        file_part = await reader.next_file()
+    except MultipartStreamError as e:
+        app_logger.warning("Rejected async upload: {}", e)
+        await _send_json(send, {"status": "error", "message": "طلب رفع غير صالح"}, 400) # Invalid upload request
+        return
+    except RequestTooLarge:
+        await _send_json(send, too_large, 413)
+        return
+
+    if file_part is None or file_part.name != "file" or not file_part.filename:
+        app_logger.warning("Async upload request received with no file part.")
+        await _send_json(send, {"status": "error", "message": "لم يتم اختيار ملف"}, 400) # No file selected
+        return
+
+    filename = secure_filename(file_part.filename)
+    app_logger.info("Async upload for file: '{}' (secured as: '{}')", file_part.filename, filename)
+
+    # 3. Check the type and leading bytes before anything is forwarded; the
+    # request's length covers every part, so the file's size is checked as it streams
+    try:
+        declared = int(content_length) if content_length and content_length.isdigit() else None
+        ext = upload_validator.check_part(filename, None)
+        chunks = await upload_validator.avalidate_chunks(ext, reader.iter_file_data())
+    except UploadValidationError as e:
+        app_logger.warning("Rejected async upload: {}", e.reason or e.message)
+        await _send_json(send, {"status": "error", "message": e.message}, e.status_code)
+        return
+    except MultipartStreamError as e:
+        app_logger.warning("Rejected async upload: {}", e)
+        await _send_json(send, {"status": "error", "message": "طلب رفع غير صالح"}, 400) # Invalid upload request
+        return
+    except RequestTooLarge:
+        await _send_json(send, too_large, 413)
+        return
+
+    # 4. Forward the file data to its storage backend as it arrives
+    try:
+        upload_id = headers.get("x-upload-id")
+        success, result = await uploader.upload_stream_async(
+            chunks, filename, upload_id if progress_tracker.is_valid_id(upload_id) else None, declared
+        )
+    except RequestTooLarge:
+        await _send_json(send, too_large, 413)
+        return
+    except UploadValidationError as e:
+        app_logger.warning("Rejected async upload: {}", e.reason or e.message)
+        await _send_json(send, {"status": "error", "message": e.message}, e.status_code)
+        return
+    except Exception as e:
+        app_logger.error("Unexpected error in async upload handler: {}", e, exc_info=True)
+        await _send_json(send, {
+            "status": "error",
+            "message": "حدث خطأ غير متوقع أثناء معالجة الرفع" # Unexpected error during upload processing
+        }, 500)
+        return
+
+    if success:
+        app_logger.info("Successfully uploaded '{}'. Link: {}", filename, result.get('download_link'))
+        await _send_json(send, {
+            "status": "success",
+            "message": "تم رفع الملف بنجاح", # File uploaded successfully
+            "download_link": result.get("download_link", "")
+        })
+        return
+
+    error_msg = result.get("error", "خطأ غير معروف أثناء الرفع") # Unknown upload error
+    app_logger.error("Async upload failed for '{}': {}", filename, error_msg)
+    await _send_json(send, {"status": "error", "message": error_msg}, error_status(error_msg))
+
+
+async def _lifespan(receive, send) -> None:
+    """Open/close per-process resources with the ASGI server's lifecycle."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            uploader.server_pool.start()
+            staging_area.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            uploader.server_pool.stop()
+            staging_area.stop()
+            await http_client.aclose()
+            http_client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def create_asgi_app(flask_app=None):
+    """
+    Create the ASGI application.
+
+    Args:
+        flask_app: Existing Flask app to delegate to (defaults to create_app()).
+
+    Returns:
+        ASGI callable.
+    """
+    flask_app = flask_app or create_app()
+    wsgi_app = WsgiToAsgi(flask_app)
+
+    async def application(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await _lifespan(receive, send)
+        elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/upload":
+            await upload_endpoint(scope, receive, send)
+        else:
+            await wsgi_app(scope, receive, send)
+
+    app_logger.info("ASGI application created; /upload served natively.")
+    return application
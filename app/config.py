@@ -22,13 +22,132 @@ class Settings(BaseSettings):
     APP_NAME: str = "مُرفِق الملفات"  # Arabic name meaning "File Uploader"
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     MAX_CONTENT_LENGTH: int = 500 * 1024 * 1024  # 500MB max upload size
-    
+
+    # Logging: file writes happen on a background thread fed by a bounded queue
+    LOG_ASYNC: bool = os.getenv("LOG_ASYNC", "True").lower() == "true"
+    LOG_QUEUE_SIZE: int = 10000  # Queued records before new ones are dropped
+    LOG_JSON: bool = os.getenv("LOG_JSON", "False").lower() == "true"  # One JSON object per line
+
+    # Streaming proxy mode: forward the request body to DDownload as it arrives
+    # instead of letting Werkzeug spool the whole file to a temp file first
+    STREAMING_UPLOADS: bool = os.getenv("STREAMING_UPLOADS", "False").lower() == "true"
+    STREAM_CHUNK_SIZE: int = 64 * 1024  # Bytes read from the request per iteration
+
+    # Async views under the gevent worker run their event loop on a native thread
+    ASYNC_VIEW_THREADS: int = 64  # Native threads per gevent worker; caps async views in flight
+
+    # Outbound HTTP connection pooling (keep-alive to DDownload)
+    HTTP_POOL_CONNECTIONS: int = 10  # Number of hosts to keep a connection pool for
+    HTTP_POOL_MAXSIZE: int = 20  # Keep-alive connections per host
+    HTTP_POOL_LIMIT: int = 100  # Total connections for the async (ASGI) client
+    HTTP_POOL_IDLE_TIMEOUT: float = 60.0  # Seconds before an idle pool is reconnected
+
+    # Upload server assignment cache (/upload/server results)
+    UPLOAD_SERVER_PREFETCH: bool = os.getenv("UPLOAD_SERVER_PREFETCH", "True").lower() == "true"
+    UPLOAD_SERVER_POOL_SIZE: int = 2  # Assignments kept warm per worker
+    UPLOAD_SERVER_TTL: float = 600.0  # Seconds an assignment is reused
+    UPLOAD_SERVER_REFRESH_INTERVAL: float = 30.0  # Seconds between prefetcher passes
+
+    # Resilience of DDownload calls
+    API_RETRY_ATTEMPTS: int = 3  # Tries per /upload/server lookup
+    UPLOAD_RETRY_ATTEMPTS: int = 2  # Tries per file transfer (seekable files only, on another server, only if never sent)
+    RETRY_BASE_DELAY: float = 0.2  # Seconds; doubles per retry, with full jitter
+    RETRY_MAX_DELAY: float = 5.0
+    HEDGE_LOOKUPS: bool = os.getenv("HEDGE_LOOKUPS", "True").lower() == "true"
+    HEDGE_PERCENTILE: float = 95.0  # Send a second lookup once the first is slower than this percentile
+    HEDGE_MIN_DELAY: float = 0.05  # Seconds; floor for the hedging delay
+    HEDGE_INITIAL_DELAY: float = 1.0  # Seconds; used until enough lookups have been timed
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # Consecutive failures before a host's circuit opens
+    CIRCUIT_RESET_TIMEOUT: float = 30.0  # Seconds an open circuit fails fast before a trial request
+
+    # Admission control for the upload endpoints (per client address)
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory" (per process) or "sqlite" (shared by workers)
+    RATE_LIMIT_TRUST_PROXY: bool = os.getenv("RATE_LIMIT_TRUST_PROXY", "False").lower() == "true"  # Key clients by X-Forwarded-For
+    RATE_LIMIT_REQUESTS_PER_SEC: float = 2.0  # Upload requests per client; 0 disables
+    RATE_LIMIT_REQUEST_BURST: int = 30
+    RATE_LIMIT_BYTES_PER_SEC: int = 20 * 1024 * 1024  # Upload bytes per client; 0 disables
+    RATE_LIMIT_BYTE_BURST: int = 500 * 1024 * 1024
+    RATE_LIMIT_CLIENT_CONCURRENCY: int = 8  # Uploads one client may have in flight; 0 disables
+    RATE_LIMIT_BUSY_RETRY_AFTER: int = 5  # Seconds suggested when a concurrency cap is reached
+    # Global cap on uploads in flight: UPSTREAM_BANDWIDTH / MIN_UPLOAD_BANDWIDTH
+    UPSTREAM_BANDWIDTH: int = int(os.getenv("UPSTREAM_BANDWIDTH", "0"))  # Bytes/s to DDownload; 0 = no global cap
+    MIN_UPLOAD_BANDWIDTH: int = 1024 * 1024  # Bytes/s each admitted upload should get
+
+    # Static assets: minified, fingerprinted and precompressed at startup
+    ASSETS_ENABLED: bool = os.getenv("ASSETS_ENABLED", "True").lower() == "true"
+    ASSET_MAX_AGE: int = 365 * 24 * 60 * 60  # Seconds; fingerprinted URLs never change content
+    INDEX_CACHE_ENABLED: bool = os.getenv("INDEX_CACHE_ENABLED", "True").lower() == "true"  # Render index.html once per process
+
+    # Storage backends: where uploaded files are kept ("ddownload", "local" or "s3")
+    STORAGE_DEFAULT_BACKEND: str = os.getenv("STORAGE_DEFAULT_BACKEND", "ddownload")
+    # Routing rules, first match wins; JSON in the environment, e.g.
+    # [{"backend": "local", "max_size": 8388608}, {"backend": "s3", "extensions": ["pdf", "docx"]}]
+    STORAGE_ROUTES: list = []
+    LOCAL_STORAGE_BASE_URL: str = os.getenv("LOCAL_STORAGE_BASE_URL", "")  # Prefix of local download links; empty = relative links
+    LOCAL_STORAGE_RETENTION: int = 7 * 24 * 60 * 60  # Seconds a locally stored file is served; 0 = kept for ever
+    S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL", "")  # e.g. https://s3.eu-central-1.amazonaws.com or a MinIO URL
+    S3_BUCKET: str = os.getenv("S3_BUCKET", "")
+    S3_ACCESS_KEY: str = os.getenv("S3_ACCESS_KEY", "")
+    S3_SECRET_KEY: str = os.getenv("S3_SECRET_KEY", "")
+    S3_REGION: str = os.getenv("S3_REGION", "us-east-1")
+    S3_PUBLIC_URL: str = os.getenv("S3_PUBLIC_URL", "")  # Public base URL of the bucket; empty = presigned links
+    S3_LINK_EXPIRY: int = 7 * 24 * 60 * 60  # Seconds a presigned link is valid (at most 7 days)
+    S3_PART_SIZE: int = 8 * 1024 * 1024  # Multipart part size for streamed uploads (at least 5MB)
+
     # File settings
     ALLOWED_EXTENSIONS: set = {"txt", "pdf", "png", "jpg", "jpeg", "gif", "zip", "rar", "doc", "docx", "xls", "xlsx"}
+    # Per-type size limits; other types use MAX_CONTENT_LENGTH (or RESUMABLE_MAX_FILE_SIZE)
+    MAX_FILE_SIZE_BY_TYPE: dict = {
+        "txt": 20 * 1024 * 1024,  # 20MB
+        "png": 50 * 1024 * 1024,  # 50MB
+        "jpg": 50 * 1024 * 1024,
+        "jpeg": 50 * 1024 * 1024,
+        "gif": 50 * 1024 * 1024,
+    }
+    UPLOAD_SNIFF_BYTES: int = 4096  # Leading bytes checked against the file type before the rest is read
     
+    # Upload staging area (form files, job files and resumable sessions awaiting transfer)
+    STAGING_MEMORY_THRESHOLD: int = 1024 * 1024  # Form files up to this size stay in memory; larger ones spill to disk
+    STAGING_QUOTA: int = 20 * 1024 * 1024 * 1024  # Bytes staged at once across all workers; 0 = no quota
+    STAGING_MIN_FREE_SPACE: int = 1024 * 1024 * 1024  # New uploads are refused when less would be left on the staging disk
+    STAGING_RETRY_AFTER: int = 30  # Seconds suggested to clients refused for lack of staging space
+    STAGING_REAP_INTERVAL: int = 60  # Seconds between reaper passes; 0 disables the reaper
+    STAGING_ORPHAN_GRACE: int = 5 * 60  # Seconds an unowned staged file is left alone before it is reaped
+
+    # Resumable (chunked) uploads
+    RESUMABLE_CHUNK_SIZE: int = 8 * 1024 * 1024  # Chunk size suggested to clients
+    RESUMABLE_MAX_FILE_SIZE: int = 2 * 1024 * 1024 * 1024  # 2GB max assembled size
+    RESUMABLE_EXPIRY: int = 24 * 60 * 60  # Seconds an idle session is kept
+
+    # Batch uploads: many files per request, sent to DDownload concurrently
+    BATCH_MAX_FILES: int = 50  # Files accepted in one /upload/batch request
+    BATCH_UPLOAD_PARALLELISM: int = int(os.getenv("BATCH_UPLOAD_PARALLELISM", "4"))  # Concurrent transfers per batch
+
+    # Background upload jobs: /upload returns a job id instead of waiting for DDownload
+    UPLOAD_JOBS_ENABLED: bool = os.getenv("UPLOAD_JOBS_ENABLED", "False").lower() == "true"
+    UPLOAD_JOB_WORKERS: int = 4  # Concurrent DDownload transfers per process
+    UPLOAD_QUEUE_MAX_DEPTH: int = 32  # Queued jobs per process before returning 503
+    UPLOAD_JOB_RESULT_TTL: int = 60 * 60  # Seconds a finished job's status is kept
+
+    # Progress of the server -> DDownload leg
+    PROGRESS_UPDATE_INTERVAL: float = 0.5  # Seconds between progress record writes
+    PROGRESS_RETENTION: int = 10 * 60  # Seconds a finished record is kept
+
+    # Content-hash deduplication
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "True").lower() == "true"
+    DEDUP_MAX_AGE: int = 30 * 24 * 60 * 60  # Seconds before an indexed link is re-uploaded
+
     # Paths
     BASE_DIR: Path = Path(__file__).resolve().parent.parent
     LOG_DIR: Path = BASE_DIR / "logs"
+    UPLOAD_STAGING_DIR: Path = BASE_DIR / "staging"
+    DATA_DIR: Path = BASE_DIR / "data"
+    DEDUP_DB_PATH: Path = DATA_DIR / "dedup.sqlite3"
+    LOCAL_STORAGE_DIR: Path = DATA_DIR / "files"  # Files kept by the local storage backend
+    RATE_LIMIT_DB_PATH: Path = UPLOAD_STAGING_DIR / "ratelimit.sqlite3"
+    STAGING_DB_PATH: Path = UPLOAD_STAGING_DIR / "staging.sqlite3"  # Staging quota ledger shared by workers
+    ASSET_BUILD_DIR: Path = BASE_DIR / "build" / "assets"  # Output of `flask build-assets`
     
     class Config:
         """Pydantic config."""
@@ -38,6 +157,3 @@ class Settings(BaseSettings):
 
 # Create settings instance
 settings = Settings()
-
-# Ensure log directory exists
-os.makedirs(settings.LOG_DIR, exist_ok=True)
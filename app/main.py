@@ -2,19 +2,56 @@
 Main application routes and views.
 Defines the main blueprint and routes for the application.
 """
-import asyncio # Required for async route
+import math
+import re
+from contextlib import ExitStack
 from flask import (
     Blueprint, 
     render_template, 
     request, 
     jsonify, 
+    Response,
+    url_for,
+    send_file,
+    g,
     current_app # Access the current Flask app instance
 )
 from werkzeug.utils import secure_filename
 from .modules.uploader import uploader
+from .modules.async_runner import async_runner
+from .modules.streaming import MultipartStreamReader, MultipartStreamError
+from .modules.resumable import resumable_store, ResumableUploadError
+from .modules.storage import local_storage
+from .modules.staging import staging_area
+from .modules.jobs import upload_jobs, QueueFullError
+from .modules.progress import progress_tracker
+from .modules.metrics import metrics, error_status
+from .modules.resilience import circuit_breakers
+from .modules.ratelimit import rate_limiter, RateLimitExceeded
+from .modules.validation import upload_validator, UploadValidationError
+from .modules.assets import asset_pipeline, Asset
 from .modules.logger import app_logger
 from .config import settings
 
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Rendered pages by template name; their content only depends on settings
+_rendered_pages = {}
+
+# Rate-limited endpoints -> (request cost, whether the request holds a concurrency slot);
+# resumable chunks are charged for their bytes only, as one upload spans many requests
+RATE_LIMITED_ENDPOINTS = {
+    'main.upload_file_route': (1, True),
+    'main.upload_batch': (1, True),
+    'main.create_resumable_upload': (1, False),
+    'main.put_resumable_chunk': (0, False),
+    'main.put_resumable_part': (0, False),
+    'main.complete_resumable_upload': (0, True),
+}
+
+# Endpoints whose multipart files are spooled to the staging area
+STAGED_ENDPOINTS = ('main.upload_file_route', 'main.upload_batch')
+
 # Create Blueprint
 main_bp = Blueprint(
     'main', 
@@ -23,31 +60,129 @@ main_bp = Blueprint(
     static_folder='../static' # Point to the static folder relative to this file
 )
 
+@main_bp.before_request
+def admit_upload_request():
+    """Apply per-client rate limits to the upload endpoints before the body is read."""
+    limits = RATE_LIMITED_ENDPOINTS.get(request.endpoint)
+    if not settings.RATE_LIMIT_ENABLED or limits is None:
+        return None
+    requests_cost, concurrent = limits
+    chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+    if rate_limiter.requires_length(request.content_length, chunked):
+        return _length_required_response()
+    client = rate_limiter.client_key(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    try:
+        rate_limiter.admit(client, request.content_length or 0, requests_cost, concurrent)
+    except RateLimitExceeded as e:
+        return _rate_limited_response(e)
+    if concurrent:
+        g.rate_limit_lease = rate_limiter.lease(client)
+    return None
+
+@main_bp.before_request
+def reserve_upload_staging():
+    """
+    Reserve staging space for a form upload from its Content-Length before
+    the body is read; StagingQuotaExceeded is answered with a 507.
+    """
+    if request.endpoint not in STAGED_ENDPOINTS or request.mimetype != 'multipart/form-data':
+        return None
+    if request.endpoint == 'main.upload_file_route' and settings.STREAMING_UPLOADS:
+        return None # Streamed straight through, never staged
+    request.reserve_staging(request.content_length or 0)
+    return None
+
+@main_bp.teardown_request
+def release_upload_slot(exc):
+    """
+    Give back the concurrency slot taken by admit_upload_request, once
+    the upload jobs the request queued have finished too.
+    """
+    lease = g.pop('rate_limit_lease', None)
+    if lease is not None:
+        lease.release()
+
+def _length_required_response():
+    """411 response for a chunked body, which the byte limit could not charge."""
+    response = jsonify({
+        "status": "error",
+        "message": "يجب تحديد حجم الطلب"  # The request size must be declared (Arabic)
+    })
+    response.status_code = 411
+    response.headers['Connection'] = 'close' # The upload body is left unread
+    return response
+
+def _rate_limited_response(error: RateLimitExceeded):
+    """429 response telling the client when to try again."""
+    response = jsonify({
+        "status": "error",
+        "message": "طلبات رفع كثيرة، الرجاء المحاولة بعد قليل"  # Too many uploads, please retry shortly (Arabic)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    response.headers['Connection'] = 'close' # The upload body is left unread
+    return response
+
 @main_bp.route('/')
 def index():
-    """Render the main application page (index.html)."""
+    """Render the main application page (index.html), once per process unless in debug mode."""
     try:
-        return render_template('index.html', app_name=settings.APP_NAME)
+        if not settings.INDEX_CACHE_ENABLED or settings.DEBUG:
+            return render_template('index.html', app_name=settings.APP_NAME)
+        page = _rendered_pages.get('index.html')
+        if page is None:
+            html = render_template('index.html', app_name=settings.APP_NAME)
+            page = _rendered_pages['index.html'] = Asset(html.encode('utf-8'), 'text/html')
+        # Revalidated on every view, answered with 304 while unchanged
+        return page.response(request, 'no-cache')
     except Exception as e:
-        app_logger.error(f"Error rendering index template: {e}", exc_info=True)
+        app_logger.error("Error rendering index template: {}", e, exc_info=True)
         # Render a generic error page or return a JSON error
         return render_template('error.html', 
                                error_title="خطأ في عرض الصفحة", 
                                error_message="حدث خطأ أثناء تحميل الصفحة الرئيسية.",
                                app_name=settings.APP_NAME), 500
 
+@main_bp.route('/assets/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted static asset in the best encoding the client accepts."""
+    built = asset_pipeline.get(filename)
+    if built is None:
+        return jsonify({"status": "error", "message": "الملف غير موجود"}), 404 # File not found
+    return built.response(request, f"public, max-age={settings.ASSET_MAX_AGE}, immutable")
+
+@main_bp.route('/files/<file_code>/<filename>')
+def download_file(file_code, filename):
+    """Serve a file kept by the local storage backend, with range request support."""
+    path = local_storage.path_of(file_code, filename)
+    if path is None:
+        return jsonify({"status": "error", "message": "الملف غير موجود"}), 404 # File not found
+    # conditional=True answers Range and If-None-Match/If-Modified-Since requests
+    return send_file(path, as_attachment=True, download_name=filename, conditional=True)
+
 @main_bp.route('/upload', methods=['POST'])
-async def upload_file_route(): # Renamed function to avoid clash with uploader.upload_file
+def upload_file_route(): # Renamed function to avoid clash with uploader.upload_file
     """
     Handle file upload requests asynchronously.
     
     Returns:
         JSON response with upload status and download link or error message.
     """
-    app_logger.debug(f"Received request to /upload: {request.method}")
+    app_logger.debug("Received request to /upload: {}", request.method)
+
+    # Refuse before reading the body if the job queue cannot take more work
+    if settings.UPLOAD_JOBS_ENABLED and upload_jobs.is_full():
+        return _queue_full_response(upload_jobs.retry_after())
+
+    # Streaming proxy mode bypasses Werkzeug's form parsing entirely
+    if settings.STREAMING_UPLOADS:
+        return _stream_upload()
 
-    # 1. Check if file part exists in the request
-    if 'file' not in request.files:
+    # 1. Check if file part exists in the request (first access parses the form;
+    #    disallowed file parts raise UploadValidationError before being spooled)
+    with metrics.time_stage("form_parse"):
+        has_file = 'file' in request.files
+    if not has_file:
         app_logger.warning("Upload request received with no file part.")
         return jsonify({
             "status": "error",
@@ -67,16 +202,19 @@ async def upload_file_route(): # Renamed function to avoid clash with uploader.u
     # 3. Secure the filename
     original_filename = file.filename
     filename = secure_filename(original_filename) # Sanitize filename
-    app_logger.info(f"Processing upload for file: '{original_filename}' (secured as: '{filename}')")
+    app_logger.info("Processing upload for file: '{}' (secured as: '{}')", original_filename, filename)
+
+    # In job mode, stage the file and return a job id right away
+    if settings.UPLOAD_JOBS_ENABLED:
+        return _enqueue_upload(file, filename)
 
     # 4. Perform the upload using the uploader module
     try:
         # The uploader.upload_file handles validation and the actual upload process
-        # It uses run_in_executor internally for the blocking part
-        success, result = await uploader.upload_file(file.stream, filename)
+        success, result = async_runner.run(uploader.upload_file(file.stream, filename, _progress_id()))
         
         if success:
-            app_logger.info(f"Successfully uploaded '{filename}'. Link: {result.get('download_link')}")
+            app_logger.info("Successfully uploaded '{}'. Link: {}", filename, result.get('download_link'))
             return jsonify({
                 "status": "success",
                 "message": "تم رفع الملف بنجاح",  # File uploaded successfully (Arabic)
@@ -85,22 +223,573 @@ async def upload_file_route(): # Renamed function to avoid clash with uploader.u
         else:
             # Uploader returns specific error message in result['error']
             error_msg = result.get("error", "خطأ غير معروف أثناء الرفع") # Unknown upload error (Arabic)
-            app_logger.error(f"Upload failed for '{filename}': {error_msg}")
-            # Determine appropriate status code based on error if possible
-            status_code = 500 if "API" in error_msg or "Network" in error_msg else 400
+            app_logger.error("Upload failed for '{}': {}", filename, error_msg)
             return jsonify({
                 "status": "error",
                 "message": f"{error_msg}" # Directly use the error from uploader
-            }), status_code
+            }), error_status(error_msg)
         
     except Exception as e:
         # Catch unexpected errors during the route handling itself
-        app_logger.error(f"Unexpected error in /upload route handler: {str(e)}", exc_info=True)
+        app_logger.error("Unexpected error in /upload route handler: {}", e, exc_info=True)
+        return jsonify({
+            "status": "error",
+            "message": "حدث خطأ غير متوقع أثناء معالجة الرفع"  # Unexpected error during upload processing (Arabic)
+        }), 500
+
+@main_bp.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    Upload several files in one request.
+
+    Accepts multipart ``files`` parts and/or ``upload_id`` fields naming
+    completed resumable sessions, or a JSON manifest ``{"uploads": [...]}``
+    of such session ids. The files are sent to DDownload concurrently and
+    the response lists a result per file, in request order.
+
+    Returns:
+        JSON response with per-file results and success/failure counts.
+    """
+    if settings.UPLOAD_JOBS_ENABLED and upload_jobs.is_full():
+        return _queue_full_response(upload_jobs.retry_after())
+
+    # 1. Collect the files: form parts first, then resumable sessions
+    if request.is_json:
+        uploads = (request.get_json(silent=True) or {}).get("uploads")
+        if not isinstance(uploads, list):
+            return jsonify({"status": "error", "message": "طلب رفع غير صالح"}), 400 # Invalid upload request
+        files = []
+    else:
+        with metrics.time_stage("form_parse"):
+            files = [f for f in request.files.getlist('files') if f and f.filename]
+        uploads = request.form.getlist('upload_id')
+
+    count = len(files) + len(uploads)
+    if count == 0:
+        app_logger.warning("Batch upload request received with no files.")
+        return jsonify({
+            "status": "error",
+            "message": "لم يتم اختيار ملف"  # No file selected (Arabic)
+        }), 400
+    if count > settings.BATCH_MAX_FILES:
+        return jsonify({
+            "status": "error",
+            "message": f"عدد الملفات يتجاوز الحد المسموح به ({settings.BATCH_MAX_FILES})"  # Too many files (Arabic)
+        }), 400
+
+    # (kind, source, filename) per file; sessions that cannot be sent get an error result
+    entries = [("form", f, secure_filename(f.filename)) for f in files]
+    results = [None] * count
+    for i, upload_id in enumerate(map(str, uploads), start=len(files)):
+        session = resumable_store.get(upload_id)
+        filename = session["filename"] if session else ""
+        if session is None:
+            results[i] = _batch_result(filename, False, {"error": "جلسة الرفع غير موجودة"}) # Upload session not found
+        elif session["offset"] != session["size"]:
+            results[i] = _batch_result(filename, False, {"error": "الرفع غير مكتمل"}) # Upload incomplete
+        entries.append(("resumable", upload_id, filename))
+    app_logger.info("Processing batch upload of {} file(s)", count)
+
+    # 2a. In job mode, stage every file and queue it as its own job
+    if settings.UPLOAD_JOBS_ENABLED:
+        for i, (kind, source, filename) in enumerate(entries):
+            if results[i] is None:
+                results[i] = _enqueue_batch_item(kind, source, filename)
+        return _batch_response(results)
+
+    # 2b. Otherwise upload them concurrently and wait for all of them
+    pending = [i for i in range(count) if results[i] is None]
+    try:
+        with ExitStack() as stack:
+            batch = []
+            for i in pending:
+                kind, source, filename = entries[i]
+                file_data = source.stream if kind == "form" else stack.enter_context(resumable_store.open_data(source))
+                batch.append((file_data, filename))
+            outcomes = async_runner.run(uploader.upload_batch(batch, _progress_id()))
+    except Exception as e:
+        app_logger.error("Unexpected error in /upload/batch route handler: {}", e, exc_info=True)
         return jsonify({
             "status": "error",
             "message": "حدث خطأ غير متوقع أثناء معالجة الرفع"  # Unexpected error during upload processing (Arabic)
         }), 500
 
+    for i, (success, result) in zip(pending, outcomes):
+        kind, source, filename = entries[i]
+        if success and kind == "resumable":
+            resumable_store.discard(source)
+        elif not success:
+            app_logger.error("Batch upload failed for '{}': {}", filename, result.get('error'))
+        results[i] = _batch_result(filename, success, result)
+    return _batch_response(results)
+
+def _enqueue_batch_item(kind: str, source, filename: str):
+    """Stage one file of a batch and queue it as an upload job; returns its result entry."""
+    if upload_jobs.is_full():
+        return _batch_result(filename, False, {"error": "الخادم مشغول حالياً، الرجاء المحاولة بعد قليل"}) # Server busy
+    job_id = upload_jobs.new_job_id()
+    staging_path = upload_jobs.staging_path(job_id)
+    with metrics.time_stage("stage_to_disk"), staging_area.disk_errors():
+        if kind == "form":
+            source.save(staging_path)
+        else:
+            resumable_store.move_data(source, staging_path)
+    try:
+        job = upload_jobs.submit(job_id, filename, keep_file=kind == "resumable", lease=g.get('rate_limit_lease'),
+                                 reservation=request.staging_reservation if kind == "form" else None)
+    except QueueFullError:
+        if kind == "resumable": # The session stays, so the client can send it again
+            resumable_store.restore_data(source, staging_path)
+        return _batch_result(filename, False, {"error": "الخادم مشغول حالياً، الرجاء المحاولة بعد قليل"}) # Server busy
+    if kind == "resumable":
+        resumable_store.discard(source)
+    return {
+        "filename": filename,
+        "status": "accepted",
+        "job_id": job["job_id"],
+        "status_url": url_for('main.upload_job_status', job_id=job["job_id"])
+    }
+
+def _batch_result(filename: str, success: bool, result: dict):
+    """Result entry for one file of a batch."""
+    if success:
+        return {"filename": filename, "status": "success", "download_link": result.get("download_link", "")}
+    return {
+        "filename": filename,
+        "status": "error",
+        "message": result.get("error", "خطأ غير معروف أثناء الرفع")  # Unknown upload error (Arabic)
+    }
+
+def _batch_response(results: list):
+    """
+    Summarise a batch: ``success`` if every file went through (``accepted``,
+    with a 202, if they were queued as jobs), ``partial`` if some did,
+    ``error`` (with a 500) if none did.
+    """
+    failed = sum(1 for r in results if r["status"] == "error")
+    body = {"uploaded": len(results) - failed, "failed": failed, "results": results}
+    if not failed and settings.UPLOAD_JOBS_ENABLED:
+        body.update(status="accepted", message="تم استلام الملفات وجاري رفعها") # Files received and being uploaded
+        return jsonify(body), 202
+    if not failed:
+        body.update(status="success", message="تم رفع الملفات بنجاح") # Files uploaded successfully
+    elif failed < len(results):
+        body.update(status="partial", message=f"تعذر رفع {failed} من {len(results)} ملفات") # Some files failed
+    else:
+        body.update(status="error", message="فشل رفع الملفات") # Upload failed
+        return jsonify(body), 500
+    return jsonify(body)
+
+def _progress_id():
+    """Client-chosen id for the progress endpoint, from the X-Upload-Id header."""
+    upload_id = request.headers.get('X-Upload-Id')
+    return upload_id if progress_tracker.is_valid_id(upload_id) else None
+
+def _enqueue_upload(file, filename: str):
+    """
+    Stage an uploaded file locally and queue it for transfer to DDownload.
+
+    Returns:
+        202 response with the job id and status URL, or 503 when the queue is full.
+    """
+    if not uploader._validate_file(filename):
+        return jsonify({
+            "status": "error",
+            "message": "نوع الملف غير مسموح به"  # File type not allowed (Arabic)
+        }), 400
+    if upload_jobs.is_full():
+        return _queue_full_response(upload_jobs.retry_after())
+
+    job_id = upload_jobs.new_job_id()
+    try:
+        with metrics.time_stage("stage_to_disk"), staging_area.disk_errors():
+            file.save(upload_jobs.staging_path(job_id))
+        job = upload_jobs.submit(job_id, filename, lease=g.get('rate_limit_lease'),
+                                 reservation=request.staging_reservation)
+    except QueueFullError as e:
+        return _queue_full_response(e.retry_after)
+
+    return _job_accepted_response(job)
+
+def _job_accepted_response(job):
+    """202 response pointing the client at the job status endpoint."""
+    status_url = url_for('main.upload_job_status', job_id=job["job_id"])
+    response = jsonify({
+        "status": "accepted",
+        "message": "تم استلام الملف وجاري رفعه",  # File received and being uploaded (Arabic)
+        "job_id": job["job_id"],
+        "status_url": status_url
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+def _queue_full_response(retry_after: int):
+    """503 response telling the client when to try again."""
+    app_logger.warning("Upload queue full; asking client to retry after {}s", retry_after)
+    response = jsonify({
+        "status": "error",
+        "message": "الخادم مشغول حالياً، الرجاء المحاولة بعد قليل"  # Server busy, please retry shortly (Arabic)
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@main_bp.route('/upload/<job_id>', methods=['GET'])
+def upload_job_status(job_id):
+    """Report the state of a queued upload job."""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "مهمة الرفع غير موجودة"}), 404 # Upload job not found
+
+    body = {"job_id": job["job_id"], "state": job["state"]}
+    if job["state"] == "done":
+        body.update(status="success", message="تم رفع الملف بنجاح", download_link=job.get("download_link", ""))
+    elif job["state"] == "failed":
+        body.update(status="error", message=job.get("error", "خطأ غير معروف أثناء الرفع")) # Unknown upload error
+    else:
+        body.update(status="pending")
+        progress = progress_tracker.get(job_id) # Set once a worker starts sending
+        if progress is not None:
+            body["progress"] = progress
+    response = jsonify(body)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@main_bp.route('/progress/<upload_id>', methods=['GET'])
+def upload_progress(upload_id):
+    """
+    Report how far the transfer to DDownload has got for an upload that was
+    sent with an ``X-Upload-Id`` header.
+    """
+    progress = progress_tracker.get(upload_id)
+    if progress is None:
+        return jsonify({"status": "error", "message": "لا توجد معلومات تقدم لهذا الرفع"}), 404 # No progress for this upload
+    response = jsonify(dict(progress, status="success", upload_id=upload_id))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@main_bp.route('/upload/lookup', methods=['POST'])
+def lookup_upload():
+    """
+    Pre-upload handshake: the browser sends the SHA-256 digest and size of a
+    file (and optionally its name, which can decide its storage backend), and
+    gets the existing download link back if that content has already been
+    uploaded, so the bytes never need to be sent.
+    """
+    payload = request.get_json(silent=True) or {}
+    digest = str(payload.get("sha256") or "").lower()
+    filename = secure_filename(str(payload.get("filename") or ""))
+    try:
+        size = int(payload.get("size", -1))
+    except (TypeError, ValueError):
+        size = -1
+
+    if not SHA256_RE.match(digest) or size < 0:
+        return jsonify({"status": "error", "message": "طلب غير صالح"}), 400 # Invalid request
+
+    existing = uploader.find_existing(digest, size, filename) if settings.DEDUP_ENABLED else None
+    if existing is None:
+        return jsonify({"status": "success", "found": False})
+
+    app_logger.info("Client-side dedup hit for {}... ({} bytes)", digest[:12], size)
+    return jsonify({
+        "status": "success",
+        "found": True,
+        "message": "تم رفع الملف بنجاح",  # File uploaded successfully (Arabic)
+        "download_link": existing["download_link"]
+    })
+
+@main_bp.route('/uploads', methods=['POST'])
+def create_resumable_upload():
+    """
+    Start a resumable upload session.
+
+    Expects JSON ``{"filename": ..., "size": ...}`` and returns the session id,
+    the current offset and the chunk size the client should use. With
+    ``"parallel": true`` the chunks are sent by number, in any order and
+    several at a time, to ``PUT /uploads/<id>/chunks/<n>``.
+    """
+    payload = request.get_json(silent=True) or {}
+    original_filename = str(payload.get("filename") or "")
+    filename = secure_filename(original_filename)
+    try:
+        size = int(payload.get("size", 0))
+    except (TypeError, ValueError):
+        size = 0
+
+    if not filename:
+        return jsonify({
+            "status": "error",
+            "message": "الرجاء اختيار ملف للرفع"  # Please select a file to upload (Arabic)
+        }), 400
+    upload_validator.check_part(filename, size, settings.RESUMABLE_MAX_FILE_SIZE)
+
+    try:
+        session = resumable_store.create(filename, size, parallel=bool(payload.get("parallel")))
+    except ResumableUploadError as e:
+        app_logger.warning("Rejected resumable upload for '{}': {}", filename, e.message)
+        return _resumable_error(e)
+
+    return jsonify(_session_payload(session)), 201
+
+def _session_payload(session):
+    """Client view of a resumable session; parallel sessions also list their missing chunks."""
+    payload = {
+        "status": "success",
+        "upload_id": session["upload_id"],
+        "offset": session["offset"],
+        "size": session["size"],
+        "chunk_size": session.get("chunk_size", settings.RESUMABLE_CHUNK_SIZE)
+    }
+    if session.get("parallel"):
+        payload.update(parallel=True, missing=session["missing"])
+    return payload
+
+@main_bp.route('/uploads/<upload_id>', methods=['GET'])
+def resumable_upload_status(upload_id):
+    """Report how many bytes of a resumable upload have been received (also answers HEAD)."""
+    session = resumable_store.get(upload_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "جلسة الرفع غير موجودة"}), 404 # Upload session not found
+    response = jsonify(_session_payload(session))
+    response.headers['Upload-Offset'] = str(session["offset"])
+    response.headers['Upload-Length'] = str(session["size"])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@main_bp.route('/uploads/<upload_id>', methods=['PUT'])
+def put_resumable_chunk(upload_id):
+    """
+    Append a chunk to a resumable upload.
+
+    The chunk is the raw request body; its position is given by the
+    ``Upload-Offset`` header and must equal the server's current offset.
+    """
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({"status": "error", "message": "طلب رفع غير صالح"}), 400 # Invalid upload request
+
+    stream = request.stream
+    session = resumable_store.get(upload_id) if offset == 0 else None
+    if session is not None and session.get("parallel"):
+        return _resumable_error(ResumableUploadError("Parallel uploads take numbered chunks", 400))
+    if session is not None:
+        # First chunk: check the leading bytes before anything is written
+        try:
+            stream = upload_validator.read_head(
+                upload_validator.extension(session["filename"]), stream, request.content_length
+            )
+        except UploadValidationError:
+            resumable_store.discard(upload_id) # This file will never be accepted
+            raise
+
+    try:
+        with metrics.time_stage("chunk_write"):
+            new_offset = resumable_store.append(upload_id, offset, stream, request.content_length)
+    except ResumableUploadError as e:
+        if e.status_code != 409:
+            app_logger.warning("Rejected chunk for upload {}: {}", upload_id, e.message)
+        return _resumable_error(e)
+
+    response = jsonify({"status": "success", "offset": new_offset})
+    response.headers['Upload-Offset'] = str(new_offset)
+    return response
+
+@main_bp.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_resumable_part(upload_id, index):
+    """
+    Write one numbered chunk of a parallel resumable upload.
+
+    The chunk is the raw request body and is written at its own position in
+    the preallocated file, so chunks can arrive in any order and concurrently.
+    An ``X-Chunk-Sha256`` header (hex digest) is checked before the chunk
+    counts as received; a mismatch is answered with 460.
+    """
+    stream = request.stream
+    if index == 0:
+        # First chunk: check the leading bytes before anything is written
+        session = resumable_store.get(upload_id)
+        if session is not None:
+            try:
+                stream = upload_validator.read_head(
+                    upload_validator.extension(session["filename"]), stream, request.content_length
+                )
+            except UploadValidationError:
+                resumable_store.discard(upload_id) # This file will never be accepted
+                raise
+
+    try:
+        with metrics.time_stage("chunk_write"):
+            session = resumable_store.write_chunk(
+                upload_id, index, stream, request.content_length, request.headers.get('X-Chunk-Sha256')
+            )
+    except ResumableUploadError as e:
+        app_logger.warning("Rejected chunk {} for upload {}: {}", index, upload_id, e.message)
+        return _resumable_error(e)
+
+    response = jsonify({"status": "success", "offset": session["offset"], "missing": len(session["missing"])})
+    response.headers['Upload-Offset'] = str(session["offset"])
+    return response
+
+@main_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_resumable_upload(upload_id):
+    """Hand a fully received resumable upload to the uploader."""
+    session = resumable_store.get(upload_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "جلسة الرفع غير موجودة"}), 404 # Upload session not found
+    if session["offset"] != session["size"]:
+        return _resumable_error(ResumableUploadError("Upload incomplete", 409, offset=session["offset"]))
+
+    filename = session["filename"]
+    app_logger.info("Finalizing resumable upload {} for '{}'", upload_id, filename)
+
+    # In job mode, move the assembled file into the job queue
+    if settings.UPLOAD_JOBS_ENABLED:
+        if upload_jobs.is_full():
+            return _queue_full_response(upload_jobs.retry_after())
+        job_id = upload_jobs.new_job_id()
+        staging_path = upload_jobs.staging_path(job_id)
+        resumable_store.move_data(upload_id, staging_path)
+        try:
+            job = upload_jobs.submit(job_id, filename, keep_file=True, lease=g.get('rate_limit_lease'))
+        except QueueFullError as e:
+            # Put the file back so the client can complete the session later
+            resumable_store.restore_data(upload_id, staging_path)
+            return _queue_full_response(e.retry_after)
+        resumable_store.discard(upload_id)
+        return _job_accepted_response(job)
+    try:
+        with resumable_store.open_data(upload_id) as file_data:
+            success, result = async_runner.run(uploader.upload_file(file_data, filename, _progress_id()))
+    except Exception as e:
+        app_logger.error("Unexpected error finalizing resumable upload {}: {}", upload_id, e, exc_info=True)
+        return jsonify({
+            "status": "error",
+            "message": "حدث خطأ غير متوقع أثناء معالجة الرفع"  # Unexpected error during upload processing (Arabic)
+        }), 500
+
+    if success:
+        resumable_store.discard(upload_id)
+        return jsonify({
+            "status": "success",
+            "message": "تم رفع الملف بنجاح",  # File uploaded successfully (Arabic)
+            "download_link": result.get("download_link", "")
+        })
+
+    # Keep the staged file so the client can retry the hand-off
+    error_msg = result.get("error", "خطأ غير معروف أثناء الرفع") # Unknown upload error (Arabic)
+    app_logger.error("Resumable upload {} failed for '{}': {}", upload_id, filename, error_msg)
+    return jsonify({"status": "error", "message": f"{error_msg}"}), error_status(error_msg)
+
+@main_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_resumable_upload(upload_id):
+    """Abort a resumable upload and delete its staged data."""
+    if resumable_store.get(upload_id) is None:
+        return jsonify({"status": "error", "message": "جلسة الرفع غير موجودة"}), 404 # Upload session not found
+    resumable_store.discard(upload_id)
+    return '', 204
+
+def _resumable_error(error: ResumableUploadError):
+    """JSON response for a resumable upload protocol error."""
+    messages = {
+        404: "جلسة الرفع غير موجودة",  # Upload session not found
+        409: "موضع الجزء غير متطابق",  # Chunk offset mismatch
+        460: "الجزء تالف أثناء النقل",  # Chunk corrupted in transit (checksum mismatch)
+        413: f"الملف كبير جداً. الحد الأقصى هو {settings.RESUMABLE_MAX_FILE_SIZE // (1024*1024)} ميجابايت.", # File too large
+    }
+    body = {"status": "error", "message": messages.get(error.status_code, "طلب رفع غير صالح")} # Invalid upload request
+    if error.offset is not None:
+        body["offset"] = error.offset
+    response = jsonify(body)
+    response.status_code = error.status_code
+    if error.offset is not None:
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response
+
+@main_bp.route('/stats/upload-servers')
+def upload_server_stats():
+    """Report upload server cache hit/miss counters and circuit breaker states for this worker process."""
+    return jsonify(dict(uploader.server_pool.stats(), circuits=circuit_breakers.states()))
+
+@main_bp.route('/metrics')
+def metrics_endpoint():
+    """Expose upload pipeline metrics in the Prometheus text format."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+def _stream_upload():
+    """
+    Parse the multipart body incrementally and forward the file part to
+    DDownload as it arrives, without spooling it to local disk.
+
+    Returns:
+        JSON response with upload status and download link or error message.
+    """
+    # 1. Set up the incremental parser on the raw request stream
+    try:
+        reader = MultipartStreamReader.from_content_type(request.stream, request.content_type)
+        file_part = reader.next_file()
+    except MultipartStreamError as e:
+        app_logger.warning("Rejected streaming upload: {}", e)
+        return jsonify({
+            "status": "error",
+            "message": "طلب رفع غير صالح"  # Invalid upload request (Arabic)
+        }), 400
+
+    # 2. Check that a file part with a filename was sent
+    if file_part is None or file_part.name != 'file' or not file_part.filename:
+        app_logger.warning("Streaming upload request received with no file part.")
+        return jsonify({
+            "status": "error",
+            "message": "لم يتم اختيار ملف"  # No file selected (Arabic)
+        }), 400
+
+    filename = secure_filename(file_part.filename)
+    app_logger.info("Streaming upload for file: '{}' (secured as: '{}')", file_part.filename, filename)
+
+    # 3. Check the type and leading bytes before anything is forwarded; the
+    # request's length covers every part, so the file's size is checked as it streams
+    ext = upload_validator.check_part(filename, None)
+    try:
+        chunks = upload_validator.validate_chunks(ext, reader.iter_file_data())
+    except MultipartStreamError as e:
+        app_logger.warning("Rejected streaming upload: {}", e)
+        return jsonify({
+            "status": "error",
+            "message": "طلب رفع غير صالح"  # Invalid upload request (Arabic)
+        }), 400
+
+    # 4. Forward the remaining file data straight to the upload server
+    try:
+        success, result = async_runner.run(
+            uploader.upload_stream(chunks, filename, _progress_id(), request.content_length)
+        )
+    except UploadValidationError:
+        raise # The file outgrew its type's limit; answered by the app's handler
+    except Exception as e:
+        app_logger.error("Unexpected error in streaming upload handler: {}", e, exc_info=True)
+        return jsonify({
+            "status": "error",
+            "message": "حدث خطأ غير متوقع أثناء معالجة الرفع"  # Unexpected error during upload processing (Arabic)
+        }), 500
+
+    if success:
+        app_logger.info("Successfully streamed '{}'. Link: {}", filename, result.get('download_link'))
+        return jsonify({
+            "status": "success",
+            "message": "تم رفع الملف بنجاح",  # File uploaded successfully (Arabic)
+            "download_link": result.get("download_link", "")
+        })
+
+    error_msg = result.get("error", "خطأ غير معروف أثناء الرفع") # Unknown upload error (Arabic)
+    app_logger.error("Streaming upload failed for '{}': {}", filename, error_msg)
+    return jsonify({
+        "status": "error",
+        "message": f"{error_msg}"
+    }), error_status(error_msg)
+
 # Note: Common error handlers (404, 413, 500) are now defined globally in app/__init__.py
 # You could keep specific blueprint error handlers here if needed.
 # @main_bp.app_errorhandler(413)
@@ -0,0 +1,140 @@
+"""
+Async runner module.
+Runs the uploader's coroutines to completion from synchronous code (the
+Flask views and the upload job workers), each on its own event loop.
+
+asyncio allows one running event loop per OS thread. Under the gevent
+worker, threads are greenlets sharing a single OS thread, so two uploads
+running their loops at once would collide. There, each loop runs on a
+native thread from a gevent thread pool instead, while the blocking calls
+it makes (run_blocking) are handed back to greenlets on the worker's hub,
+which owns the sockets they use. The calling greenlet waits cooperatively.
+Blocking calls that gevent cannot make cooperative, such as SQLite's, go
+the other way: off_hub moves them from the hub to a native thread.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Coroutine, Optional, Tuple
+from ..config import settings
+
+
+def gevent_threads() -> bool:
+    """Whether threads are gevent greenlets in this process (gevent worker)."""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def off_hub(func):
+    """
+    Decorator for blocking calls that the network monkey-patching does not
+    cover, such as the SQLite ledgers: called from a greenlet on the gevent
+    worker's hub, ``func`` runs on a native thread of the hub's thread pool,
+    so waiting on a locked database does not stall every other greenlet.
+    Elsewhere it is called directly.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if gevent_threads():
+            import gevent
+            if isinstance(gevent.getcurrent(), gevent.Greenlet): # Not one of the native threads
+                return gevent.get_hub().threadpool.apply(func, args, kwargs)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class HubExecutor(ThreadPoolExecutor):
+    """
+    Executor running each call in a new greenlet on the hub it was created on.
+    (A ThreadPoolExecutor only because asyncio accepts no other default
+    executor; it never starts a thread.)
+    """
+
+    def __init__(self):
+        import gevent
+        super().__init__(max_workers=1)
+        self._spawn = gevent.spawn
+        self._hub = gevent.get_hub()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        # Called from the loop's native thread: schedule on the hub's own thread
+        self._hub.loop.run_callback_threadsafe(self._spawn, run)
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        pass # Shared by every loop of the process; its greenlets end with their calls
+
+
+class AsyncRunner:
+    """Runs coroutines from synchronous code, on native threads under gevent."""
+
+    def __init__(self, threads: int = None):
+        """
+        Args:
+            threads: Native threads per process for event loops under gevent
+                (defaults to ASYNC_VIEW_THREADS); caps coroutines in flight.
+        """
+        self.threads = threads or settings.ASYNC_VIEW_THREADS
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._executor: Optional[HubExecutor] = None
+
+    def _gevent_pool(self) -> Tuple[Any, HubExecutor]:
+        """This process's thread pool and hub executor (fork-safe)."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid(): # A pool inherited across fork is not ours
+                    from gevent.threadpool import ThreadPool
+                    self._pool = ThreadPool(self.threads)
+                    self._executor = HubExecutor()
+                    self._pid = os.getpid()
+        return self._pool, self._executor
+
+    @staticmethod
+    def _run_loop(coro: Coroutine, executor: HubExecutor) -> Tuple[Any, Optional[Exception]]:
+        """
+        Run ``coro`` on a pool thread; returns its result or the exception it raised.
+
+        (The hub would print the traceback of an exception leaving the pool
+        thread, though the caller handles it.)
+        """
+        try:
+            with asyncio.Runner() as runner:
+                runner.get_loop().set_default_executor(executor)
+                return runner.run(coro), None
+        except Exception as e:
+            return None, e
+
+    def run(self, coro: Coroutine) -> Any:
+        """
+        Run ``coro`` on a fresh event loop and return its result.
+
+        The coroutine sees the caller's context variables, such as Flask's
+        request context.
+        """
+        if not gevent_threads():
+            return asyncio.run(coro)
+        pool, executor = self._gevent_pool()
+        context = contextvars.copy_context()
+        result, error = pool.apply(context.run, (self._run_loop, coro, executor))
+        if error is not None:
+            raise error
+        return result
+
+# Create runner instance for use in the application
+async_runner = AsyncRunner()
@@ -0,0 +1,597 @@
+"""
+DDownload storage backend.
+Sends files to the DDownload file host: an upload server is assigned by the
+API (/upload/server, cached in a warm pool) and the file is posted to it as
+multipart form data. Uses a pooled keep-alive requests session for the
+server lookup and the blocking upload, either from a spooled file or
+streamed chunk by chunk, and a pooled aiohttp session for the fully async
+(ASGI) upload path. Bytes sent to the upload server are counted for the
+progress endpoint.
+"""
+import asyncio
+from typing import Dict, Any, AsyncIterable, Iterable, Optional, Tuple
+from ..config import settings
+from .lazy import lazy_import
+from .logger import app_logger
+from .http_client import http_client
+from .metrics import metrics
+from .progress import progress_tracker
+from .resilience import Hedger, RetryPolicy, circuit_breakers, circuit_open_error, is_resendable, is_transient, was_not_sent
+from .server_pool import UploadServerPool
+from .storage import Result, StorageBackend, run_blocking
+from .streaming import MultipartStreamEncoder, MultipartStreamError, SizedBody, StreamRejected, iter_file_chunks, remaining_size
+
+# Imported on first use (the WSGI path only needs requests, the ASGI path aiohttp)
+aiohttp = lazy_import("aiohttp")
+requests = lazy_import("requests") # Using requests for the file upload part as in the brief
+
+def _is_server_error(api_response: Dict[str, Any]) -> bool:
+    """Whether a DDownload API answer reports a server-side (5xx) failure."""
+    try:
+        return int(api_response.get("status", 0)) >= 500
+    except (TypeError, ValueError):
+        return False
+
+
+class DDownloadBackend(StorageBackend):
+    """Stores files on DDownload."""
+
+    name = "ddownload"
+
+    def __init__(self, api_key: str = None, api_url: str = None, download_url_base: str = None):
+        """
+        Initialize the backend with API key and URLs.
+
+        Args:
+            api_key: DDownload API key (defaults to DDOWNLOAD_API_KEY).
+            api_url: API base URL, e.g. a local stand-in for benchmarks (defaults to DDOWNLOAD_API_URL).
+            download_url_base: Base of generated download links (defaults to DDOWNLOAD_DOWNLOAD_URL).
+        """
+        self.api_key = api_key if api_key is not None else settings.DDOWNLOAD_API_KEY
+        self.api_url = (api_url or settings.DDOWNLOAD_API_URL).rstrip("/")
+        self.download_url_base = download_url_base or settings.DDOWNLOAD_DOWNLOAD_URL
+        self.server_pool = UploadServerPool(self.get_upload_server_sync)
+        self.lookup_retry = RetryPolicy()
+        self.transfer_retry = RetryPolicy(attempts=settings.UPLOAD_RETRY_ATTEMPTS)
+        self.lookup_hedger = Hedger("server_lookup")
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def get_upload_server(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Asynchronously get upload server details from DDownload API.
+
+        The lookup runs on the shared keep-alive pool in the default executor:
+        Flask runs each async view on a fresh event loop, so an aiohttp session
+        could not be kept open across requests.
+        
+        Returns:
+            Tuple[bool, Dict]: Success status and server information or error message.
+        """
+        return await run_blocking(self.get_upload_server_sync)
+
+    def get_upload_server_sync(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Synchronously get upload server details from DDownload API.
+
+        Transient failures are retried with backoff, and the API host's
+        circuit breaker fails the lookup fast while DDownload is down.
+        
+        Returns:
+            Tuple[bool, Dict]: Success status and server information or error message.
+        """
+        def attempt():
+            if not circuit_breakers.allow(self.api_url):
+                return False, circuit_open_error(self.api_url)
+            success, result = self._request_upload_server_sync()
+            circuit_breakers.record(self.api_url, success, result)
+            return success, result
+        return self.lookup_retry.call("server_lookup", attempt)
+
+    def _request_upload_server_sync(self) -> Tuple[bool, Dict[str, Any]]:
+        """Single /upload/server request on the pooled requests session."""
+        if not self.api_key:
+            app_logger.error("DDownload API Key is missing.")
+            return False, {"error": "API Key not configured"}
+
+        server_url = f"{self.api_url}/upload/server?key={self.api_key}"
+        app_logger.debug("Requesting upload server from: {}", server_url)
+        
+        try:
+            response = http_client.session.get(server_url, timeout=30) # Added timeout
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+            server_info = response.json()
+            app_logger.debug("Upload server response: {}", server_info)
+            
+            # DDownload API v2 uses 'msg' for status message and 'status' code
+            if server_info.get('status') == 200 and server_info.get('result'):
+                app_logger.info("Successfully obtained upload server.")
+                return True, {
+                    "upload_url": server_info['result'],
+                    "sess_id": server_info.get('sess_id') # sess_id might not always be present
+                }
+            else:
+                error_msg = server_info.get('msg', "Unknown error from DDownload API")
+                app_logger.error("Failed to get upload server: {} (Status: {})", error_msg, server_info.get('status'))
+                return False, {"error": f"API Error: {error_msg}", "retryable": _is_server_error(server_info)}
+                        
+        except requests.exceptions.Timeout:
+            app_logger.error("Timeout getting upload server.")
+            return False, {"error": "Request timed out", "retryable": True}
+        except requests.exceptions.RequestException as e:
+            app_logger.error("Network error getting upload server: {}", e)
+            return False, {"error": f"Network error: {str(e)}", "retryable": is_transient(e)}
+        except Exception as e:
+            app_logger.error("Unexpected error getting upload server: {}", e, exc_info=True)
+            return False, {"error": "An unexpected error occurred"}
+    
+    async def get_upload_server_async(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Get upload server details natively on the running event loop.
+
+        Uses the pooled aiohttp session, so it is only worthwhile on a
+        long-lived loop (the ASGI entry point). Retried and circuit-broken
+        like get_upload_server_sync.
+
+        Returns:
+            Tuple[bool, Dict]: Success status and server information or error message.
+        """
+        async def attempt():
+            if not circuit_breakers.allow(self.api_url):
+                return False, circuit_open_error(self.api_url)
+            success, result = await self._request_upload_server_async()
+            circuit_breakers.record(self.api_url, success, result)
+            return success, result
+        return await self.lookup_retry.acall("server_lookup", attempt)
+
+    async def _request_upload_server_async(self) -> Tuple[bool, Dict[str, Any]]:
+        """Single /upload/server request on the pooled aiohttp session."""
+        if not self.api_key:
+            app_logger.error("DDownload API Key is missing.")
+            return False, {"error": "API Key not configured"}
+
+        server_url = f"{self.api_url}/upload/server?key={self.api_key}"
+        app_logger.debug("Requesting upload server from: {}", server_url)
+
+        try:
+            session = await http_client.aio_session()
+            async with session.get(server_url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                response.raise_for_status()
+                server_info = await response.json(content_type=None)
+                app_logger.debug("Upload server response: {}", server_info)
+
+                if server_info.get('status') == 200 and server_info.get('result'):
+                    app_logger.info("Successfully obtained upload server.")
+                    return True, {
+                        "upload_url": server_info['result'],
+                        "sess_id": server_info.get('sess_id')
+                    }
+                else:
+                    error_msg = server_info.get('msg', "Unknown error from DDownload API")
+                    app_logger.error("Failed to get upload server: {} (Status: {})", error_msg, server_info.get('status'))
+                    return False, {"error": f"API Error: {error_msg}", "retryable": _is_server_error(server_info)}
+
+        except aiohttp.ClientError as e:
+            app_logger.error("Network error getting upload server: {}", e)
+            return False, {"error": f"Network error: {str(e)}", "retryable": is_transient(e)}
+        except asyncio.TimeoutError:
+            app_logger.error("Timeout getting upload server.")
+            return False, {"error": "Request timed out", "retryable": True}
+        except Exception as e:
+            app_logger.error("Unexpected error getting upload server: {}", e, exc_info=True)
+            return False, {"error": "An unexpected error occurred"}
+
+    async def acquire_upload_server(self, native: bool = False) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Get an upload server assignment, preferring a warm cached one.
+
+        Cached assignments on hosts whose circuit is open are skipped. Falls
+        back to a live /upload/server lookup, hedged when it is slow, when no
+        usable assignment is cached; a lookup that hands out a host with an
+        open circuit is repeated to get another one.
+
+        Args:
+            native: Do the fallback lookup with aiohttp instead of the executor.
+
+        Returns:
+            Tuple[bool, Dict]: Success status and server information or error message.
+        """
+        server_info = self._cached_upload_server()
+        if server_info is not None:
+            return True, server_info
+
+        metrics.server_cache.labels("miss").inc()
+        lookup = self.get_upload_server_async if native else self.get_upload_server
+        for _ in range(self.lookup_retry.attempts):
+            with metrics.time_stage("server_lookup"):
+                if settings.HEDGE_LOOKUPS:
+                    success, server_info = await self.lookup_hedger.call(lookup)
+                else:
+                    success, server_info = await lookup()
+            if not success:
+                return success, server_info
+            if circuit_breakers.allow(server_info.get("upload_url")):
+                self.server_pool.add(server_info)
+                return success, server_info
+            app_logger.warning("Upload server {} assigned while its circuit is open; asking again", server_info.get('upload_url'))
+        return False, circuit_open_error(server_info.get("upload_url"))
+
+    def acquire_upload_server_sync(self) -> Tuple[bool, Dict[str, Any]]:
+        """Blocking version of acquire_upload_server (lookups are not hedged)."""
+        server_info = self._cached_upload_server()
+        if server_info is not None:
+            return True, server_info
+
+        metrics.server_cache.labels("miss").inc()
+        for _ in range(self.lookup_retry.attempts):
+            with metrics.time_stage("server_lookup"):
+                success, server_info = self.get_upload_server_sync()
+            if not success:
+                return success, server_info
+            if circuit_breakers.allow(server_info.get("upload_url")):
+                self.server_pool.add(server_info)
+                return success, server_info
+            app_logger.warning("Upload server {} assigned while its circuit is open; asking again", server_info.get("upload_url"))
+        return False, circuit_open_error(server_info.get("upload_url"))
+
+    def _cached_upload_server(self) -> Optional[Dict[str, Any]]:
+        """A warm cached assignment on a host whose circuit is closed, if any."""
+        for _ in range(max(self.server_pool.size, 1)):
+            server_info = self.server_pool.get()
+            if server_info is None:
+                break
+            if circuit_breakers.allow(server_info.get("upload_url")):
+                metrics.server_cache.labels("hit").inc()
+                app_logger.debug("Using cached upload server: {}", server_info.get('upload_url'))
+                return server_info
+            app_logger.debug("Skipping cached upload server {}: circuit open", server_info.get('upload_url'))
+        return None
+
+    @staticmethod
+    def _server_rejected(result: Dict[str, Any]) -> bool:
+        """Whether a failed upload suggests its server assignment is no longer usable."""
+        error_msg = result.get("error", "")
+        return "API" in error_msg or "network" in error_msg
+
+    def _release_upload_server(self, server_info: Dict[str, Any], success: bool, result: Dict[str, Any]) -> None:
+        """Evict the assignment from the pool if the upload server rejected it."""
+        if not success and self._server_rejected(result):
+            self.server_pool.evict(server_info)
+
+    # Blocking transfers on the pooled requests session; the async store
+    # methods run them through run_blocking, off the event loop.
+    def upload_file_sync(self, file_data, filename: str, upload_url: str, sess_id: str = None, progress_id: str = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Synchronously uploads file data using the requests library.
+
+        The file is read and sent in STREAM_CHUNK_SIZE pieces rather than
+        being encoded into one in-memory body, so the bytes actually handed to
+        the socket can be counted for progress reporting.
+
+        Args:
+            file_data: The file stream/data to upload.
+            filename: The name of the file.
+            upload_url: The URL provided by get_upload_server.
+            sess_id: The session ID from get_upload_server (optional).
+            progress_id: Client-supplied id to publish progress under (optional).
+
+        Returns:
+            Tuple[bool, Dict]: Success status and upload results or error message.
+        """
+        app_logger.debug("Starting synchronous upload for {} to {}", filename, upload_url)
+        encoder = MultipartStreamEncoder(self._build_upload_data(sess_id), 'file', filename)
+        size = remaining_size(file_data)
+        reporter = progress_tracker.reporter(progress_id, size, upload_url)
+        body = encoder.iter_body(reporter.wrap(iter_file_chunks(file_data)))
+        if size is not None:
+            # Known size: send a Content-Length instead of chunked encoding
+            body = SizedBody(body, encoder.encoded_length(size))
+
+        success, result = False, {}
+        try:
+            # Using the pooled requests session for the actual file upload (blocking)
+            upload_response = http_client.session.post(
+                upload_url,
+                data=body,
+                headers={'Content-Type': encoder.content_type},
+                timeout=300 # 5 min timeout for upload
+            )
+            upload_response.raise_for_status()
+            success, result = self._parse_upload_response(upload_response.json(), filename)
+
+        except requests.exceptions.RequestException as e:
+            app_logger.error("Error during requests file upload for '{}': {}", filename, e)
+            result = {"error": f"Upload network error: {str(e)}", "retryable": is_transient(e), "resendable": was_not_sent(e)}
+        except Exception as e:
+            app_logger.error("Unexpected error during synchronous upload for '{}': {}", filename, e, exc_info=True)
+            result = {"error": "An unexpected error occurred during upload"}
+        finally:
+            reporter.finish(success)
+        circuit_breakers.record(upload_url, success, result)
+        return success, result
+
+    def upload_stream_sync(self, chunks: Iterable[bytes], filename: str, upload_url: str, sess_id: str = None, progress_id: str = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Synchronously uploads a stream of file chunks using chunked transfer encoding.
+
+        The multipart body is generated on the fly, so only the chunk currently
+        being sent is held in memory.
+
+        Args:
+            chunks: Iterable yielding the file payload as bytes.
+            filename: The name of the file.
+            upload_url: The URL provided by get_upload_server.
+            sess_id: The session ID from get_upload_server (optional).
+            progress_id: Client-supplied id to publish progress under (optional).
+
+        Returns:
+            Tuple[bool, Dict]: Success status and upload results or error message.
+        """
+        app_logger.debug("Starting streaming upload for {} to {}", filename, upload_url)
+        encoder = MultipartStreamEncoder(self._build_upload_data(sess_id), 'file', filename)
+        # The total is unknown: the file is still arriving from the client
+        reporter = progress_tracker.reporter(progress_id, None, upload_url)
+
+        success, result = False, {}
+        try:
+            # A generator body makes requests use Transfer-Encoding: chunked
+            upload_response = http_client.session.post(
+                upload_url,
+                data=encoder.iter_body(reporter.wrap(chunks)),
+                headers={'Content-Type': encoder.content_type},
+                timeout=300 # 5 min timeout for upload
+            )
+            upload_response.raise_for_status()
+            success, result = self._parse_upload_response(upload_response.json(), filename)
+
+        except MultipartStreamError as e:
+            app_logger.warning("Malformed upload stream for '{}': {}", filename, e)
+            return False, {"error": "Invalid upload request body"} # The client's fault, not the host's
+        except StreamRejected:
+            raise # Answered by the caller
+        except requests.exceptions.RequestException as e:
+            app_logger.error("Error during streaming file upload for '{}': {}", filename, e)
+            result = {"error": f"Upload network error: {str(e)}", "retryable": is_transient(e), "resendable": was_not_sent(e)}
+        except Exception as e:
+            app_logger.error("Unexpected error during streaming upload for '{}': {}", filename, e, exc_info=True)
+            result = {"error": "An unexpected error occurred during upload"}
+        finally:
+            reporter.finish(success)
+        circuit_breakers.record(upload_url, success, result)
+        return success, result
+
+    def _build_upload_data(self, sess_id: str = None) -> Dict[str, str]:
+        """Form fields sent alongside the file to the upload server."""
+        data = {
+            'utype': 'prem', # Or 'anon' depending on API key type
+        }
+        if sess_id:
+            data['sess_id'] = sess_id
+        return data
+
+    def _parse_upload_response(self, upload_result, filename: str) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Interpret the JSON returned by the upload server.
+
+        Args:
+            upload_result: Decoded JSON response body.
+            filename: The name of the uploaded file (for logging).
+
+        Returns:
+            Tuple[bool, Dict]: Success status and upload results or error message.
+        """
+        app_logger.debug("Upload response data: {}", upload_result)
+
+        # Check response format - it's often a list
+        if isinstance(upload_result, list) and upload_result:
+            first_result = upload_result[0]
+            if first_result.get('file_status') == 'OK' and first_result.get('file_code'):
+                file_code = first_result['file_code']
+                download_link = f"{self.download_url_base}/{file_code}"
+                app_logger.info("File '{}' uploaded successfully. Code: {}", filename, file_code)
+                return True, {
+                    "file_code": file_code,
+                    "download_link": download_link
+                }
+            else:
+                error_msg = first_result.get('error', "Upload failed according to API status")
+                app_logger.error("Upload failed for '{}': {}", filename, error_msg)
+                return False, {"error": f"API Upload Error: {error_msg}"}
+        else:
+             app_logger.error("Unexpected API response format during upload: {}", upload_result)
+             return False, {"error": "Unexpected API response format"}
+
+
+    async def store_file(self, file_data, filename: str, progress_id: str = None,
+                         server_info: Dict[str, Any] = None) -> Result:
+        """
+        Get a server (async) and upload the file to it (sync, in the executor).
+
+        A seekable file is sent again, to another server, when the upload
+        request never reached its host (see was_not_sent); after a timeout
+        or a 5xx answer it may have been stored, so the failure is returned.
+
+        Args:
+            file_data: File data object (e.g., file stream).
+            filename: Name of the file.
+            progress_id: Client-supplied id to publish progress under (optional).
+            server_info: Upload server assignment to use instead of acquiring one (optional).
+
+        Returns:
+            Tuple[bool, Dict]: Success status and upload results or error message.
+        """
+        start = file_data.tell() if getattr(file_data, "seekable", lambda: False)() else None
+        attempts = self.transfer_retry.attempts if start is not None else 1
+
+        for attempt in range(1, attempts + 1):
+            # Get upload server (cached assignment or async lookup) unless one was shared
+            if server_info is None:
+                success, server_info = await self.acquire_upload_server()
+                if not success:
+                    # server_info already contains the error message
+                    return False, server_info 
+            
+            upload_url = server_info.get("upload_url")
+            sess_id = server_info.get("sess_id")
+
+            if not upload_url:
+                 app_logger.error("Upload URL not found in server info response.")
+                 return False, {"error": "Could not retrieve upload URL"}
+
+            # Run the synchronous upload part in a separate thread 
+            # to avoid blocking the main async event loop.
+            try:
+                # Run the blocking upload call in the default thread pool executor
+                success, result = await run_blocking(
+                    self.upload_file_sync, 
+                    file_data, 
+                    filename, 
+                    upload_url, 
+                    sess_id,
+                    progress_id
+                )
+            except Exception as e:
+                # Catch potential errors from the executor itself
+                app_logger.error("Error running upload_file_sync in executor: {}", e, exc_info=True)
+                return False, {"error": "Failed to execute upload task"}
+
+            self._release_upload_server(server_info, success, result)
+            if success or not is_resendable(result) or attempt == attempts:
+                break # The POST is not idempotent: only resend it if the host never got it
+            self.transfer_retry.record_retry("upload", attempt, result)
+            await asyncio.sleep(self.transfer_retry.backoff(attempt))
+            file_data.seek(start)
+            server_info = None # Acquire again; open circuits steer it to another server
+
+        return success, result
+
+    async def store_stream(self, chunks: Iterable[bytes], filename: str, progress_id: str = None) -> Result:
+        """
+        Get a server (async) and forward the chunks to it as they are produced
+        (sync, in the executor).
+
+        Args:
+            chunks: Iterable yielding the file payload, e.g. MultipartStreamReader.iter_file_data().
+            filename: Name of the file.
+            progress_id: Client-supplied id to publish progress under (optional).
+
+        Returns:
+            Tuple[bool, Dict]: Success status and upload results or error message.
+        """
+        success, server_info = await self.acquire_upload_server()
+        if not success:
+            return False, server_info
+
+        upload_url = server_info.get("upload_url")
+        sess_id = server_info.get("sess_id")
+
+        if not upload_url:
+             app_logger.error("Upload URL not found in server info response.")
+             return False, {"error": "Could not retrieve upload URL"}
+
+        try:
+            # The chunk iterator reads from the client connection, so it is
+            # consumed in the same worker thread that sends to the upload server
+            success, result = await run_blocking(
+                self.upload_stream_sync,
+                chunks,
+                filename,
+                upload_url,
+                sess_id,
+                progress_id
+            )
+        except StreamRejected:
+            raise # Answered by the caller
+        except Exception as e:
+            app_logger.error("Error running upload_stream_sync in executor: {}", e, exc_info=True)
+            return False, {"error": "Failed to execute upload task"}
+        self._release_upload_server(server_info, success, result)
+        return success, result
+
+    def store_file_sync(self, file_data, filename: str, progress_id: str = None) -> Result:
+        """Get a server and upload the file to it, both blocking (a single attempt)."""
+        return self._store_sync(self.upload_file_sync, file_data, filename, progress_id)
+
+    def store_stream_sync(self, chunks: Iterable[bytes], filename: str, progress_id: str = None) -> Result:
+        """Get a server and forward the chunks to it, both blocking."""
+        return self._store_sync(self.upload_stream_sync, chunks, filename, progress_id)
+
+    def _store_sync(self, upload, data, filename: str, progress_id: str = None) -> Result:
+        success, server_info = self.acquire_upload_server_sync()
+        if not success:
+            return False, server_info
+
+        upload_url = server_info.get("upload_url")
+        if not upload_url:
+            app_logger.error("Upload URL not found in server info response.")
+            return False, {"error": "Could not retrieve upload URL"}
+
+        success, result = upload(data, filename, upload_url, server_info.get("sess_id"), progress_id)
+        self._release_upload_server(server_info, success, result)
+        return success, result
+
+    async def store_stream_async(self, chunks: AsyncIterable[bytes], filename: str, progress_id: str = None) -> Result:
+        """
+        Fully asynchronous streaming upload for the ASGI entry point.
+
+        Both the server lookup and the upload run on the event loop through
+        the pooled aiohttp session, so there is no thread hop and concurrency
+        is not capped by the default executor's worker count.
+
+        Args:
+            chunks: Async iterable yielding the file payload.
+            filename: Name of the file.
+            progress_id: Client-supplied id to publish progress under (optional).
+
+        Returns:
+            Tuple[bool, Dict]: Success status and upload results or error message.
+        """
+        success, server_info = await self.acquire_upload_server(native=True)
+        if not success:
+            return False, server_info
+
+        upload_url = server_info.get("upload_url")
+        if not upload_url:
+             app_logger.error("Upload URL not found in server info response.")
+             return False, {"error": "Could not retrieve upload URL"}
+
+        encoder = MultipartStreamEncoder(self._build_upload_data(server_info.get("sess_id")), 'file', filename)
+        reporter = progress_tracker.reporter(progress_id, None, upload_url)
+        success, result = False, {}
+        try:
+            session = await http_client.aio_session()
+            try:
+                async with session.post(
+                    upload_url,
+                    data=encoder.aiter_body(reporter.awrap(chunks)), # Sent with chunked transfer encoding
+                    headers={'Content-Type': encoder.content_type},
+                    timeout=aiohttp.ClientTimeout(total=300) # 5 min timeout for upload
+                ) as response:
+                    response.raise_for_status()
+                    success, result = self._parse_upload_response(await response.json(content_type=None), filename)
+            except aiohttp.ClientConnectionError as e:
+                # aiohttp wraps errors raised while reading the body; the incoming stream's are the client's
+                if isinstance(e.__cause__, (MultipartStreamError, StreamRejected)):
+                    raise e.__cause__
+                raise
+
+        except MultipartStreamError as e:
+            app_logger.warning("Malformed upload stream for '{}': {}", filename, e)
+            return False, {"error": "Invalid upload request body"}
+        except StreamRejected:
+            raise # Answered by the caller
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            app_logger.error("Error during async file upload for '{}': {}", filename, e)
+            success, result = False, {"error": f"Upload network error: {str(e)}", "retryable": is_transient(e),
+                                     "resendable": was_not_sent(e)}
+        except Exception as e:
+            app_logger.error("Unexpected error during async upload for '{}': {}", filename, e, exc_info=True)
+            return False, {"error": "An unexpected error occurred during upload"}
+        finally:
+            reporter.finish(success)
+
+        circuit_breakers.record(upload_url, success, result)
+        self._release_upload_server(server_info, success, result)
+        return success, result
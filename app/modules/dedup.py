@@ -0,0 +1,192 @@
+"""
+Deduplication module.
+Keeps a persistent SQLite index of SHA-256 digest + size -> download link
+and the storage backend holding the file, so a file that has already been
+uploaded is answered from the index instead of being stored again.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Optional, Tuple
+from ..config import settings
+from .async_runner import off_hub
+from .logger import app_logger
+
+class StreamHasher:
+    """Computes the SHA-256 digest and size of data as it passes through."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def update(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    @property
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def wrap(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass chunks through unchanged while hashing them."""
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+    async def awrap(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """Async version of wrap."""
+        async for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+
+def hash_file(file_obj, chunk_size: int = 1024 * 1024) -> Tuple[str, int]:
+    """
+    Hash a seekable file from its current position to the end.
+
+    The position is restored afterwards so the file can still be uploaded.
+
+    Returns:
+        Tuple[str, int]: Hex SHA-256 digest and number of bytes hashed.
+    """
+    start = file_obj.tell()
+    hasher = StreamHasher()
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    file_obj.seek(start)
+    return hasher.hexdigest, hasher.size
+
+
+class DedupIndex:
+    """SQLite-backed digest index shared by all worker processes."""
+
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path: Path of the SQLite database (defaults to DEDUP_DB_PATH).
+        """
+        self.db_path = str(db_path or settings.DEDUP_DB_PATH)
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    _CREATE_TABLE = (
+        "CREATE TABLE IF NOT EXISTS {table} ("
+        " digest TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " file_code TEXT,"
+        " download_link TEXT NOT NULL,"
+        " filename TEXT,"
+        " created_at REAL NOT NULL,"
+        " backend TEXT NOT NULL DEFAULT 'ddownload',"
+        " PRIMARY KEY (digest, size, backend))" # The same content may be kept by several backends
+    )
+
+    @staticmethod
+    def _keyed_by_backend(conn: sqlite3.Connection) -> bool:
+        return any(row[1] == "backend" and row[5] for row in conn.execute("PRAGMA table_info(uploads)"))
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        """
+        Rebuild an index created before storage backends existed, which is
+        keyed by (digest, size) only: ALTER TABLE cannot change a primary key.
+        Its rows were all DDownload uploads unless they already say otherwise.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._keyed_by_backend(conn): # Another worker got here first
+                conn.rollback()
+                return
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(uploads)")}
+            backend = "backend" if "backend" in columns else "'ddownload'"
+            conn.execute(self._CREATE_TABLE.format(table="uploads_new"))
+            conn.execute(
+                "INSERT INTO uploads_new (digest, size, file_code, download_link, filename, created_at, backend)"
+                f" SELECT digest, size, file_code, download_link, filename, created_at, {backend} FROM uploads"
+            )
+            conn.execute("DROP TABLE uploads")
+            conn.execute("ALTER TABLE uploads_new RENAME TO uploads")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        app_logger.info("Rebuilt the dedup index keyed by storage backend")
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process (connections must not cross a fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL") # Readers don't block the writer
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self._CREATE_TABLE.format(table="uploads"))
+            if not self._keyed_by_backend(conn):
+                self._migrate(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @off_hub
+    def lookup(self, digest: str, size: int, backend: str = "ddownload", max_age: float = None) -> Optional[Dict[str, Any]]:
+        """
+        Find an existing upload with the same content.
+
+        Args:
+            digest: Hex SHA-256 digest of the content.
+            size: Size of the content in bytes.
+            backend: Only match uploads kept by this storage backend.
+            max_age: Ignore entries older than this many seconds (defaults to DEDUP_MAX_AGE).
+
+        Returns:
+            Dict with ``file_code`` and ``download_link``, or None.
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT file_code, download_link, created_at FROM uploads WHERE digest = ? AND size = ? AND backend = ?",
+                (digest.lower(), size, backend),
+            ).fetchone()
+        except sqlite3.Error as e:
+            app_logger.error("Dedup index lookup failed: {}", e)
+            return None
+        if row is None or time.time() - row[2] > (max_age if max_age is not None else settings.DEDUP_MAX_AGE):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"file_code": row[0], "download_link": row[1]}
+
+    @off_hub
+    def record(self, digest: str, size: int, filename: str, result: Dict[str, Any], backend: str = "ddownload") -> None:
+        """Remember the link of a successful upload (replacing any earlier one of the same content and backend)."""
+        if not result.get("download_link"):
+            return
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO uploads (digest, size, file_code, download_link, filename, created_at, backend)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (digest.lower(), size, result.get("file_code"), result["download_link"], filename, time.time(), backend),
+                )
+        except sqlite3.Error as e:
+            app_logger.error("Dedup index update failed: {}", e)
+
+    @off_hub
+    def forget(self, digest: str, size: int, backend: str = "ddownload") -> None:
+        """Drop an entry, e.g. when its link turned out to be dead."""
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "DELETE FROM uploads WHERE digest = ? AND size = ? AND backend = ?", (digest.lower(), size, backend)
+                )
+        except sqlite3.Error as e:
+            app_logger.error("Dedup index delete failed: {}", e)
+
+# Create index instance for use in the application
+dedup_index = DedupIndex()
@@ -0,0 +1,136 @@
+"""
+HTTP client module.
+Owns the long-lived, keep-alive connection pools used to talk to the DDownload
+API and upload servers, so uploads reuse DNS/TCP/TLS setup between requests.
+A requests session serves the WSGI path; aiohttp sessions, one per event
+loop (in practice the ASGI server's long-lived loop), serve the ASGI path.
+"""
+import asyncio
+import atexit
+import os
+import threading
+import time
+from typing import Dict
+from ..config import settings
+from .lazy import lazy_import
+from .logger import app_logger
+
+# Imported on first use: each entry point only ever needs one of them
+aiohttp = lazy_import("aiohttp")
+requests = lazy_import("requests")
+
+class HTTPClientPool:
+    """
+    Process-wide pooled ``requests.Session`` (and ``aiohttp.ClientSession``).
+
+    The session is created lazily and re-created when the process has been
+    forked (gunicorn workers must never share sockets with the master) or when
+    the pool has been idle longer than ``HTTP_POOL_IDLE_TIMEOUT``, since the
+    remote side will have dropped those keep-alive connections by then.
+    """
+
+    def __init__(self):
+        """Initialize an empty pool; connections are opened on first use."""
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._last_used = 0.0
+        self._aio_sessions: Dict[asyncio.AbstractEventLoop, "aiohttp.ClientSession"] = {}
+
+    def _create_session(self) -> "requests.Session":
+        """Build a session whose adapter keeps connections alive per host."""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=settings.HTTP_POOL_CONNECTIONS, # Number of per-host pools to cache
+            pool_maxsize=settings.HTTP_POOL_MAXSIZE, # Connections kept alive per host
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        app_logger.debug("Created HTTP connection pool in process {}", os.getpid())
+        return session
+
+    @property
+    def session(self) -> "requests.Session":
+        """Return the pooled session for the current process."""
+        now = time.monotonic()
+        with self._lock:
+            if self._pid != os.getpid():
+                # Inherited from the parent across fork: drop it without
+                # closing, the sockets still belong to the parent process
+                self._session = None
+            elif self._session is not None and now - self._last_used > settings.HTTP_POOL_IDLE_TIMEOUT:
+                app_logger.debug("HTTP connection pool idle timeout reached; reconnecting.")
+                self._session.close()
+                self._session = None
+
+            if self._session is None:
+                self._session = self._create_session()
+                self._pid = os.getpid()
+            self._last_used = now
+            return self._session
+
+    async def aio_session(self) -> "aiohttp.ClientSession":
+        """
+        Return the pooled aiohttp session for the running event loop.
+
+        Meant for a long-lived loop such as the ASGI server's; a session is
+        tied to the loop it was created on, so each loop gets its own.
+        """
+        loop = asyncio.get_running_loop()
+        session = self._aio_sessions.get(loop)
+        if session is None or session.closed:
+            self._drop_dead_sessions()
+            connector = aiohttp.TCPConnector(
+                limit=settings.HTTP_POOL_LIMIT, # Total connections across all hosts
+                limit_per_host=settings.HTTP_POOL_MAXSIZE,
+                keepalive_timeout=settings.HTTP_POOL_IDLE_TIMEOUT,
+            )
+            session = self._aio_sessions[loop] = aiohttp.ClientSession(connector=connector)
+            app_logger.debug("Created aiohttp connection pool in process {}", os.getpid())
+        return session
+
+    def _drop_dead_sessions(self) -> None:
+        """
+        Forget the sessions of loops that have been closed. Their connections
+        cannot be closed without their loop, so they are detached (the
+        sockets go with the loop) rather than left to warn when collected.
+        """
+        for loop, session in list(self._aio_sessions.items()):
+            if loop.is_closed():
+                session.detach()
+                del self._aio_sessions[loop]
+
+    async def aclose(self) -> None:
+        """Close the aiohttp sessions of every loop (call on ASGI lifespan shutdown)."""
+        running = asyncio.get_running_loop()
+        sessions, self._aio_sessions = self._aio_sessions, {}
+        for loop, session in sessions.items():
+            if session.closed:
+                continue
+            if loop is running:
+                await session.close()
+            elif loop.is_running(): # Another thread's loop: close it there
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+            else:
+                session.detach()
+
+    def reset(self) -> None:
+        """Forget the current sessions (e.g. right after a worker fork)."""
+        with self._lock:
+            self._session = None
+            self._pid = None
+        for session in self._aio_sessions.values():
+            session.detach() # The sockets belong to the parent process
+        self._aio_sessions = {}
+
+    def close(self) -> None:
+        """Close all pooled connections owned by this process."""
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+# Create the shared pool for use in the application
+http_client = HTTPClientPool()
+atexit.register(http_client.close)
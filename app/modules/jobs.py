@@ -0,0 +1,308 @@
+"""
+Upload jobs module.
+Decouples the client request from the DDownload transfer: files are staged
+locally, queued on a bounded per-process worker pool, and their status is
+polled by job id. When the queue is full new uploads are refused with a
+Retry-After hint instead of tying up a worker until the transfer times out.
+
+Job status lives in JSON files in the staging directory, so a status request
+can be answered by any gunicorn worker, not only the one running the job.
+Staged files are recorded in the staging area's ledger until their job has
+finished; the staging reaper fails jobs whose worker died and deletes
+staged files no job owns.
+"""
+import json
+import math
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from ..config import settings
+from .async_runner import async_runner
+from .logger import app_logger
+from .metrics import metrics
+from .ratelimit import SlotLease
+from .staging import StagingReservation, staging_area
+from .uploader import uploader
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+class QueueFullError(Exception):
+    """Raised when the job queue has reached UPLOAD_QUEUE_MAX_DEPTH."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Upload queue is full")
+        self.retry_after = retry_after
+
+
+class UploadJobQueue:
+    """Bounded queue of staged uploads drained by a pool of worker threads."""
+
+    def __init__(self, workers: int = None, max_depth: int = None, jobs_dir=None):
+        """
+        Args:
+            workers: Number of concurrent transfers per process.
+            max_depth: Maximum number of queued (not yet running) jobs.
+            jobs_dir: Directory for staged files and job status files.
+        """
+        self.workers = workers or settings.UPLOAD_JOB_WORKERS
+        self.max_depth = max_depth or settings.UPLOAD_QUEUE_MAX_DEPTH
+        self.jobs_dir = str(jobs_dir or (settings.UPLOAD_STAGING_DIR / "jobs"))
+        self._queue = queue.Queue(maxsize=self.max_depth)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._avg_duration = None # Moving average of job run time, for Retry-After
+        self._leases: Dict[str, SlotLease] = {} # job id -> rate limit slots held until it has finished
+
+    # --- Status storage --- #
+
+    def _status_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def staging_path(self, job_id: str) -> str:
+        """Path a job's file must be staged at before it is submitted."""
+        return os.path.join(self.jobs_dir, f"{job_id}.data")
+
+    @staticmethod
+    def _staging_owner(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    def _list_dir(self) -> List[str]:
+        try:
+            return os.listdir(self.jobs_dir)
+        except FileNotFoundError: # No job staged yet
+            return []
+
+    def _write(self, job: Dict[str, Any]) -> None:
+        """Atomically persist a job's status."""
+        tmp_path = self._status_path(job["job_id"]) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._status_path(job["job_id"]))
+
+    def update(self, job_id: str, **fields) -> None:
+        """Merge fields into a job's persisted status."""
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.update(fields, updated_at=time.time())
+        self._write(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Read a job's status, or None if it is unknown."""
+        if not JOB_ID_RE.match(job_id or ""):
+            return None
+        try:
+            with open(self._status_path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # --- Queue --- #
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker in this process."""
+        return self._queue.qsize()
+
+    def is_full(self) -> bool:
+        return self._queue.full()
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait before trying again."""
+        if self._avg_duration is None:
+            return 5
+        estimate = self._avg_duration * (self.depth + 1) / self.workers
+        return max(1, min(int(math.ceil(estimate)), 300))
+
+    def new_job_id(self) -> str:
+        """New job id; also creates the jobs directory its file is staged into."""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        return uuid.uuid4().hex
+
+    def submit(self, job_id: str, filename: str, keep_file: bool = False,
+               lease: Optional[SlotLease] = None, reservation: Optional[StagingReservation] = None) -> Dict[str, Any]:
+        """
+        Queue a staged file for upload.
+
+        The file must already be at ``staging_path(job_id)``; the queue owns it
+        from here on and deletes it once the job has finished.
+
+        Args:
+            job_id: Id from new_job_id().
+            filename: Original file name.
+            keep_file: Leave the staged file in place if the queue is full, for
+                a caller that moves it back where it came from.
+            lease: Rate limit slots of the submitting request, held until the
+                job has finished (optional).
+            reservation: Staging reservation of the request the file came from;
+                the job takes its share over instead of reserving the file again (optional).
+
+        Raises:
+            QueueFullError: If the queue is at capacity (the staged file is
+                removed unless keep_file is set).
+        """
+        self.start()
+        self.purge_finished()
+        path = self.staging_path(job_id)
+        # Already on disk, so recorded even past the quota; it is freed when the job ends
+        if reservation is not None:
+            reservation.hand_over(self._staging_owner(job_id), os.path.getsize(path), path=path)
+        else:
+            staging_area.reserve(self._staging_owner(job_id), os.path.getsize(path), path=path, force=True)
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "filename": filename,
+            "state": "queued",
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._write(job)
+        if lease is not None:
+            self._leases[job_id] = lease.hold()
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            self._discard(job_id, keep_file=keep_file)
+            raise QueueFullError(self.retry_after())
+        metrics.job_queue_depth.inc()
+        app_logger.info("Queued upload job {} for '{}' (depth {})", job_id, filename, self.depth)
+        return job
+
+    def _discard(self, job_id: str, keep_file: bool = False) -> None:
+        paths = [self._status_path(job_id)]
+        if not keep_file:
+            paths.append(self.staging_path(job_id))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        staging_area.release(self._staging_owner(job_id))
+        self._release_lease(job_id)
+
+    def _release_lease(self, job_id: str) -> None:
+        lease = self._leases.pop(job_id, None)
+        if lease is not None:
+            lease.release()
+
+    # --- Workers --- #
+
+    def start(self) -> None:
+        """Start the worker threads once per process (fork-safe)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Queued job ids and threads inherited across fork are not ours
+            self._queue = queue.Queue(maxsize=self.max_depth)
+            self._leases = {}
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"upload-job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _work(self) -> None:
+        """Worker loop: run queued jobs one at a time."""
+        while True:
+            job_id = self._queue.get()
+            metrics.job_queue_depth.dec()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                app_logger.error("Upload job {} crashed: {}", job_id, e, exc_info=True)
+                self.update(job_id, state="failed", error="An unexpected error occurred during upload")
+            finally:
+                # Only after the final status, or the reaper would take the job for an orphan
+                staging_area.release(self._staging_owner(job_id))
+                self._release_lease(job_id)
+                self._queue.task_done()
+
+    def _run(self, job_id: str) -> None:
+        """Transfer one staged file to DDownload and record the outcome."""
+        job = self.get(job_id)
+        if job is None:
+            return
+        started = time.monotonic()
+        metrics.observe_stage("job_wait", max(0.0, time.time() - job["created_at"]))
+        self.update(job_id, state="running")
+        app_logger.info("Running upload job {} for '{}'", job_id, job['filename'])
+        try:
+            with open(self.staging_path(job_id), "rb") as file_data:
+                # Progress is published under the job id and merged into its status
+                success, result = async_runner.run(uploader.upload_file(file_data, job["filename"], job_id))
+        finally:
+            try:
+                os.remove(self.staging_path(job_id))
+            except FileNotFoundError:
+                pass
+
+        duration = time.monotonic() - started
+        self._avg_duration = duration if self._avg_duration is None else 0.8 * self._avg_duration + 0.2 * duration
+        if success:
+            self.update(job_id, state="done", download_link=result.get("download_link", ""))
+        else:
+            self.update(job_id, state="failed", error=result.get("error", "Unknown upload error"))
+
+    def purge_finished(self) -> int:
+        """Delete status files of jobs finished longer than UPLOAD_JOB_RESULT_TTL ago."""
+        removed = 0
+        cutoff = time.time() - settings.UPLOAD_JOB_RESULT_TTL
+        for name in self._list_dir():
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff and not os.path.exists(path[:-5] + ".data"):
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def purge_orphans(self) -> int:
+        """
+        Fail unfinished jobs that no longer hold a staging reservation (their
+        worker process died, and the reaper deleted their file with it), and
+        delete staged files no job owns once older than STAGING_ORPHAN_GRACE.
+
+        Returns:
+            int: Number of jobs failed plus staged files deleted.
+        """
+        removed = 0
+        cutoff = time.time() - settings.STAGING_ORPHAN_GRACE
+        for name in self._list_dir():
+            job_id, ext = os.path.splitext(name)
+            path = os.path.join(self.jobs_dir, name)
+            if ext == ".json":
+                job = self.get(job_id)
+                if (job is None or job["state"] not in ("queued", "running")
+                        or job["updated_at"] >= cutoff or staging_area.is_reserved(self._staging_owner(job_id))):
+                    continue
+                self.update(job_id, state="failed", error="The upload was interrupted, please try again")
+                app_logger.warning("Failed orphaned upload job {} for '{}'", job_id, job['filename'])
+                removed += 1
+            elif ext == ".data":
+                try:
+                    if os.path.getmtime(path) >= cutoff or staging_area.is_reserved(self._staging_owner(job_id)):
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+                metrics.staging_reaped_files.inc()
+                app_logger.warning("Removed orphaned staged file {}", path)
+                removed += 1
+        return removed
+
+# Create job queue instance for use in the application
+upload_jobs = UploadJobQueue()
+staging_area.add_cleanup(upload_jobs.purge_orphans)
+staging_area.add_cleanup(upload_jobs.purge_finished)
@@ -0,0 +1,44 @@
+"""
+Lazy imports.
+Heavy client libraries (aiohttp, requests) are only needed once the first
+upload is sent, and only one of them per entry point: the WSGI path uses
+requests, the ASGI path aiohttp. Binding them through LazyModule keeps them
+out of ``import app`` and so out of every worker's cold start.
+
+Annotations naming a lazily imported module must be strings, since evaluating
+``aiohttp.ClientSession`` at definition time would import it.
+"""
+import importlib
+import sys
+from types import ModuleType
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def load(self) -> ModuleType:
+        """Import the module now (e.g. in a preloading master before it forks)."""
+        if self._module is None:
+            # import_module is thread-safe and returns the cached module once imported
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None or self._name in sys.modules
+
+    def __getattr__(self, attr: str):
+        value = getattr(self.load(), attr)
+        setattr(self, attr, value) # Later lookups skip __getattr__
+        return value
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}' ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Module ``name`` (dotted names allowed), imported when first used."""
+    return LazyModule(name)
@@ -1,71 +1,262 @@
 """
 Logging module for the application.
 Provides structured logging functionality using Loguru.
+
+With LOG_ASYNC (the default) records are formatted on the calling thread and
+put on a bounded in-memory queue; a background thread writes them to the log
+files, so a request never waits for disk I/O. When the queue is full new
+records are dropped and counted rather than blocking the caller.
 """
 from loguru import logger
-import sys
+import atexit
+import copy
 import os
+import queue
+import sys
+import threading
 from datetime import datetime
 from ..config import settings
+from .metrics import metrics
 
-# Configure main logger
-logger.remove()  # Remove default handlers
+TEXT_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {message}"
+DETAILED_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}"
+
+class QueuedLogWriter:
+    """
+    Bounded queue of formatted log lines drained by a background writer thread.
+
+    The file sinks (with their rotation and retention) live on a private
+    copy of the loguru logger that only the writer thread logs to; the main
+    logger gets lightweight sinks that just enqueue the formatted line.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.dropped = 0
+        self._reported_drops = 0
+        self._writer = copy.deepcopy(logger) # Independent logger, no handlers yet
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def add_file(self, name: str, path, level: str, format: str, **file_options) -> None:
+        """
+        Log records of ``level`` and above to ``path`` through the queue.
+
+        Args:
+            name: Destination name used to route queued lines.
+            path: Log file path (may contain loguru time placeholders).
+            level: Minimum level written to this file.
+            format: Line format (ignored when LOG_JSON is set).
+            **file_options: Passed to loguru's file sink (rotation, retention...).
+        """
+        self._writer.add(
+            path,
+            level=level,
+            format="{message}",
+            filter=lambda record, name=name: record["extra"].get("dest") == name,
+            **file_options
+        )
+        logger.add(self._enqueuer(name), level=level, format=format, serialize=settings.LOG_JSON)
+
+    def remove_files(self) -> None:
+        """Close the file sinks (queued lines are not written out; see close)."""
+        self._writer.remove()
+
+    def _enqueuer(self, name: str):
+        def enqueue(message):
+            self.start()
+            try:
+                self._queue.put_nowait((name, message.record["level"].name, str(message)))
+            except queue.Full:
+                self.dropped += 1
+                metrics.log_messages_dropped.inc()
+        return enqueue
+
+    def start(self) -> None:
+        """Start the writer thread once per process (fork-safe)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A queue inherited across fork may hold a lock taken by a thread
+            # that does not exist in this process
+            self._queue = queue.Queue(maxsize=self.max_size)
+            self._thread = threading.Thread(target=self._drain, name="log-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _drain(self) -> None:
+        """Writer loop: write queued lines until the stop sentinel arrives."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._report_drops()
+                break
+            name, level, line = item
+            self._writer.bind(dest=name).opt(raw=True).log(level, line)
+            if self.dropped != self._reported_drops:
+                self._report_drops()
+
+    def _report_drops(self) -> None:
+        """Note in the main log file how many records were lost since the last note."""
+        lost = self.dropped - self._reported_drops
+        if not lost:
+            return
+        self._reported_drops += lost
+        note = f"{datetime.now():%Y-%m-%d %H:%M:%S} | WARNING  | Dropped {lost} log message(s): logging queue full\n"
+        self._writer.bind(dest="app").opt(raw=True).log("WARNING", note)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write out everything still queued, then stop the writer thread."""
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._pid = None
 
-# Console handler for development
-if settings.DEBUG:
-    logger.add(
-        sys.stderr, 
-        level="DEBUG",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}"
-    )
-
-# File handler for all logs (INFO and above)
-log_file = settings.LOG_DIR / f"app_{datetime.now().strftime('%Y-%m-%d')}.log"
-logger.add(
-    log_file,
-    rotation="1 day",
-    retention="30 days",
-    level="INFO", # Log INFO level and above to the file
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {message} | {extra}"
-)
-
-# Optionally, add a separate file handler for errors
-error_log_file = settings.LOG_DIR / f"error_{datetime.now().strftime('%Y-%m-%d')}.log"
-logger.add(
-    error_log_file,
-    level="ERROR",
-    rotation="1 week",
-    retention="1 month",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}"
-)
 
 class AppLogger:
-    """Application logger wrapper for easy access."""
-    
-    @staticmethod
-    def info(message: str, **kwargs):
+    """
+    Application logger wrapper for easy access.
+
+    Messages can use ``{}`` placeholders filled from positional arguments;
+    they are only formatted when the level is enabled, so hot paths should
+    prefer ``app_logger.debug("Sent {}", value)`` over an f-string.
+    ``exc_info=True`` attaches the current exception's traceback.
+    """
+
+    def __init__(self, min_level: str = "INFO"):
+        self._min_level_no = logger.level(min_level).no
+        self._level_nos = {name: logger.level(name).no for name in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")}
+
+    @property
+    def dropped(self) -> int:
+        """Messages discarded because the logging queue was full."""
+        return log_writer.dropped if log_writer is not None else 0
+
+    def is_enabled(self, level: str) -> bool:
+        return self._level_nos[level] >= self._min_level_no
+
+    def _log(self, level: str, message: str, args, kwargs) -> None:
+        exc_info = kwargs.pop("exc_info", False)
+        if self._level_nos[level] < self._min_level_no:
+            return
+        if _sinks_pid != os.getpid():
+            configure_sinks()
+        # depth=2 attributes the record to the caller rather than this wrapper
+        logger.opt(depth=2, exception=exc_info or None).log(level, message, *args, **kwargs)
+
+    def info(self, message: str, *args, **kwargs):
         """Log info level message."""
-        logger.info(message, **kwargs)
-    
-    @staticmethod
-    def error(message: str, **kwargs):
+        self._log("INFO", message, args, kwargs)
+
+    def error(self, message: str, *args, **kwargs):
         """Log error level message."""
-        logger.error(message, **kwargs)
-    
-    @staticmethod
-    def debug(message: str, **kwargs):
+        self._log("ERROR", message, args, kwargs)
+
+    def debug(self, message: str, *args, **kwargs):
         """Log debug level message."""
-        logger.debug(message, **kwargs)
-    
-    @staticmethod
-    def warning(message: str, **kwargs):
+        self._log("DEBUG", message, args, kwargs)
+
+    def warning(self, message: str, *args, **kwargs):
         """Log warning level message."""
-        logger.warning(message, **kwargs)
-    
-    @staticmethod
-    def critical(message: str, **kwargs):
+        self._log("WARNING", message, args, kwargs)
+
+    def critical(self, message: str, *args, **kwargs):
         """Log critical level message."""
-        logger.critical(message, **kwargs)
+        self._log("CRITICAL", message, args, kwargs)
+
+# No sinks until a process first logs: the files are opened by the process
+# that writes them, never inherited across a fork (see configure_sinks)
+logger.remove()  # Remove default handlers
+
+log_writer = QueuedLogWriter(settings.LOG_QUEUE_SIZE) if settings.LOG_ASYNC else None
+if log_writer is not None:
+    atexit.register(log_writer.close)
+
+_sinks_lock = threading.Lock()
+_sinks_pid = None # Process the sinks were added in
+
+def configure_sinks() -> None:
+    """
+    Add the log file (and debug console) sinks for the current process.
+
+    Called on the first record a process logs, so importing the application
+    opens no files; a forked worker re-adds its own sinks rather than
+    writing through its parent's.
+    """
+    global _sinks_pid
+    if _sinks_pid == os.getpid():
+        return
+    with _sinks_lock:
+        if _sinks_pid == os.getpid():
+            return
+        logger.remove() # Sinks inherited from a parent process
+        os.makedirs(settings.LOG_DIR, exist_ok=True)
+        log_file = settings.LOG_DIR / f"app_{datetime.now().strftime('%Y-%m-%d')}.log"
+        error_log_file = settings.LOG_DIR / f"error_{datetime.now().strftime('%Y-%m-%d')}.log"
+
+        if log_writer is not None:
+            log_writer.remove_files()
+            # File handler for all logs (INFO and above)
+            log_writer.add_file("app", log_file, "INFO", TEXT_FORMAT, rotation="1 day", retention="30 days")
+            # Separate file handler for errors
+            log_writer.add_file("error", error_log_file, "ERROR", DETAILED_FORMAT, rotation="1 week", retention="1 month")
+        else:
+            # File handler for all logs (INFO and above)
+            logger.add(
+                log_file,
+                rotation="1 day",
+                retention="30 days",
+                level="INFO", # Log INFO level and above to the file
+                format=TEXT_FORMAT,
+                serialize=settings.LOG_JSON
+            )
+
+            # Optionally, add a separate file handler for errors
+            logger.add(
+                error_log_file,
+                level="ERROR",
+                rotation="1 week",
+                retention="1 month",
+                format=DETAILED_FORMAT,
+                serialize=settings.LOG_JSON
+            )
+
+        # Console handler for development (added last: the queued writer copies the
+        # logger, and a stderr sink cannot be copied)
+        if settings.DEBUG:
+            logger.add(
+                sys.stderr,
+                level="DEBUG",
+                format=DETAILED_FORMAT,
+                serialize=settings.LOG_JSON
+            )
+        _sinks_pid = os.getpid()
+
+
+def close_sinks() -> None:
+    """
+    Flush and close this process's sinks; the next record adds them again.
+
+    Meant for a process about to fork (the gunicorn master with preload_app),
+    so workers inherit neither open log files nor queued records.
+    """
+    global _sinks_pid
+    with _sinks_lock:
+        if _sinks_pid is None:
+            return
+        if log_writer is not None:
+            log_writer.close()
+            log_writer.remove_files()
+        logger.remove()
+        _sinks_pid = None
 
 # Create app logger instance for use in other modules
-app_logger = AppLogger()
+app_logger = AppLogger("DEBUG" if settings.DEBUG else "INFO")
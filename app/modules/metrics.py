@@ -0,0 +1,221 @@
+"""
+Metrics module.
+Prometheus instrumentation for the upload pipeline: per-stage latency
+histograms, outcome and error counters, bytes sent to DDownload and gauges
+for in-flight uploads and queue depths, served in text format at /metrics.
+
+Under gunicorn every worker has its own counters. When the
+PROMETHEUS_MULTIPROC_DIR environment variable is set (gunicorn.conf.py does
+this) the client library keeps them in memory-mapped files in that directory
+and /metrics aggregates all workers, whichever worker answers the scrape.
+"""
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Seconds; covers a cached server lookup up to a five-minute transfer
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class UploadMetrics:
+    """Metric objects of the upload pipeline plus small recording helpers."""
+
+    def __init__(self):
+        self.stage_duration = Histogram(
+            "upload_stage_duration_seconds",
+            "Time spent in each stage of the upload pipeline",
+            ["stage"],
+            buckets=STAGE_BUCKETS,
+        )
+        self.uploads = Counter(
+            "uploads",
+            "Finished uploads by upload path and outcome",
+            ["mode", "outcome"],
+        )
+        self.storage_uploads = Counter(
+            "storage_uploads",
+            "Finished uploads by storage backend and outcome",
+            ["backend", "outcome"],
+        )
+        self.errors = Counter(
+            "upload_errors",
+            "Failed uploads by error class",
+            ["error_class"],
+        )
+        self.bytes_sent = Counter(
+            "upload_bytes_sent",
+            "Payload bytes forwarded to storage backends (DDownload upload servers, local disk, S3)",
+        )
+        self.server_cache = Counter(
+            "upload_server_cache_lookups",
+            "Upload server assignment cache lookups",
+            ["result"],
+        )
+        self.in_flight = Gauge(
+            "uploads_in_flight",
+            "Uploads currently being processed",
+            multiprocess_mode="livesum",
+        )
+        self.executor_queue_depth = Gauge(
+            "upload_executor_queue_depth",
+            "Blocking upload calls submitted to a thread pool but not yet started",
+            multiprocess_mode="livesum",
+        )
+        self.log_messages_dropped = Counter(
+            "log_messages_dropped",
+            "Log records discarded because the logging queue was full",
+        )
+        self.job_queue_depth = Gauge(
+            "upload_job_queue_depth",
+            "Upload jobs waiting for a worker thread",
+            multiprocess_mode="livesum",
+        )
+        self.retries = Counter(
+            "ddownload_retries",
+            "Retried DDownload calls by operation",
+            ["operation"],
+        )
+        self.hedged_requests = Counter(
+            "ddownload_hedged_requests",
+            "Hedged (duplicate) requests sent, and how many answered first",
+            ["operation", "outcome"],
+        )
+        self.circuit_state = Gauge(
+            "ddownload_circuit_state",
+            "Circuit breaker state per DDownload host (0 closed, 1 half-open, 2 open)",
+            ["host"],
+            multiprocess_mode="livemax",
+        )
+        self.circuit_opened = Counter(
+            "ddownload_circuit_opened",
+            "Times a DDownload host's circuit breaker opened",
+            ["host"],
+        )
+        self.staging_bytes = Gauge(
+            "upload_staging_bytes",
+            "Bytes of upload form files being staged, in memory or spilled to disk",
+            ["kind"],
+            multiprocess_mode="livesum",
+        )
+        self.staging_reserved_bytes = Gauge(
+            "upload_staging_reserved_bytes",
+            "Bytes of the staging quota reserved by all workers",
+            multiprocess_mode="mostrecent",
+        )
+        self.staging_rejected = Counter(
+            "upload_staging_rejected",
+            "Uploads refused for lack of staging space, by reason",
+            ["reason"],
+        )
+        self.staging_reaped_files = Counter(
+            "upload_staging_reaped_files",
+            "Orphaned staged files deleted by the staging reaper",
+        )
+        self.rate_limited = Counter(
+            "rate_limited_requests",
+            "Upload requests rejected with 429 by the exceeded limit",
+            ["reason"],
+        )
+
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        """Record the duration of the enclosed block under ``stage``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_duration.labels(stage).observe(time.perf_counter() - started)
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        self.stage_duration.labels(stage).observe(seconds)
+
+    @contextmanager
+    def track_in_flight(self) -> Iterator[None]:
+        self.in_flight.inc()
+        try:
+            yield
+        finally:
+            self.in_flight.dec()
+
+    def instrument_upload(self, mode: str) -> Callable:
+        """
+        Decorator for the uploader's async orchestrators: tracks in-flight
+        uploads, the end-to-end duration and the outcome of each call.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                with self.track_in_flight():
+                    success, result = await func(*args, **kwargs)
+                self.observe_stage("total", time.perf_counter() - started)
+                self.record_outcome(mode, success, result)
+                return success, result
+            return wrapper
+        return decorator
+
+    def record_outcome(self, mode: str, success: bool, result: Dict[str, Any]) -> None:
+        """
+        Count a finished upload.
+
+        Args:
+            mode: Upload path (``file``, ``stream`` or ``async``).
+            success: Whether the upload succeeded.
+            result: Uploader result dict (``deduplicated`` or ``error`` key).
+        """
+        if success:
+            self.uploads.labels(mode, "deduplicated" if result.get("deduplicated") else "success").inc()
+            return
+        self.uploads.labels(mode, "error").inc()
+        self.errors.labels(classify_error(result.get("error", ""))).inc()
+
+    def render(self) -> Tuple[bytes, str]:
+        """Serialise all metrics (of every worker in multiprocess mode)."""
+        registry = REGISTRY
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def classify_error(error_msg: Optional[str]) -> str:
+    """Map an uploader error message to a low-cardinality error class."""
+    error_msg = error_msg or ""
+    if "circuit open" in error_msg:
+        return "circuit_open"
+    if "timed out" in error_msg:
+        return "timeout"
+    if "network" in error_msg or "Network" in error_msg:
+        return "network"
+    if "API" in error_msg:
+        return "api"
+    if "غير مسموح" in error_msg: # File type not allowed
+        return "validation"
+    if "Invalid upload request body" in error_msg:
+        return "bad_request"
+    return "internal"
+
+
+def error_status(error_msg: Optional[str]) -> int:
+    """HTTP status for a failed upload: 400 when the request was at fault, 500 otherwise."""
+    return 400 if classify_error(error_msg) in ("validation", "bad_request") else 500
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the live gauges of an exited worker (multiprocess mode only)."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
+# Create metrics instance for use in the application
+metrics = UploadMetrics()
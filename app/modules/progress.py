@@ -0,0 +1,213 @@
+"""
+Progress module.
+Tracks how many bytes of an upload have been forwarded to the DDownload
+upload server, so the browser can show the second leg of the transfer
+instead of a progress bar frozen at 100%.
+
+Records are small JSON files in the staging directory, written at most every
+PROGRESS_UPDATE_INTERVAL seconds, so a poll can be answered by any worker.
+"""
+import json
+import os
+import re
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
+from ..config import settings
+from .logger import app_logger
+from .metrics import metrics
+
+PROGRESS_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+class ProgressReporter:
+    """Counts the bytes of one outgoing upload body and publishes them."""
+
+    def __init__(self, tracker: "ProgressTracker", upload_id: Optional[str], total: Optional[int], upload_url: str):
+        self.tracker = tracker
+        self.upload_id = upload_id
+        self.total = total
+        self.host = urlparse(upload_url).hostname or ""
+        self.bytes_sent = 0
+        self.started = time.monotonic()
+        self._last_flush = 0.0
+        self.publish("transferring", force=True)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Average bytes per second since the transfer started."""
+        elapsed = self.elapsed
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def publish(self, phase: str, force: bool = False) -> None:
+        """Write the current state, throttled unless ``force`` is set."""
+        if not self.upload_id:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < settings.PROGRESS_UPDATE_INTERVAL:
+            return
+        self._last_flush = now
+        self.tracker.write(self.upload_id, {
+            "phase": phase,
+            "bytes_sent": self.bytes_sent,
+            "total": self.total,
+            "throughput": round(self.throughput, 1),
+            "host": self.host,
+        })
+
+    def count(self, chunk: bytes) -> bytes:
+        self.add(len(chunk))
+        return chunk
+
+    def add(self, nbytes: int) -> None:
+        """Count bytes moved without passing through Python (e.g. a zero-copy file copy)."""
+        self.bytes_sent += nbytes
+        self.publish("transferring")
+
+    def wrap(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass chunks through unchanged while counting them."""
+        for chunk in chunks:
+            yield self.count(chunk)
+
+    async def awrap(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """Async version of wrap."""
+        async for chunk in chunks:
+            yield self.count(chunk)
+
+    def finish(self, success: bool) -> None:
+        """Publish the final state, record metrics and log the throughput to this upload host."""
+        self.publish("done" if success else "failed", force=True)
+        metrics.observe_stage("transfer", self.elapsed)
+        metrics.bytes_sent.inc(self.bytes_sent)
+        app_logger.info(
+            "Sent {} bytes to {} in {:.2f}s ({:.2f} MB/s, {})",
+            self.bytes_sent, self.host, self.elapsed, self.throughput / (1024 * 1024), "ok" if success else "failed"
+        )
+
+
+class ProgressTracker:
+    """Filesystem-backed store of per-upload progress records."""
+
+    def __init__(self, progress_dir=None):
+        """
+        Args:
+            progress_dir: Directory for progress files (defaults to UPLOAD_STAGING_DIR/progress).
+        """
+        self.progress_dir = str(progress_dir or (settings.UPLOAD_STAGING_DIR / "progress"))
+        self._last_purge = 0.0
+
+    @staticmethod
+    def is_valid_id(upload_id: Optional[str]) -> bool:
+        return bool(upload_id) and bool(PROGRESS_ID_RE.match(upload_id))
+
+    def _path(self, upload_id: str) -> str:
+        return os.path.join(self.progress_dir, f"{upload_id}.json")
+
+    def reporter(self, upload_id: Optional[str], total: Optional[int], upload_url: str) -> ProgressReporter:
+        """
+        Start tracking an outgoing transfer.
+
+        Args:
+            upload_id: Client-supplied id; counting still happens (for logging)
+                when it is missing or invalid, but nothing is published.
+            total: Number of payload bytes expected, if known.
+            upload_url: Upload server URL (its host is recorded).
+        """
+        if time.monotonic() - self._last_purge > 60:
+            self._last_purge = time.monotonic()
+            self.purge_stale()
+        return ProgressReporter(self, upload_id if self.is_valid_id(upload_id) else None, total, upload_url)
+
+    def write(self, upload_id: str, record: Dict[str, Any]) -> None:
+        """Atomically replace an upload's progress record."""
+        record["updated_at"] = time.time()
+        tmp_path = self._path(upload_id) + f".{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.progress_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, self._path(upload_id))
+        except OSError as e:
+            app_logger.warning("Could not write progress for {}: {}", upload_id, e)
+
+    def start_batch(self, batch_id: Optional[str], count: int, total: Optional[int]) -> List[Optional[str]]:
+        """
+        Publish a batch record that aggregates the progress of ``count`` transfers.
+
+        Returns:
+            The progress id for each file of the batch (None when ``batch_id``
+            is missing or invalid, so nothing is published).
+        """
+        item_ids = [f"{batch_id}-{i}" for i in range(count)] if self.is_valid_id(batch_id) else []
+        if not item_ids or not all(self.is_valid_id(item_id) for item_id in item_ids):
+            return [None] * count
+        self.write(batch_id, {"phase": "transferring", "bytes_sent": 0, "total": total, "files": count})
+        return item_ids
+
+    def mark_finished(self, upload_id: Optional[str], success: bool, size: Optional[int]) -> None:
+        """Record the outcome of an upload that finished without a transfer (e.g. a duplicate)."""
+        if not self.is_valid_id(upload_id) or os.path.exists(self._path(upload_id)):
+            return
+        self.write(upload_id, {
+            "phase": "done" if success else "failed",
+            "bytes_sent": size or 0 if success else 0,
+            "total": size,
+            "throughput": 0.0,
+            "host": "",
+        })
+
+    def _read(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(upload_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _aggregate(self, batch_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill a batch record in from the records of its files."""
+        items = [self._read(f"{batch_id}-{i}") for i in range(record["files"])]
+        started = [item for item in items if item is not None]
+        record["bytes_sent"] = sum(item["bytes_sent"] for item in started)
+        record["throughput"] = round(sum(item["throughput"] for item in started if item["phase"] == "transferring"), 1)
+        record["files_done"] = sum(1 for item in started if item["phase"] == "done")
+        record["files_failed"] = sum(1 for item in started if item["phase"] == "failed")
+        if record["files_done"] + record["files_failed"] == record["files"]:
+            record["phase"] = "done" if record["files_done"] else "failed"
+        return record
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Read an upload's progress record, or None if none exists (yet)."""
+        if not self.is_valid_id(upload_id):
+            return None
+        record = self._read(upload_id)
+        if record is None:
+            return None
+        if "files" in record:
+            record = self._aggregate(upload_id, record)
+        total = record.get("total")
+        record["percent"] = min(100, int(record["bytes_sent"] * 100 / total)) if total else None
+        return record
+
+    def purge_stale(self) -> int:
+        """Delete records not updated for PROGRESS_RETENTION seconds."""
+        removed = 0
+        cutoff = time.time() - settings.PROGRESS_RETENTION
+        try:
+            names = os.listdir(self.progress_dir)
+        except FileNotFoundError: # Nothing published yet
+            return 0
+        for name in names:
+            path = os.path.join(self.progress_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+# Create tracker instance for use in the application
+progress_tracker = ProgressTracker()
@@ -0,0 +1,365 @@
+"""
+Rate limiting module.
+Per-client admission control for the upload endpoints: token buckets limit
+each client's upload requests per second and bytes per second, and
+concurrency caps bound the uploads one client, and the whole service, may
+have in flight. The global cap follows from the outbound bandwidth to
+DDownload (UPSTREAM_BANDWIDTH / MIN_UPLOAD_BANDWIDTH), so admitted uploads
+keep a useful share of the link instead of all slowing to a crawl.
+
+State lives in a backend: MemoryBackend keeps it per process, SQLiteBackend
+shares it between all gunicorn workers through a local database.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from ..config import settings
+from .async_runner import off_hub
+from .logger import app_logger
+from .metrics import metrics
+
+GLOBAL_SLOT = "conn:*" # Slot key shared by every client
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is not admitted; carries the seconds to wait."""
+
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(f"Rate limited ({reason}), retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def _take(tokens: float, elapsed: float, rate: float, burst: float, cost: float) -> Tuple[float, float]:
+    """
+    Refill a token bucket and try to take ``cost`` from it.
+
+    A cost larger than the burst is admitted once the bucket is full and
+    leaves it in debt, so one big upload delays the client's next ones
+    rather than being impossible.
+
+    Returns:
+        Tuple[float, float]: New token count, and the seconds to wait (0.0 when admitted).
+    """
+    tokens = min(burst, tokens + elapsed * rate)
+    needed = min(cost, burst)
+    if tokens < needed:
+        return tokens, (needed - tokens) / rate
+    return tokens - cost, 0.0
+
+
+class MemoryBackend:
+    """Limiter state of this process only; each worker enforces the limits on its own."""
+
+    MAX_BUCKETS = 10000 # Buckets kept before refilled (idle) ones are dropped
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float, float]] = {} # key -> (tokens, updated, full at)
+        self._slots: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        """Take ``cost`` tokens from a bucket; returns the seconds to wait (0.0 when admitted)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens, wait = _take(tokens, now - updated, rate, burst, cost)
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        return wait
+
+    def acquire(self, limits: Sequence[Tuple[str, int]]) -> Optional[str]:
+        """
+        Take one slot under each ``(key, limit)``, all or none.
+
+        Returns:
+            Optional[str]: None when admitted, else the key whose limit was reached.
+        """
+        with self._lock:
+            for key, limit in limits:
+                if self._slots.get(key, 0) >= limit:
+                    return key
+            for key, _ in limits:
+                self._slots[key] = self._slots.get(key, 0) + 1
+        return None
+
+    def release(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            for key in keys:
+                count = self._slots.get(key, 0) - 1
+                if count > 0:
+                    self._slots[key] = count
+                else:
+                    self._slots.pop(key, None)
+
+    def forget_process(self, pid: int) -> None:
+        """Nothing to do: the state died with the process."""
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._slots.clear()
+
+
+class SQLiteBackend:
+    """
+    Limiter state shared by all worker processes through a local SQLite database.
+
+    Slots are counted per process, so the slots of a worker that died can be
+    dropped with forget_process. Database errors admit the request (fail
+    open): a broken limiter must not take uploads down with it.
+    """
+
+    PRUNE_EVERY = 1000 # Bucket updates between deletions of refilled buckets
+
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path: Path of the SQLite database (defaults to RATE_LIMIT_DB_PATH).
+        """
+        self.db_path = str(db_path or settings.RATE_LIMIT_DB_PATH)
+        self._local = threading.local()
+        self._updates = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process (connections must not cross a fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None) # Transactions are explicit
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF") # Losing limiter state in a crash is harmless
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated REAL NOT NULL,"
+                " full_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS slots ("
+                " key TEXT NOT NULL,"
+                " pid INTEGER NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " PRIMARY KEY (key, pid))"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction, taken up front so concurrent read-modify-writes serialise."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @off_hub
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        """Take ``cost`` tokens from a bucket; returns the seconds to wait (0.0 when admitted)."""
+        now = time.time() # Wall clock: shared between processes
+        try:
+            with self._transaction() as conn:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (burst, now)
+                tokens, wait = _take(tokens, max(0.0, now - updated), rate, burst, cost)
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                    (key, tokens, now, now + (burst - tokens) / rate),
+                )
+                self._updates += 1
+                if self._updates % self.PRUNE_EVERY == 0:
+                    conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+        except sqlite3.Error as e:
+            app_logger.error("Rate limit bucket update failed: {}", e)
+            return 0.0
+        return wait
+
+    @off_hub
+    def acquire(self, limits: Sequence[Tuple[str, int]]) -> Optional[str]:
+        """
+        Take one slot under each ``(key, limit)``, all or none.
+
+        Returns:
+            Optional[str]: None when admitted, else the key whose limit was reached.
+        """
+        pid = os.getpid()
+        try:
+            with self._transaction() as conn:
+                for key, limit in limits:
+                    (count,) = conn.execute("SELECT COALESCE(SUM(count), 0) FROM slots WHERE key = ?", (key,)).fetchone()
+                    if count >= limit:
+                        return key
+                for key, _ in limits:
+                    conn.execute(
+                        "INSERT INTO slots (key, pid, count) VALUES (?, ?, 1)"
+                        " ON CONFLICT (key, pid) DO UPDATE SET count = count + 1",
+                        (key, pid),
+                    )
+        except sqlite3.Error as e:
+            app_logger.error("Rate limit slot update failed: {}", e)
+        return None
+
+    @off_hub
+    def release(self, keys: Sequence[str]) -> None:
+        pid = os.getpid()
+        try:
+            with self._transaction() as conn:
+                for key in keys:
+                    conn.execute("UPDATE slots SET count = count - 1 WHERE key = ? AND pid = ?", (key, pid))
+                conn.execute("DELETE FROM slots WHERE count <= 0")
+        except sqlite3.Error as e:
+            app_logger.error("Rate limit slot release failed: {}", e)
+
+    @off_hub
+    def forget_process(self, pid: int) -> None:
+        """Drop the slots still held by an exited worker."""
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM slots WHERE pid = ?", (pid,))
+        except sqlite3.Error as e:
+            app_logger.error("Rate limit cleanup for worker {} failed: {}", pid, e)
+
+    @off_hub
+    def reset(self) -> None:
+        """Start from empty buckets and no held slots (e.g. on server start)."""
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM buckets")
+                conn.execute("DELETE FROM slots")
+        except sqlite3.Error as e:
+            app_logger.error("Rate limit reset failed: {}", e)
+
+
+class RateLimiter:
+    """Admission control for upload requests, keyed by client address."""
+
+    def __init__(self, backend=None):
+        """
+        Args:
+            backend: MemoryBackend or SQLiteBackend (defaults to RATE_LIMIT_BACKEND).
+        """
+        if backend is None:
+            backend = SQLiteBackend() if settings.RATE_LIMIT_BACKEND == "sqlite" else MemoryBackend()
+        self.backend = backend
+
+    @staticmethod
+    def client_key(remote_addr: Optional[str], forwarded_for: Optional[str] = None) -> str:
+        """
+        Identify the client of a request.
+
+        Behind a reverse proxy (RATE_LIMIT_TRUST_PROXY) the last X-Forwarded-For
+        entry is used: it is the address the proxy itself saw, whereas earlier
+        entries are whatever the client chose to send.
+        """
+        if settings.RATE_LIMIT_TRUST_PROXY and forwarded_for:
+            return forwarded_for.rsplit(",", 1)[-1].strip()
+        return remote_addr or "unknown"
+
+    @staticmethod
+    def global_concurrency() -> int:
+        """Uploads the upstream link can carry at MIN_UPLOAD_BANDWIDTH each (0 = no global cap)."""
+        if settings.UPSTREAM_BANDWIDTH <= 0:
+            return 0
+        return max(1, settings.UPSTREAM_BANDWIDTH // settings.MIN_UPLOAD_BANDWIDTH)
+
+    def _slot_limits(self, client: str) -> List[Tuple[str, int]]:
+        limits = []
+        if settings.RATE_LIMIT_CLIENT_CONCURRENCY > 0:
+            limits.append((f"conn:{client}", settings.RATE_LIMIT_CLIENT_CONCURRENCY))
+        if self.global_concurrency():
+            limits.append((GLOBAL_SLOT, self.global_concurrency()))
+        return limits
+
+    def admit(self, client: str, nbytes: int = 0, requests: int = 1, concurrent: bool = False) -> None:
+        """
+        Admit a request or raise RateLimitExceeded.
+
+        Args:
+            client: Client key (see client_key).
+            nbytes: Body size charged to the client's byte bucket.
+            requests: Cost charged to the client's request bucket.
+            concurrent: Also take a concurrency slot; the caller must call
+                release(client) once the request has finished.
+        """
+        limits = self._slot_limits(client) if concurrent else []
+        if limits:
+            refused = self.backend.acquire(limits)
+            if refused is not None:
+                reason = "global_concurrency" if refused == GLOBAL_SLOT else "client_concurrency"
+                self._reject(client, reason, settings.RATE_LIMIT_BUSY_RETRY_AFTER)
+        try:
+            if requests and settings.RATE_LIMIT_REQUESTS_PER_SEC > 0:
+                wait = self.backend.take(f"req:{client}", settings.RATE_LIMIT_REQUESTS_PER_SEC,
+                                         settings.RATE_LIMIT_REQUEST_BURST, requests)
+                if wait:
+                    self._reject(client, "requests", wait)
+            if nbytes and settings.RATE_LIMIT_BYTES_PER_SEC > 0:
+                wait = self.backend.take(f"bytes:{client}", settings.RATE_LIMIT_BYTES_PER_SEC,
+                                         settings.RATE_LIMIT_BYTE_BURST, nbytes)
+                if wait:
+                    self._reject(client, "bytes", wait)
+        except RateLimitExceeded:
+            if limits:
+                self.backend.release([key for key, _ in limits])
+            raise
+
+    def release(self, client: str) -> None:
+        """Give back the concurrency slots taken by admit(..., concurrent=True)."""
+        limits = self._slot_limits(client)
+        if limits:
+            self.backend.release([key for key, _ in limits])
+
+    def lease(self, client: str) -> "SlotLease":
+        """Lease of the slots taken by admit(..., concurrent=True), for work outliving the request."""
+        return SlotLease(self, client)
+
+    @staticmethod
+    def requires_length(content_length: Optional[int], chunked: bool) -> bool:
+        """
+        Whether a request body must declare its length to be admitted: bytes
+        are charged from Content-Length, so a chunked body would bypass the
+        byte limit.
+        """
+        return chunked and content_length is None and settings.RATE_LIMIT_BYTES_PER_SEC > 0
+
+    def _reject(self, client: str, reason: str, retry_after: float) -> None:
+        metrics.rate_limited.labels(reason).inc()
+        app_logger.warning("Rate limited {} ({}); retry after {:.1f}s", client, reason, retry_after)
+        raise RateLimitExceeded(retry_after, reason)
+
+class SlotLease:
+    """
+    Concurrency slots of one admitted request, shared with the work it hands
+    on (such as upload jobs); released once every holder has let go.
+    """
+
+    def __init__(self, limiter: RateLimiter, client: str):
+        self._limiter = limiter
+        self._client = client
+        self._holders = 1 # The request itself
+        self._lock = threading.Lock()
+
+    def hold(self) -> "SlotLease":
+        """Add a holder; each must call release() once."""
+        with self._lock:
+            self._holders += 1
+        return self
+
+    def release(self) -> None:
+        with self._lock:
+            self._holders -= 1
+            if self._holders:
+                return
+        self._limiter.release(self._client)
+
+# Create rate limiter instance for use in the application
+rate_limiter = RateLimiter()
@@ -0,0 +1,303 @@
+"""
+Resilience module.
+Retry with exponential backoff, hedged requests and per-host circuit
+breakers for calls to DDownload, so a failing or slow host costs a few fast
+failures instead of a full timeout on every request.
+
+Calls keep the uploader's ``(success, result)`` convention; a failed result
+carrying ``"retryable": True`` (network errors, timeouts, 5xx answers) is
+what the retry policy and the breakers treat as a transient failure. Upload
+POSTs are not idempotent, so they are only sent again when the result also
+carries ``"resendable": True``: the request never reached the host.
+"""
+import asyncio
+import math
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+from ..config import settings
+from .logger import app_logger
+from .metrics import metrics
+
+Result = Tuple[bool, Dict[str, Any]]
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    Whether a requests/aiohttp exception is worth retrying: anything without
+    an HTTP status (connection errors, timeouts), 5xx answers and 429.
+    """
+    status = getattr(exc, "status", None) # aiohttp.ClientResponseError
+    response = getattr(exc, "response", None) # requests.HTTPError
+    if status is None and response is not None:
+        status = response.status_code
+    return status is None or status >= 500 or status == 429
+
+
+def is_retryable(result: Dict[str, Any]) -> bool:
+    return bool(result.get("retryable"))
+
+
+def _loaded_class(module: str, name: str):
+    """``module.name`` if the module has been imported, else None (never imports it)."""
+    return getattr(sys.modules.get(module), name, None)
+
+
+def was_not_sent(exc: BaseException) -> bool:
+    """
+    Whether a requests/aiohttp exception shows the request was never
+    processed, so even a non-idempotent call can be sent again: the
+    connection could not be established, or the host answered 429.
+    Read timeouts, dropped connections and 5xx answers are ambiguous.
+    """
+    status = getattr(exc, "status", None)
+    response = getattr(exc, "response", None)
+    if status is None and response is not None:
+        status = response.status_code
+    if status == 429:
+        return True
+    connect_errors = tuple(filter(None, (
+        _loaded_class("requests.exceptions", "ConnectTimeout"),
+        _loaded_class("aiohttp", "ClientConnectorError"),
+    )))
+    if connect_errors and isinstance(exc, connect_errors):
+        return True
+    # requests reports a refused connection as ConnectionError(MaxRetryError(reason=NewConnectionError))
+    new_connection_error = _loaded_class("urllib3.exceptions", "NewConnectionError")
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return new_connection_error is not None and isinstance(reason, new_connection_error)
+
+
+def is_resendable(result: Dict[str, Any]) -> bool:
+    return bool(result.get("resendable"))
+
+
+def host_of(url: Optional[str]) -> str:
+    """Breaker key of a URL: its host, plus the port if one is given."""
+    return urlparse(url or "").netloc
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter for idempotent calls."""
+
+    def __init__(self, attempts: int = None, base_delay: float = None, max_delay: float = None):
+        """
+        Args:
+            attempts: Total tries, including the first.
+            base_delay: Upper bound of the first backoff, in seconds.
+            max_delay: Cap on any single backoff, in seconds.
+        """
+        self.attempts = max(1, attempts if attempts is not None else settings.API_RETRY_ATTEMPTS)
+        self.base_delay = base_delay if base_delay is not None else settings.RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else settings.RETRY_MAX_DELAY
+
+    def backoff(self, retry: int) -> float:
+        """Seconds to wait before retry number ``retry`` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+    def call(self, operation: str, func: Callable[..., Result], *args) -> Result:
+        """Call ``func`` until it succeeds, fails permanently or runs out of attempts (blocking)."""
+        for attempt in range(1, self.attempts + 1):
+            success, result = func(*args)
+            if success or not is_retryable(result) or attempt == self.attempts:
+                return success, result
+            self.record_retry(operation, attempt, result)
+            time.sleep(self.backoff(attempt))
+
+    async def acall(self, operation: str, func: Callable[..., Awaitable[Result]], *args) -> Result:
+        """Async version of call."""
+        for attempt in range(1, self.attempts + 1):
+            success, result = await func(*args)
+            if success or not is_retryable(result) or attempt == self.attempts:
+                return success, result
+            self.record_retry(operation, attempt, result)
+            await asyncio.sleep(self.backoff(attempt))
+
+    def record_retry(self, operation: str, attempt: int, result: Dict[str, Any]) -> None:
+        """Count and log a retry after failed attempt number ``attempt``."""
+        metrics.retries.labels(operation).inc()
+        app_logger.warning("Retrying {} after attempt {}/{} failed: {}", operation, attempt, self.attempts, result.get('error'))
+
+
+class LatencyWindow:
+    """Latencies of the most recent calls, for percentile estimates."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        """Nearest-rank percentile of the window (0.0 when empty)."""
+        ordered = sorted(self._samples)
+        if not ordered:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+
+class Hedger:
+    """
+    Hedged requests: when a call has not answered within the given latency
+    percentile of recent calls, a second identical call is sent and the
+    first successful answer wins. Only for idempotent calls.
+    """
+
+    MIN_SAMPLES = 20 # Lookups timed before the percentile is trusted
+
+    def __init__(self, operation: str, percentile: float = None, min_delay: float = None, initial_delay: float = None):
+        self.operation = operation
+        self.percentile = percentile if percentile is not None else settings.HEDGE_PERCENTILE
+        self.min_delay = min_delay if min_delay is not None else settings.HEDGE_MIN_DELAY
+        self.initial_delay = initial_delay if initial_delay is not None else settings.HEDGE_INITIAL_DELAY
+        self.latencies = LatencyWindow()
+
+    def delay(self) -> float:
+        """Seconds to wait for the first call before hedging."""
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return self.initial_delay
+        return max(self.min_delay, self.latencies.percentile(self.percentile))
+
+    async def call(self, func: Callable[[], Awaitable[Result]]) -> Result:
+        """Run ``func``, hedging it once if it is slow; returns the first success (or the last failure)."""
+        started = time.perf_counter()
+        first = asyncio.ensure_future(func())
+        pending = {first}
+        done, _ = await asyncio.wait(pending, timeout=self.delay())
+        hedge = None
+        if not done:
+            hedge = asyncio.ensure_future(func())
+            pending.add(hedge)
+            metrics.hedged_requests.labels(self.operation, "sent").inc()
+            app_logger.debug("Hedging slow {} after {:.3f}s", self.operation, time.perf_counter() - started)
+
+        success, result, winner = False, {}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    success, result = task.result()
+                    winner = task
+                    if success:
+                        break
+                if success:
+                    break
+        finally:
+            for task in pending:
+                task.cancel() # The loser's answer is discarded
+
+        if success:
+            self.latencies.add(time.perf_counter() - started)
+            if winner is hedge:
+                metrics.hedged_requests.labels(self.operation, "won").inc()
+        return success, result
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    After ``failure_threshold`` consecutive transient failures the circuit
+    opens and calls fail fast for ``reset_timeout`` seconds; then a single
+    trial call is let through (half-open), whose outcome closes or re-opens it.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _GAUGE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, host: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.host = host
+        self.failure_threshold = failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout if reset_timeout is not None else settings.CIRCUIT_RESET_TIMEOUT
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None # Monotonic start of the half-open trial call
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call to this host may go ahead now."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state != self.HALF_OPEN:
+                return False
+            # One trial at a time; a trial that never reported back is replaced
+            now = time.monotonic()
+            if self._trial_started is None or now - self._trial_started >= self.reset_timeout:
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial_started = None
+            if self.state != self.CLOSED:
+                app_logger.info("Circuit for {} closed", self.host)
+                self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_started = None
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+                metrics.circuit_opened.labels(self.host).inc()
+                app_logger.warning("Circuit for {} opened after {} consecutive failure(s)", self.host, self.failures)
+
+    def _set_state(self, state: str) -> None:
+        """Change state. Caller must hold the lock."""
+        self.state = state
+        metrics.circuit_state.labels(self.host).set(self._GAUGE_VALUES[state])
+
+
+class CircuitBreakers:
+    """Registry of circuit breakers keyed by host name."""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> CircuitBreaker:
+        host = host_of(url)
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(host)
+            return breaker
+
+    def allow(self, url: str) -> bool:
+        return self.get(url).allow()
+
+    def record(self, url: str, success: bool, result: Dict[str, Any]) -> None:
+        """Feed a call's outcome to its host's breaker; only transient failures count against it."""
+        breaker = self.get(url)
+        if success or not is_retryable(result):
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        """Breaker state per host for this worker process."""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.host: {"state": b.state, "failures": b.failures} for b in breakers}
+
+
+def circuit_open_error(url: str) -> Dict[str, Any]:
+    """Uploader error result for a call refused by an open circuit."""
+    return {"error": f"DDownload host unavailable (circuit open): {host_of(url)}"}
+
+# Create circuit breaker registry for use in the application
+circuit_breakers = CircuitBreakers()
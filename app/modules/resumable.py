@@ -0,0 +1,363 @@
+"""
+Resumable upload module.
+Implements the server side of a tus-style chunked upload protocol: a session
+is created with the final file size, chunks are appended at the current
+offset, and the assembled file is handed to the uploader once complete.
+
+Parallel sessions accept their fixed-size chunks in any order and several at
+a time: the data file is preallocated and each chunk is written at its own
+position, with a one-byte-per-chunk map recording which chunks are complete.
+
+State lives in the staging directory (one data file plus one JSON metadata
+file per session), so any gunicorn worker can serve any chunk. A session
+reserves its full size in the staging area's ledger when it is created and
+gives it back when it is discarded.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, Optional
+from ..config import settings
+from .logger import app_logger
+from .staging import staging_area
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+class ResumableUploadError(Exception):
+    """Protocol error with the HTTP status code it should be reported as."""
+
+    def __init__(self, message: str, status_code: int = 400, offset: int = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ResumableUploadStore:
+    """Filesystem-backed store of in-progress resumable uploads."""
+
+    def __init__(self, staging_dir=None):
+        """
+        Args:
+            staging_dir: Directory for session files (defaults to UPLOAD_STAGING_DIR/resumable).
+        """
+        self.staging_dir = staging_dir or (settings.UPLOAD_STAGING_DIR / "resumable")
+
+    @staticmethod
+    def _staging_owner(upload_id: str) -> str:
+        return f"resumable:{upload_id}"
+
+    def _data_path(self, upload_id: str) -> str:
+        return os.path.join(self.staging_dir, f"{upload_id}.part")
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.staging_dir, f"{upload_id}.json")
+
+    def _chunk_map_path(self, upload_id: str) -> str:
+        return os.path.join(self.staging_dir, f"{upload_id}.chunks")
+
+    def _write_meta(self, meta: Dict[str, Any]) -> None:
+        """Atomically replace the metadata file of a session."""
+        tmp_path = self._meta_path(meta["upload_id"]) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(meta["upload_id"]))
+
+    def create(self, filename: str, size: int, parallel: bool = False) -> Dict[str, Any]:
+        """
+        Start a new upload session.
+
+        Args:
+            filename: Secured name of the file being uploaded.
+            size: Total size of the file in bytes.
+            parallel: Accept RESUMABLE_CHUNK_SIZE chunks in any order (write_chunk)
+                instead of appends at the current offset.
+
+        Returns:
+            Dict: Session metadata including ``upload_id`` and ``offset``.
+
+        Raises:
+            ResumableUploadError: If the size is invalid or too large.
+            StagingQuotaExceeded: If the staging area cannot take ``size`` more bytes.
+        """
+        if size <= 0:
+            raise ResumableUploadError("Invalid upload size", 400)
+        if size > settings.RESUMABLE_MAX_FILE_SIZE:
+            raise ResumableUploadError("File too large", 413)
+
+        self.purge_expired()
+        now = time.time()
+        meta = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": filename,
+            "size": size,
+            "created_at": now,
+        }
+        # Sessions outlive the worker that created them, so the reservation is not process-bound
+        staging_area.reserve(self._staging_owner(meta["upload_id"]), size,
+                             path=self._data_path(meta["upload_id"]), process_bound=False)
+        try:
+            with staging_area.disk_errors():
+                os.makedirs(self.staging_dir, exist_ok=True)
+                # Create the data file first so the session is never half-visible
+                if parallel:
+                    meta.update(parallel=True, chunk_size=settings.RESUMABLE_CHUNK_SIZE)
+                    self._preallocate(meta["upload_id"], size)
+                    with open(self._chunk_map_path(meta["upload_id"]), "wb") as f:
+                        f.write(bytes(self._chunk_count(meta)))
+                else:
+                    open(self._data_path(meta["upload_id"]), "wb").close()
+                self._write_meta(meta)
+        except Exception:
+            self.discard(meta["upload_id"])
+            raise
+        app_logger.info("Created resumable upload {} for '{}' ({} bytes)", meta['upload_id'], filename, size)
+        if parallel:
+            return dict(meta, offset=0, missing=list(range(self._chunk_count(meta))))
+        return dict(meta, offset=0)
+
+    def _preallocate(self, upload_id: str, size: int) -> None:
+        """Reserve the full size of a parallel session's data file up front."""
+        fd = os.open(self._data_path(upload_id), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size) # Fails early when the disk is full
+            else:
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _chunk_count(meta: Dict[str, Any]) -> int:
+        return -(-meta["size"] // meta["chunk_size"])
+
+    @staticmethod
+    def chunk_range(meta: Dict[str, Any], index: int) -> Optional[range]:
+        """Byte range of chunk ``index`` of a parallel session (None if out of range)."""
+        start = index * meta["chunk_size"]
+        if index < 0 or start >= meta["size"]:
+            return None
+        return range(start, min(start + meta["chunk_size"], meta["size"]))
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a session; the current offset is the size of its data file.
+
+        Returns:
+            Dict: Session metadata with ``offset``, or None if unknown/expired.
+        """
+        if not UPLOAD_ID_RE.match(upload_id or ""):
+            return None
+        try:
+            with open(self._meta_path(upload_id), encoding="utf-8") as f:
+                meta = json.load(f)
+            stat = os.stat(self._data_path(upload_id))
+        except (OSError, ValueError):
+            return None
+        # Sessions expire after a period without any chunk being written
+        if time.time() - stat.st_mtime > settings.RESUMABLE_EXPIRY:
+            self.discard(upload_id)
+            return None
+        if not meta.get("parallel"):
+            meta["offset"] = stat.st_size
+            return meta
+        # Parallel sessions: the offset is the complete prefix, so a session
+        # is finished exactly when offset == size, as for sequential ones
+        try:
+            with open(self._chunk_map_path(upload_id), "rb") as f:
+                received = f.read()
+        except OSError:
+            return None
+        meta["missing"] = [i for i, done in enumerate(received) if not done]
+        first_missing = meta["missing"][0] if meta["missing"] else len(received)
+        meta["offset"] = min(first_missing * meta["chunk_size"], meta["size"])
+        return meta
+
+    def append(self, upload_id: str, offset: int, stream, length: Optional[int] = None) -> int:
+        """
+        Append a chunk read from ``stream`` at ``offset``.
+
+        The chunk is copied from the request stream straight into the
+        session's data file through a single reusable buffer; chunks are never
+        stored separately, so there is no assembly step at the end.
+
+        Args:
+            upload_id: Session identifier.
+            offset: Offset the client believes the chunk starts at.
+            stream: Readable binary stream with the chunk payload.
+            length: Declared chunk length (Content-Length), if known.
+
+        Returns:
+            int: The new offset after the write.
+
+        Raises:
+            ResumableUploadError: On unknown sessions, offset mismatch or overflow.
+        """
+        meta = self.get(upload_id)
+        if meta is None:
+            raise ResumableUploadError("Upload not found", 404)
+        if meta.get("parallel"):
+            raise ResumableUploadError("Parallel uploads take numbered chunks", 400)
+
+        fd = os.open(self._data_path(upload_id), os.O_WRONLY | os.O_APPEND)
+        try:
+            # Serialise writers of the same session across workers
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            current = os.fstat(fd).st_size
+            if offset != current:
+                raise ResumableUploadError("Offset mismatch", 409, offset=current)
+            remaining = meta["size"] - current
+            if length is not None and length > remaining:
+                raise ResumableUploadError("Chunk exceeds declared upload size", 400, offset=current)
+
+            buf = bytearray(min(settings.STREAM_CHUNK_SIZE, max(remaining, 1)))
+            view = memoryview(buf)
+            readinto = getattr(stream, "readinto", None)
+            written = 0
+            try:
+                while written <= remaining:
+                    if readinto is not None:
+                        n = readinto(buf)
+                    else:
+                        data = stream.read(len(buf))
+                        n = len(data)
+                        buf[:n] = data
+                    if not n:
+                        break
+                    if written + n > remaining:
+                        raise ResumableUploadError("Chunk exceeds declared upload size", 400, offset=current + written)
+                    os.write(fd, view[:n])
+                    written += n
+            except ResumableUploadError:
+                raise
+            except Exception as e:
+                # Client went away mid-chunk: keep what arrived, the client
+                # resumes from the offset reported by the status endpoint
+                app_logger.warning("Chunk for upload {} interrupted after {} bytes: {}", upload_id, written, e)
+            return current + written
+        finally:
+            os.close(fd)
+
+    def write_chunk(self, upload_id: str, index: int, stream, length: Optional[int] = None,
+                    sha256: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Write chunk ``index`` of a parallel session at its position in the data file.
+
+        Chunks may arrive in any order, concurrently and more than once; a
+        chunk only counts as received once all its bytes were written (and
+        matched ``sha256``, if given), so a failed one is simply sent again.
+
+        Args:
+            upload_id: Session identifier.
+            index: Chunk number; chunk ``i`` covers bytes ``i * chunk_size`` onwards.
+            stream: Readable binary stream with the chunk payload.
+            length: Declared chunk length (Content-Length), if known.
+            sha256: Hex SHA-256 digest the client computed for the chunk.
+
+        Returns:
+            Dict: The session metadata after the write (``offset``, ``missing``).
+
+        Raises:
+            ResumableUploadError: On unknown sessions, bad chunk numbers or
+                lengths, incomplete chunks and checksum mismatches (460).
+        """
+        meta = self.get(upload_id)
+        if meta is None:
+            raise ResumableUploadError("Upload not found", 404)
+        span = self.chunk_range(meta, index) if meta.get("parallel") else None
+        if span is None:
+            raise ResumableUploadError("Invalid chunk number", 400)
+        expected = len(span)
+        if length is not None and length != expected:
+            raise ResumableUploadError(f"Chunk {index} must be {expected} bytes", 400)
+
+        hasher = hashlib.sha256() if sha256 else None
+        buf = bytearray(min(settings.STREAM_CHUNK_SIZE, expected))
+        view = memoryview(buf)
+        readinto = getattr(stream, "readinto", None)
+        written = 0
+        fd = os.open(self._data_path(upload_id), os.O_WRONLY)
+        try:
+            while written < expected:
+                if readinto is not None:
+                    n = readinto(view[:min(len(buf), expected - written)])
+                else:
+                    data = stream.read(min(len(buf), expected - written))
+                    n = len(data)
+                    buf[:n] = data
+                if not n:
+                    break
+                os.pwrite(fd, view[:n], span.start + written) # Positional: no shared file offset
+                if hasher is not None:
+                    hasher.update(view[:n])
+                written += n
+        except Exception as e:
+            app_logger.warning("Chunk {} of upload {} interrupted after {} bytes: {}", index, upload_id, written, e)
+        finally:
+            os.close(fd)
+
+        if written != expected:
+            raise ResumableUploadError(f"Chunk {index} incomplete ({written} of {expected} bytes)", 400)
+        if hasher is not None and hasher.hexdigest() != sha256.lower():
+            raise ResumableUploadError(f"Chunk {index} checksum mismatch", 460)
+        self._mark_received(upload_id, index)
+        return self.get(upload_id) or meta
+
+    def _mark_received(self, upload_id: str, index: int) -> None:
+        """Flag a chunk as complete (a one-byte positional write, safe across workers)."""
+        fd = os.open(self._chunk_map_path(upload_id), os.O_WRONLY)
+        try:
+            os.pwrite(fd, b"\x01", index)
+        finally:
+            os.close(fd)
+
+    def open_data(self, upload_id: str):
+        """Open the assembled data file of a session for reading."""
+        return open(self._data_path(upload_id), "rb")
+
+    def move_data(self, upload_id: str, destination: str) -> None:
+        """Move the assembled data file elsewhere in the staging area (no copy)."""
+        os.replace(self._data_path(upload_id), destination)
+
+    def restore_data(self, upload_id: str, source: str) -> None:
+        """Move data taken with move_data() back into its session."""
+        os.replace(source, self._data_path(upload_id))
+
+    def discard(self, upload_id: str) -> None:
+        """Delete all files of a session."""
+        for path in (self._data_path(upload_id), self._meta_path(upload_id), self._chunk_map_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        staging_area.release(self._staging_owner(upload_id))
+
+    def purge_expired(self) -> int:
+        """Delete sessions idle longer than RESUMABLE_EXPIRY; returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - settings.RESUMABLE_EXPIRY
+        try:
+            names = os.listdir(self.staging_dir)
+        except FileNotFoundError: # No session created yet
+            return 0
+        for name in names:
+            if not name.endswith(".part"):
+                continue
+            upload_id = name[:-5]
+            try:
+                if os.path.getmtime(os.path.join(self.staging_dir, name)) < cutoff:
+                    self.discard(upload_id)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            app_logger.info("Purged {} expired resumable upload(s)", removed)
+        return removed
+
+# Create store instance for use in the application
+resumable_store = ResumableUploadStore()
+staging_area.add_cleanup(resumable_store.purge_expired)
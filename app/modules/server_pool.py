@@ -0,0 +1,158 @@
+"""
+Upload server pool module.
+Caches upload server assignments (``upload_url``/``sess_id`` pairs) returned
+by DDownload's /upload/server endpoint and keeps a few of them warm in the
+background, so the lookup round trip is off the critical path of an upload.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+from ..config import settings
+from .logger import app_logger
+
+class UploadServerPool:
+    """
+    TTL cache of upload server assignments with a background prefetcher.
+
+    Assignments are shared: ``get`` hands out cached entries round-robin and
+    leaves them in the pool until they expire or are evicted after the
+    upload server rejects them.
+    """
+
+    def __init__(self, fetch: Callable[[], Tuple[bool, Dict[str, Any]]],
+                 size: int = None, ttl: float = None, refresh_interval: float = None):
+        """
+        Args:
+            fetch: Blocking callable returning ``(success, server_info)``.
+            size: Number of assignments to keep warm.
+            ttl: Seconds an assignment stays valid after it was fetched.
+            refresh_interval: Seconds between prefetcher passes.
+        """
+        self._fetch = fetch
+        self.size = size if size is not None else settings.UPLOAD_SERVER_POOL_SIZE
+        self.ttl = ttl if ttl is not None else settings.UPLOAD_SERVER_TTL
+        self.refresh_interval = refresh_interval if refresh_interval is not None else settings.UPLOAD_SERVER_REFRESH_INTERVAL
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetches = 0
+
+    def _is_fresh(self, entry: Dict[str, Any], now: float) -> bool:
+        """Check whether an assignment is still within its TTL."""
+        return now - entry["fetched_at"] < self.ttl
+
+    def _purge_expired(self, now: float) -> None:
+        """Drop expired assignments. Caller must hold the lock."""
+        self._entries = deque(e for e in self._entries if self._is_fresh(e, now))
+
+    def get(self) -> Optional[Dict[str, Any]]:
+        """
+        Return a cached assignment, or None on a cache miss.
+
+        Returns:
+            Dict with ``upload_url`` and ``sess_id`` (a copy of the cached entry).
+        """
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            if not self._entries:
+                self.misses += 1
+                return None
+            entry = self._entries[0]
+            self._entries.rotate(-1) # Round-robin across warm assignments
+            self.hits += 1
+            return dict(entry)
+
+    def add(self, server_info: Dict[str, Any]) -> None:
+        """Store a freshly fetched assignment if the pool has room for it."""
+        entry = {
+            "upload_url": server_info.get("upload_url"),
+            "sess_id": server_info.get("sess_id"),
+            "fetched_at": server_info.get("fetched_at", time.monotonic()),
+        }
+        if not entry["upload_url"]:
+            return
+        with self._lock:
+            if len(self._entries) < max(self.size, 1):
+                self._entries.append(entry)
+
+    def evict(self, server_info: Dict[str, Any]) -> None:
+        """Remove an assignment that the upload server rejected."""
+        key = (server_info.get("upload_url"), server_info.get("sess_id"))
+        with self._lock:
+            before = len(self._entries)
+            self._entries = deque(e for e in self._entries if (e["upload_url"], e["sess_id"]) != key)
+            if len(self._entries) != before:
+                self.evictions += 1
+                app_logger.warning("Evicted rejected upload server: {}", key[0])
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters for this worker process."""
+        with self._lock:
+            warm = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "pid": os.getpid(),
+            "warm": warm,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "prefetches": self.prefetches,
+        }
+
+    def start(self) -> None:
+        """Start the background prefetcher once per process (fork-safe)."""
+        if not settings.UPLOAD_SERVER_PREFETCH or self.size <= 0:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Assignments and thread state inherited across fork are not ours
+                self._entries.clear()
+                self._thread = None
+                self._stop = threading.Event()
+                self._pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._prefetch_loop, name="upload-server-prefetch", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """Ask the prefetcher to exit."""
+        self._stop.set()
+
+    def _prefetch_loop(self) -> None:
+        """Keep ``size`` fresh assignments in the pool until stopped."""
+        app_logger.debug("Upload server prefetcher started in process {}", os.getpid())
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                self._purge_expired(now)
+                # Refresh ahead of expiry so a warm entry is always available
+                refresh_before = now - self.ttl + 2 * self.refresh_interval
+                missing = self.size - sum(1 for e in self._entries if e["fetched_at"] > refresh_before)
+            for _ in range(max(missing, 0)):
+                try:
+                    success, server_info = self._fetch()
+                except Exception as e:
+                    app_logger.error("Upload server prefetch failed: {}", e, exc_info=True)
+                    break
+                if not success:
+                    break # Try again on the next pass
+                self.prefetches += 1
+                with self._lock:
+                    # Replace the oldest entry if the pool is already full
+                    if len(self._entries) >= self.size:
+                        oldest = min(self._entries, key=lambda e: e["fetched_at"])
+                        self._entries.remove(oldest)
+                self.add(server_info)
+            self._stop.wait(self.refresh_interval)
@@ -0,0 +1,487 @@
+"""
+Upload staging module.
+Manages the local staging area that uploads pass through before they reach
+their storage backend: the files of a parsed upload form (kept in memory up
+to STAGING_MEMORY_THRESHOLD, spilled to UPLOAD_STAGING_DIR/spool beyond
+it), queued job files and resumable upload sessions.
+
+Every staged byte is covered by a reservation in a SQLite ledger shared by
+all worker processes. An upload whose declared size does not fit under
+STAGING_QUOTA, or that would leave less than STAGING_MIN_FREE_SPACE on the
+staging disk, is refused with a 507 before its body is read, instead of
+failing half-way with a full disk. A background reaper drops the
+reservations and files of workers that died and sweeps orphaned files.
+"""
+import errno
+import io
+import os
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+from ..config import settings
+from .async_runner import off_hub
+from .logger import app_logger
+from .metrics import metrics
+
+DISK_FULL_ERRNOS = (errno.ENOSPC, errno.EDQUOT)
+
+class StagingQuotaExceeded(Exception):
+    """Raised when an upload cannot be staged; carries the (Arabic) client message and status code."""
+
+    def __init__(self, reason: str, retry_after: int = None):
+        super().__init__(f"Staging area full ({reason})")
+        self.message = "الخادم مشغول حالياً، الرجاء المحاولة بعد قليل" # Server busy, please retry shortly (Arabic)
+        self.status_code = 507 # Insufficient Storage
+        self.reason = reason
+        self.retry_after = retry_after or settings.STAGING_RETRY_AFTER
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Alive, owned by another user
+        return True
+    return True
+
+
+class StagingReservation:
+    """Share of the staging quota held by one owner (e.g. a request) until released."""
+
+    def __init__(self, area: "StagingArea", owner: str, reserved: int = 0):
+        self.area = area
+        self.owner = owner
+        self.reserved = reserved
+        self.used = 0
+        self.unrecorded = False # The ledger failed; the rest is admitted without asking it again
+
+    def charge(self, nbytes: int) -> None:
+        """
+        Account ``nbytes`` more staged bytes, growing the reservation (by at
+        least STAGING_MEMORY_THRESHOLD) once they exceed it.
+
+        Raises:
+            StagingQuotaExceeded: If the reservation cannot grow.
+        """
+        self.used += nbytes
+        if self.used > self.reserved and not self.unrecorded:
+            wanted = max(self.used, self.reserved + self.area.memory_threshold)
+            if self.area.reserve(self.owner, wanted):
+                self.reserved = wanted
+            else: # Fail open once, rather than retry (and log) on every chunk
+                self.unrecorded = True
+
+    def hand_over(self, owner: str, nbytes: int, path: str = None) -> bool:
+        """
+        Move ``nbytes`` of this reservation to ``owner``, such as the upload
+        job taking over a file staged by the request (see StagingArea.transfer).
+        """
+        self.reserved = max(0, self.reserved - nbytes)
+        return self.area.transfer(self.owner, owner, nbytes, path)
+
+    def release(self) -> None:
+        if self.reserved:
+            self.area.release(self.owner)
+            self.reserved = 0
+
+
+class SpillFile:
+    """
+    Upload file kept in memory until it grows past the memory threshold,
+    then moved to a named file in the spool directory (deleted on close).
+    Written bytes are charged to a staging reservation.
+    """
+
+    def __init__(self, area: "StagingArea", reservation: StagingReservation):
+        self._area = area
+        self._reservation = reservation
+        self._file = io.BytesIO() # Named ``_file`` like SpooledTemporaryFile, see storage.file_descriptor
+        self.path = None
+        self.size = 0
+
+    @property
+    def kind(self) -> str:
+        return "memory" if self.path is None else "disk"
+
+    def write(self, data: bytes) -> int:
+        end = self._file.tell() + len(data)
+        if end > self.size:
+            self._reservation.charge(end - self.size)
+            if self.path is None and end > self._area.memory_threshold:
+                self._spill()
+            metrics.staging_bytes.labels(self.kind).inc(end - self.size)
+            self.size = end
+        with self._area.disk_errors():
+            return self._file.write(data)
+
+    def _spill(self) -> None:
+        """Move the in-memory contents to a file in the spool directory."""
+        path = os.path.join(self._area.spool_dir, f"{os.getpid()}-{secrets.token_hex(8)}.spool")
+        with self._area.disk_errors():
+            os.makedirs(self._area.spool_dir, exist_ok=True)
+            disk_file = open(path, "w+b")
+            try:
+                disk_file.write(self._file.getbuffer())
+                disk_file.seek(self._file.tell())
+            except BaseException:
+                disk_file.close()
+                os.remove(path)
+                raise
+        metrics.staging_bytes.labels("memory").dec(self.size)
+        metrics.staging_bytes.labels("disk").inc(self.size)
+        self._file, self.path = disk_file, path
+
+    def fileno(self) -> int:
+        """OS file descriptor; spills an in-memory file to disk first, as SpooledTemporaryFile does."""
+        if self.path is None:
+            self._spill()
+        return self._file.fileno()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.close()
+        metrics.staging_bytes.labels(self.kind).dec(self.size)
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StagingArea:
+    """Quota ledger, spill files and reaper of the upload staging area."""
+
+    def __init__(self, root_dir=None, quota: int = None, memory_threshold: int = None, db_path=None):
+        """
+        Args:
+            root_dir: Staging directory (defaults to UPLOAD_STAGING_DIR).
+            quota: Bytes all staged uploads may hold at once, 0 for no quota (defaults to STAGING_QUOTA).
+            memory_threshold: Bytes a form file is kept in memory before it spills (defaults to STAGING_MEMORY_THRESHOLD).
+            db_path: Path of the ledger database (defaults to STAGING_DB_PATH).
+        """
+        self.root_dir = str(root_dir or settings.UPLOAD_STAGING_DIR)
+        self.spool_dir = os.path.join(self.root_dir, "spool")
+        self.quota = quota if quota is not None else settings.STAGING_QUOTA
+        self.memory_threshold = memory_threshold if memory_threshold is not None else settings.STAGING_MEMORY_THRESHOLD
+        self.db_path = str(db_path or settings.STAGING_DB_PATH)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cleanups: List[Callable[[], object]] = []
+        self._reaper_pid = None
+        self._stop = threading.Event()
+
+    # --- Ledger --- #
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process (connections must not cross a fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None) # Transactions are explicit
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reservations ("
+                " owner TEXT PRIMARY KEY,"
+                " pid INTEGER," # Process holding it, NULL if it outlives processes (resumable sessions)
+                " bytes INTEGER NOT NULL,"
+                " path TEXT," # Staged file it covers, if any
+                " created_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction, taken up front so concurrent read-modify-writes serialise."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _free_space(self) -> Optional[int]:
+        try:
+            return shutil.disk_usage(self.root_dir).free
+        except OSError:
+            return None
+
+    @off_hub
+    def reserve(self, owner: str, nbytes: int, path: str = None, process_bound: bool = True,
+                force: bool = False) -> bool:
+        """
+        Reserve (or resize the reservation of) ``owner`` to ``nbytes``.
+
+        Args:
+            owner: Unique name, e.g. ``job:<id>``.
+            nbytes: Bytes to hold in total.
+            path: Staged file covered by the reservation; the reaper deletes
+                it with the reservation of a dead process.
+            process_bound: Released automatically when this process dies.
+            force: Record bytes that are already on disk without checking the quota.
+
+        Returns:
+            bool: Whether the reservation was recorded; False if the ledger
+            failed, in which case the bytes are admitted unrecorded (fail open).
+
+        Raises:
+            StagingQuotaExceeded: If the quota or the free-space floor would be exceeded.
+        """
+        self.start()
+        try:
+            with self._transaction() as conn:
+                (others,) = conn.execute(
+                    "SELECT COALESCE(SUM(bytes), 0) FROM reservations WHERE owner != ?", (owner,)
+                ).fetchone()
+                row = conn.execute("SELECT bytes FROM reservations WHERE owner = ?", (owner,)).fetchone()
+                growth = nbytes - (row[0] if row else 0)
+                if not force and growth > 0:
+                    if self.quota and others + nbytes > self.quota:
+                        self._reject("quota", owner, nbytes)
+                    free = self._free_space()
+                    if free is not None and free - growth < settings.STAGING_MIN_FREE_SPACE:
+                        self._reject("disk_space", owner, nbytes)
+                conn.execute(
+                    "INSERT OR REPLACE INTO reservations (owner, pid, bytes, path, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (owner, os.getpid() if process_bound else None, nbytes, path, time.time()),
+                )
+        except sqlite3.Error as e: # Fail open: a broken ledger must not take uploads down with it
+            app_logger.error("Staging reservation failed: {}", e)
+            return False
+        metrics.staging_reserved_bytes.set(others + nbytes)
+        return True
+
+    @off_hub
+    def transfer(self, from_owner: str, to_owner: str, nbytes: int, path: str = None) -> bool:
+        """
+        Move ``nbytes`` from the reservation of ``from_owner`` to a new,
+        process-bound one of ``to_owner``, in one transaction, so the bytes
+        are never counted twice. The bytes are on disk already, so the quota
+        is not checked.
+
+        Returns:
+            bool: Whether the ledger recorded it (see reserve).
+        """
+        try:
+            with self._transaction() as conn:
+                row = conn.execute("SELECT bytes FROM reservations WHERE owner = ?", (from_owner,)).fetchone()
+                left = (row[0] if row else 0) - nbytes
+                if left > 0:
+                    conn.execute("UPDATE reservations SET bytes = ? WHERE owner = ?", (left, from_owner))
+                else:
+                    conn.execute("DELETE FROM reservations WHERE owner = ?", (from_owner,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO reservations (owner, pid, bytes, path, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (to_owner, os.getpid(), nbytes, path, time.time()),
+                )
+                (total,) = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations").fetchone()
+        except sqlite3.Error as e:
+            app_logger.error("Staging transfer failed: {}", e)
+            return False
+        metrics.staging_reserved_bytes.set(total)
+        return True
+
+    def _reject(self, reason: str, owner: str, nbytes: int) -> None:
+        metrics.staging_rejected.labels(reason).inc()
+        app_logger.warning("Refused to stage {} bytes for {} ({})", nbytes, owner, reason)
+        raise StagingQuotaExceeded(reason)
+
+    @off_hub
+    def release(self, owner: str) -> None:
+        """Give back the reservation of ``owner`` (no-op if it holds none)."""
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM reservations WHERE owner = ?", (owner,))
+                (total,) = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations").fetchone()
+        except sqlite3.Error as e:
+            app_logger.error("Staging release failed: {}", e)
+            return
+        metrics.staging_reserved_bytes.set(total)
+
+    @off_hub
+    def is_reserved(self, owner: str) -> bool:
+        try:
+            return self._connection().execute(
+                "SELECT 1 FROM reservations WHERE owner = ?", (owner,)
+            ).fetchone() is not None
+        except sqlite3.Error as e:
+            app_logger.error("Staging ledger lookup failed: {}", e)
+            return True # Unknown: never treat a file as orphaned on a lookup error
+
+    @off_hub
+    def usage(self) -> int:
+        """Bytes currently reserved by all processes."""
+        try:
+            (total,) = self._connection().execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations").fetchone()
+        except sqlite3.Error as e:
+            app_logger.error("Staging ledger lookup failed: {}", e)
+            return 0
+        return total
+
+    def request_reservation(self, nbytes: int = 0) -> StagingReservation:
+        """
+        Reservation for the files of one request, sized from its Content-Length.
+
+        Raises:
+            StagingQuotaExceeded: If ``nbytes`` cannot be reserved.
+        """
+        reservation = StagingReservation(self, f"request:{uuid.uuid4().hex}")
+        if nbytes > 0:
+            if self.reserve(reservation.owner, nbytes):
+                reservation.reserved = nbytes
+            else:
+                reservation.unrecorded = True
+        return reservation
+
+    def spill_file(self, reservation: StagingReservation) -> SpillFile:
+        """File for one form part, charged to ``reservation``."""
+        return SpillFile(self, reservation)
+
+    @contextmanager
+    def disk_errors(self) -> Iterator[None]:
+        """Turn a full-disk OSError into StagingQuotaExceeded (a 507 rather than a 500)."""
+        try:
+            yield
+        except OSError as e:
+            if e.errno not in DISK_FULL_ERRNOS:
+                raise
+            metrics.staging_rejected.labels("disk_full").inc()
+            app_logger.error("Staging disk full: {}", e)
+            raise StagingQuotaExceeded("disk_full") from e
+
+    # --- Cleanup --- #
+
+    def add_cleanup(self, func: Callable[[], object]) -> None:
+        """Run ``func`` on every reaper pass (e.g. a module's own expiry sweep)."""
+        self._cleanups.append(func)
+
+    def _remove(self, path: Optional[str]) -> bool:
+        if not path:
+            return False
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            app_logger.warning("Could not remove staged file {}: {}", path, e)
+            return False
+        metrics.staging_reaped_files.inc()
+        return True
+
+    @off_hub
+    def forget_process(self, pid: int) -> int:
+        """Drop the reservations of an exited worker and delete the files they covered."""
+        try:
+            with self._transaction() as conn:
+                rows = conn.execute("SELECT path FROM reservations WHERE pid = ?", (pid,)).fetchall()
+                conn.execute("DELETE FROM reservations WHERE pid = ?", (pid,))
+        except sqlite3.Error as e:
+            app_logger.error("Staging cleanup for worker {} failed: {}", pid, e)
+            return 0
+        removed = sum(self._remove(path) for (path,) in rows)
+        for name in self._spool_files():
+            if name.startswith(f"{pid}-"):
+                removed += self._remove(os.path.join(self.spool_dir, name))
+        return removed
+
+    def _spool_files(self) -> List[str]:
+        try:
+            return os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return []
+
+    @off_hub
+    def reap(self) -> int:
+        """
+        One cleanup pass: reservations of dead processes (and their files),
+        process-independent reservations whose file has disappeared, spill
+        files of dead processes, then the registered module sweeps.
+
+        Returns:
+            int: Number of files removed by the staging area itself.
+        """
+        removed = 0
+        try:
+            rows = self._connection().execute("SELECT owner, pid, path FROM reservations").fetchall()
+        except sqlite3.Error as e:
+            app_logger.error("Staging reaper could not read the ledger: {}", e)
+            rows = []
+        dead = {pid for _, pid, _ in rows if pid is not None and not _process_alive(pid)}
+        for pid in dead:
+            removed += self.forget_process(pid)
+        for owner, pid, path in rows:
+            if pid is None and path and not os.path.exists(path):
+                self.release(owner) # Not tied to a process: its file was deleted without releasing it
+
+        for name in self._spool_files():
+            try:
+                pid = int(name.split("-", 1)[0])
+            except ValueError:
+                continue
+            if not _process_alive(pid):
+                removed += self._remove(os.path.join(self.spool_dir, name))
+
+        for cleanup in self._cleanups:
+            try:
+                cleanup()
+            except Exception as e:
+                app_logger.error("Staging cleanup {} failed: {}", getattr(cleanup, "__qualname__", cleanup), e, exc_info=True)
+        metrics.staging_reserved_bytes.set(self.usage())
+        if removed:
+            app_logger.info("Staging reaper removed {} orphaned file(s)", removed)
+        return removed
+
+    def start(self) -> None:
+        """Start the reaper thread once per process (fork-safe)."""
+        if self._reaper_pid == os.getpid() or settings.STAGING_REAP_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._reaper_pid == os.getpid():
+                return
+            self._stop = threading.Event() # Threads inherited across fork are not ours
+            threading.Thread(target=self._reap_loop, args=(self._stop,), name="staging-reaper", daemon=True).start()
+            self._reaper_pid = os.getpid()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._reaper_pid = None
+
+    def _reap_loop(self, stop: threading.Event) -> None:
+        # The first pass runs right away, clearing what an earlier server run left behind
+        while True:
+            try:
+                self.reap()
+            except Exception as e:
+                app_logger.error("Staging reaper pass failed: {}", e, exc_info=True)
+            if stop.wait(settings.STAGING_REAP_INTERVAL):
+                return
+
+# Create staging area instance for use in the application
+staging_area = StagingArea()
@@ -0,0 +1,751 @@
+"""
+Storage module.
+Where uploaded files are kept. Every backend implements StorageBackend:
+DDownload (app.modules.ddownload) sends files to the file host,
+LocalStorageBackend keeps them on this machine and serves them with range
+requests, and S3StorageBackend writes them to any S3-compatible object
+store. StorageRouter picks the backend of each upload from STORAGE_ROUTES,
+by size and file type, so for example small files never leave the box.
+
+Results keep the uploader's ``(success, result)`` convention: ``file_code``
+and ``download_link`` on success, ``error`` (plus ``retryable`` for
+transient failures) otherwise.
+"""
+import asyncio
+import errno
+from abc import ABC, abstractmethod
+import hashlib
+import hmac
+import io
+import mimetypes
+import os
+import re
+import secrets
+import shutil
+import time
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlsplit
+from werkzeug.utils import secure_filename
+from ..config import settings
+from .http_client import http_client
+from .lazy import lazy_import
+from .logger import app_logger
+from .metrics import metrics
+from .progress import progress_tracker
+from .resilience import circuit_breakers, circuit_open_error, is_transient
+from .streaming import MultipartStreamError, SizedBody, StreamRejected, iter_file_chunks, remaining_size
+
+aiohttp = lazy_import("aiohttp")
+requests = lazy_import("requests")
+
+Result = Tuple[bool, Dict[str, Any]]
+
+FILE_CODE_RE = re.compile(r"^[A-Za-z0-9_-]{16}$")
+COPY_SLICE = 8 * 1024 * 1024 # Bytes per zero-copy call, so progress is published between them
+
+async def run_blocking(func, *args):
+    """
+    Run a blocking call in the default executor, recording how long it
+    waited for a free thread and how many calls are waiting.
+    """
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    started = False
+    metrics.executor_queue_depth.inc()
+
+    def run():
+        nonlocal started
+        started = True
+        metrics.executor_queue_depth.dec()
+        metrics.observe_stage("executor_wait", time.perf_counter() - submitted)
+        return func(*args)
+
+    try:
+        return await loop.run_in_executor(None, run)
+    finally:
+        if not started: # Cancelled before a thread picked it up
+            metrics.executor_queue_depth.dec()
+
+
+def new_file_code() -> str:
+    """Random, URL-safe identifier of a stored file (16 characters)."""
+    return secrets.token_urlsafe(12)
+
+
+class StorageBackend(ABC):
+    """
+    Interface of a storage backend.
+
+    Backends implement the blocking store_file_sync and store_stream_sync;
+    the async methods run them in the executor unless overridden.
+    """
+
+    name = "storage"
+
+    @property
+    def configured(self) -> bool:
+        """Whether the backend has the settings it needs to accept files."""
+        return True
+
+    @property
+    def link_lifetime(self) -> Optional[float]:
+        """Seconds a download link stays valid, or None if it does not expire."""
+        return None
+
+    async def store_file(self, file_data, filename: str, progress_id: str = None) -> Result:
+        """
+        Store a seekable file from its current position.
+
+        Args:
+            file_data: File object (e.g. the spooled upload).
+            filename: Secured file name.
+            progress_id: Client-supplied id to publish progress under (optional).
+        """
+        return await run_blocking(self.store_file_sync, file_data, filename, progress_id)
+
+    async def store_stream(self, chunks: Iterable[bytes], filename: str, progress_id: str = None) -> Result:
+        """Store a stream of unknown length; ``chunks`` blocks, so it is consumed in the executor."""
+        return await run_blocking(self.store_stream_sync, chunks, filename, progress_id)
+
+    async def store_stream_async(self, chunks: AsyncIterable[bytes], filename: str, progress_id: str = None) -> Result:
+        """
+        Store a stream read on the running event loop (ASGI path).
+
+        By default chunks are relayed through a small bounded queue to
+        store_stream_sync on an executor thread; backends with an async
+        client override this to stay on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        relay = asyncio.Queue(maxsize=4)
+
+        def relayed() -> Iterator[bytes]:
+            while True:
+                item = asyncio.run_coroutine_threadsafe(relay.get(), loop).result()
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    return
+                yield item
+
+        store = loop.run_in_executor(None, self.store_stream_sync, relayed(), filename, progress_id)
+
+        async def put(item) -> bool:
+            """Queue an item for the writer; False if the writer has already finished."""
+            queued = asyncio.ensure_future(relay.put(item))
+            await asyncio.wait({queued, store}, return_when=asyncio.FIRST_COMPLETED)
+            if not queued.done():
+                queued.cancel()
+                return False
+            return True
+
+        end = None # End of stream
+        try:
+            async for chunk in chunks:
+                if not await put(chunk): # The writer gave up; the rest is not needed
+                    break
+        except MultipartStreamError as e:
+            end = e # Raised in the writer, which reports it as for a blocking stream
+        except BaseException:
+            # Failed or cancelled: unblock the writer without waiting for queue space
+            if not store.done():
+                while not relay.empty():
+                    relay.get_nowait()
+                relay.put_nowait(MultipartStreamError("Upload stream aborted"))
+            raise
+        await put(end)
+        return await store
+
+    @abstractmethod
+    def store_file_sync(self, file_data, filename: str, progress_id: str = None) -> Result:
+        """Blocking version of store_file."""
+
+    @abstractmethod
+    def store_stream_sync(self, chunks: Iterable[bytes], filename: str, progress_id: str = None) -> Result:
+        """Blocking version of store_stream."""
+
+
+def file_descriptor(file_obj) -> Optional[int]:
+    """
+    OS file descriptor behind a file object, or None for in-memory files.
+
+    Wrappers (SniffingFile, SpooledTemporaryFile) keep the real file in
+    ``_file``; asking a spooled file for its fileno() would first copy it
+    to disk.
+    """
+    while hasattr(file_obj, "_file"):
+        file_obj = file_obj._file
+    try:
+        return file_obj.fileno()
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def copy_file_data(file_data, out_fd: int, reporter=None) -> int:
+    """
+    Copy a file object from its current position to the end into ``out_fd``.
+
+    Disk-backed files are copied in the kernel with ``os.copy_file_range``
+    (falling back to ``os.sendfile``), so the bytes never pass through
+    Python; in-memory files are written out in chunks. The file position is
+    left unchanged.
+
+    Returns:
+        int: Number of bytes copied.
+    """
+    start = file_data.tell()
+    size = remaining_size(file_data)
+    in_fd = file_descriptor(file_data)
+    copied = 0
+    if in_fd is not None and size is not None:
+        for copy in (getattr(os, "copy_file_range", None), _sendfile):
+            if copy is None:
+                continue
+            try:
+                while copied < size:
+                    sent = copy(in_fd, out_fd, min(COPY_SLICE, size - copied), start + copied)
+                    if not sent:
+                        break
+                    copied += sent
+                    if reporter is not None:
+                        reporter.add(sent)
+                return copied
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF) or copied:
+                    raise
+    # In memory, or no kernel copy between these files
+    for chunk in iter_file_chunks(file_data):
+        write_all(out_fd, chunk)
+        copied += len(chunk)
+        if reporter is not None:
+            reporter.add(len(chunk))
+    file_data.seek(start)
+    return copied
+
+
+def write_all(fd: int, data: bytes) -> None:
+    """os.write until all of ``data`` is written."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _sendfile(in_fd: int, out_fd: int, count: int, offset: int) -> int:
+    """copy_file_range-style wrapper of os.sendfile (file to file on Linux)."""
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Files kept under LOCAL_STORAGE_DIR, as ``<file_code>/<filename>``.
+
+    Downloads are served by the ``/files/<file_code>/<filename>`` route with
+    range request support; files older than LOCAL_STORAGE_RETENTION are no
+    longer served and are swept from disk.
+    """
+
+    name = "local"
+    PURGE_INTERVAL = 60 * 60 # Seconds between sweeps for expired files
+
+    def __init__(self, root_dir=None, base_url: str = None, retention: int = None):
+        """
+        Args:
+            root_dir: Directory files are kept in (defaults to LOCAL_STORAGE_DIR).
+            base_url: Prefix of download links (defaults to LOCAL_STORAGE_BASE_URL; empty gives relative links).
+            retention: Seconds a file is kept, 0 for ever (defaults to LOCAL_STORAGE_RETENTION).
+        """
+        self.root_dir = str(root_dir or settings.LOCAL_STORAGE_DIR)
+        self.base_url = (base_url if base_url is not None else settings.LOCAL_STORAGE_BASE_URL).rstrip("/")
+        self.retention = retention if retention is not None else settings.LOCAL_STORAGE_RETENTION
+        self._last_purge = 0.0
+
+    @property
+    def link_lifetime(self) -> Optional[float]:
+        return self.retention or None
+
+    def path_of(self, file_code: str, filename: str) -> Optional[str]:
+        """Path of a stored, unexpired file, or None."""
+        if not FILE_CODE_RE.match(file_code) or not filename or secure_filename(filename) != filename:
+            return None
+        path = os.path.join(self.root_dir, file_code, filename)
+        try:
+            stored_at = os.path.getmtime(path)
+        except OSError:
+            return None
+        if self.retention and time.time() - stored_at > self.retention:
+            return None
+        return path
+
+    def _link(self, file_code: str, filename: str) -> str:
+        return f"{self.base_url}/files/{file_code}/{quote(filename)}"
+
+    def _store(self, filename: str, write) -> Result:
+        """
+        Create the file through ``write(fd)`` under a temporary name and
+        publish it with a rename, so a partial file is never served.
+        """
+        if time.monotonic() - self._last_purge > self.PURGE_INTERVAL:
+            self._last_purge = time.monotonic()
+            self.purge_expired()
+        file_code = new_file_code()
+        path = os.path.join(self.root_dir, file_code, filename)
+        tmp_path = f"{path}.part"
+        try:
+            os.makedirs(os.path.dirname(path))
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                size = write(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, path)
+        except BaseException as e:
+            self.delete(file_code)
+            if not isinstance(e, OSError):
+                raise
+            app_logger.error("Could not store '{}' locally: {}", filename, e)
+            return False, {"error": "Local storage error"}
+        app_logger.info("File '{}' stored locally ({} bytes). Code: {}", filename, size, file_code)
+        return True, {"file_code": file_code, "download_link": self._link(file_code, filename)}
+
+    def store_file_sync(self, file_data, filename: str, progress_id: str = None) -> Result:
+        reporter = progress_tracker.reporter(progress_id, remaining_size(file_data), self.base_url)
+        success = False
+        try:
+            success, result = self._store(filename, lambda fd: copy_file_data(file_data, fd, reporter))
+        finally:
+            reporter.finish(success)
+        return success, result
+
+    def store_stream_sync(self, chunks: Iterable[bytes], filename: str, progress_id: str = None) -> Result:
+        reporter = progress_tracker.reporter(progress_id, None, self.base_url)
+
+        def write(fd: int) -> int:
+            size = 0
+            for chunk in reporter.wrap(chunks):
+                write_all(fd, chunk)
+                size += len(chunk)
+            return size
+
+        success = False
+        try:
+            success, result = self._store(filename, write)
+        except MultipartStreamError as e:
+            app_logger.warning("Malformed upload stream for '{}': {}", filename, e)
+            result = {"error": "Invalid upload request body"}
+        finally:
+            reporter.finish(success)
+        return success, result
+
+    def delete(self, file_code: str) -> None:
+        if FILE_CODE_RE.match(file_code):
+            shutil.rmtree(os.path.join(self.root_dir, file_code), ignore_errors=True)
+
+    def purge_expired(self) -> int:
+        """Delete files stored longer than the retention period (none when it is 0)."""
+        if not self.retention or not os.path.isdir(self.root_dir):
+            return 0
+        removed = 0
+        cutoff = time.time() - self.retention
+        for file_code in os.listdir(self.root_dir):
+            directory = os.path.join(self.root_dir, file_code)
+            try:
+                if os.path.getmtime(directory) < cutoff:
+                    shutil.rmtree(directory)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            app_logger.info("Removed {} expired locally stored file(s)", removed)
+        return removed
+
+
+class S3Error(Exception):
+    """Error answer of an S3-compatible service (``status`` is None for malformed answers)."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class SigV4Signer:
+    """AWS Signature Version 4, as accepted by S3 and S3-compatible stores."""
+
+    ALGORITHM = "AWS4-HMAC-SHA256"
+    UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+    def __init__(self, access_key: str, secret_key: str, region: str, service: str = "s3"):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.service = service
+
+    @staticmethod
+    def _encode(value: str) -> str:
+        return quote(value, safe="-_.~")
+
+    def _scope(self, date_stamp: str) -> str:
+        return f"{date_stamp}/{self.region}/{self.service}/aws4_request"
+
+    def _signature(self, date_stamp: str, string_to_sign: str) -> str:
+        key = f"AWS4{self.secret_key}".encode("utf-8")
+        for part in (date_stamp, self.region, self.service, "aws4_request"):
+            key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+        return hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def _sign(self, method: str, url: str, headers: Dict[str, str], payload_hash: str,
+              amz_date: str, extra_query: List[Tuple[str, str]] = ()) -> Tuple[str, str]:
+        """Signature and signed header list of a request (``url`` path already percent-encoded)."""
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query, keep_blank_values=True) + list(extra_query)
+        canonical_query = "&".join(f"{self._encode(k)}={self._encode(v)}" for k, v in sorted(query))
+        canonical_headers = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+        canonical_headers["host"] = parts.netloc
+        signed_headers = ";".join(sorted(canonical_headers))
+        canonical_request = "\n".join([
+            method,
+            parts.path or "/",
+            canonical_query,
+            "".join(f"{name}:{canonical_headers[name]}\n" for name in sorted(canonical_headers)),
+            signed_headers,
+            payload_hash,
+        ])
+        string_to_sign = "\n".join([
+            self.ALGORITHM,
+            amz_date,
+            self._scope(amz_date[:8]),
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        return self._signature(amz_date[:8], string_to_sign), signed_headers
+
+    def sign_headers(self, method: str, url: str, headers: Dict[str, str] = None,
+                     payload_hash: str = UNSIGNED_PAYLOAD, now: datetime = None) -> Dict[str, str]:
+        """Headers of a request signed with an Authorization header."""
+        amz_date = (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+        headers = dict(headers or {}, **{"x-amz-date": amz_date, "x-amz-content-sha256": payload_hash})
+        signature, signed_headers = self._sign(method, url, headers, payload_hash, amz_date)
+        headers["Authorization"] = (
+            f"{self.ALGORITHM} Credential={self.access_key}/{self._scope(amz_date[:8])}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return headers
+
+    def presign(self, method: str, url: str, expires: int, now: datetime = None) -> str:
+        """URL carrying its own signature in the query string, valid for ``expires`` seconds."""
+        amz_date = (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+        query = [
+            ("X-Amz-Algorithm", self.ALGORITHM),
+            ("X-Amz-Credential", f"{self.access_key}/{self._scope(amz_date[:8])}"),
+            ("X-Amz-Date", amz_date),
+            ("X-Amz-Expires", str(expires)),
+            ("X-Amz-SignedHeaders", "host"),
+        ]
+        signature, _ = self._sign(method, url, {}, self.UNSIGNED_PAYLOAD, amz_date, query)
+        separator = "&" if urlsplit(url).query else "?"
+        encoded = "&".join(f"{self._encode(k)}={self._encode(v)}" for k, v in query)
+        return f"{url}{separator}{encoded}&X-Amz-Signature={signature}"
+
+
+def iter_parts(chunks: Iterable[bytes], part_size: int) -> Iterator[bytes]:
+    """Regroup a stream into ``part_size`` pieces (the last one shorter)."""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def aiter_parts(chunks: AsyncIterable[bytes], part_size: int) -> AsyncIterator[bytes]:
+    """Async version of iter_parts."""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+class S3StorageBackend(StorageBackend):
+    """
+    Files kept in a bucket of an S3-compatible object store, as ``<file_code>/<filename>``.
+
+    Files of known size are sent with one PUT; streams are sent as a
+    multipart upload of S3_PART_SIZE parts, so at most one part is held in
+    memory. Links are presigned (valid for S3_LINK_EXPIRY) unless the bucket
+    is public under S3_PUBLIC_URL.
+    """
+
+    name = "s3"
+
+    def __init__(self, endpoint_url: str = None, bucket: str = None, access_key: str = None, secret_key: str = None,
+                 region: str = None, public_url: str = None, link_expiry: int = None, part_size: int = None):
+        """Arguments default to the S3_* settings of the same name."""
+        self.endpoint_url = (endpoint_url if endpoint_url is not None else settings.S3_ENDPOINT_URL).rstrip("/")
+        self.bucket = bucket if bucket is not None else settings.S3_BUCKET
+        self.public_url = (public_url if public_url is not None else settings.S3_PUBLIC_URL).rstrip("/")
+        self.link_expiry = link_expiry or settings.S3_LINK_EXPIRY
+        self.part_size = max(5 * 1024 * 1024, part_size or settings.S3_PART_SIZE) # S3's minimum part size
+        self.signer = SigV4Signer(
+            access_key if access_key is not None else settings.S3_ACCESS_KEY,
+            secret_key if secret_key is not None else settings.S3_SECRET_KEY,
+            region or settings.S3_REGION,
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.endpoint_url and self.bucket)
+
+    @property
+    def link_lifetime(self) -> Optional[float]:
+        return None if self.public_url else self.link_expiry
+
+    def _object_url(self, key: str) -> str:
+        return f"{self.endpoint_url}/{self.bucket}/{quote(key, safe='/-_.~')}"
+
+    def _stored(self, key: str, filename: str, size: int) -> Result:
+        if self.public_url:
+            link = f"{self.public_url}/{quote(key, safe='/-_.~')}"
+        else:
+            link = self.signer.presign("GET", self._object_url(key), self.link_expiry)
+        app_logger.info("File '{}' stored in S3 bucket {} ({} bytes). Key: {}", filename, self.bucket, size, key)
+        return True, {"file_code": key, "download_link": link}
+
+    @staticmethod
+    def _check(status: int, body: bytes, operation: str) -> bytes:
+        """Raise S3Error for an error answer (CompleteMultipartUpload can fail with a 200)."""
+        if status < 300 and b"<Error>" not in body[:256]:
+            return body
+        code = re.search(rb"<Code>(.*?)</Code>", body)
+        detail = code.group(1).decode("utf-8", "replace") if code else body[:100].decode("utf-8", "replace")
+        raise S3Error(f"S3 API error during {operation}: HTTP {status} {detail}", status if status >= 300 else 500)
+
+    @staticmethod
+    def _upload_id(body: bytes) -> str:
+        match = re.search(rb"<UploadId>(.*?)</UploadId>", body)
+        if match is None:
+            raise S3Error("S3 API error: no UploadId in CreateMultipartUpload answer")
+        return match.group(1).decode("utf-8")
+
+    @staticmethod
+    def _complete_body(etags: List[str]) -> bytes:
+        parts = "".join(f"<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>" for n, etag in enumerate(etags, 1))
+        return f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+
+    def _failure(self, e: Exception, filename: str) -> Dict[str, Any]:
+        if isinstance(e, S3Error):
+            app_logger.error("S3 upload of '{}' failed: {}", filename, e)
+            return {"error": str(e), "retryable": is_transient(e)}
+        app_logger.error("Network error during S3 upload of '{}': {}", filename, e)
+        return {"error": f"Upload network error: {str(e)}", "retryable": is_transient(e)}
+
+    # --- Blocking transfers (requests) ---
+
+    def _request_sync(self, method: str, url: str, operation: str, data=None, headers: Dict[str, str] = None):
+        response = http_client.session.request(
+            method, url, data=data, headers=self.signer.sign_headers(method, url, headers), timeout=300
+        )
+        self._check(response.status_code, response.content, operation)
+        return response
+
+    def store_file_sync(self, file_data, filename: str, progress_id: str = None) -> Result:
+        size = remaining_size(file_data)
+        if size is None:
+            return self.store_stream_sync(iter_file_chunks(file_data), filename, progress_id)
+        if not circuit_breakers.allow(self.endpoint_url):
+            return False, circuit_open_error(self.endpoint_url)
+        key = f"{new_file_code()}/{filename}"
+        reporter = progress_tracker.reporter(progress_id, size, self.endpoint_url)
+        success, result = False, {}
+        try:
+            body = SizedBody(reporter.wrap(iter_file_chunks(file_data)), size)
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            self._request_sync("PUT", self._object_url(key), "PutObject", body, {"Content-Type": content_type})
+            success, result = self._stored(key, filename, size)
+        except (S3Error, requests.exceptions.RequestException) as e:
+            result = self._failure(e, filename)
+        finally:
+            reporter.finish(success)
+        circuit_breakers.record(self.endpoint_url, success, result)
+        return success, result
+
+    def store_stream_sync(self, chunks: Iterable[bytes], filename: str, progress_id: str = None) -> Result:
+        if not circuit_breakers.allow(self.endpoint_url):
+            return False, circuit_open_error(self.endpoint_url)
+        key = f"{new_file_code()}/{filename}"
+        url = self._object_url(key)
+        reporter = progress_tracker.reporter(progress_id, None, self.endpoint_url)
+        content_type = {"Content-Type": mimetypes.guess_type(filename)[0] or "application/octet-stream"}
+        success, result, upload_id = False, {}, None
+        try:
+            parts = iter_parts(reporter.wrap(chunks), self.part_size)
+            first = next(parts, b"")
+            if len(first) < self.part_size: # The whole stream fits in one request
+                self._request_sync("PUT", url, "PutObject", first, content_type)
+                size = len(first)
+            else:
+                response = self._request_sync("POST", f"{url}?uploads", "CreateMultipartUpload", headers=content_type)
+                upload_id = self._upload_id(response.content)
+                etags, size = [], 0
+                for number, part in enumerate(chain([first], parts), 1):
+                    response = self._request_sync("PUT", self._part_url(url, upload_id, number), "UploadPart", part)
+                    etags.append(response.headers.get("ETag", ""))
+                    size += len(part)
+                self._request_sync("POST", self._part_url(url, upload_id), "CompleteMultipartUpload",
+                                   self._complete_body(etags))
+            success, result = self._stored(key, filename, size)
+        except MultipartStreamError as e:
+            app_logger.warning("Malformed upload stream for '{}': {}", filename, e)
+            if upload_id is not None:
+                self._abort_sync(url, upload_id)
+            return False, {"error": "Invalid upload request body"} # The client's fault, not the store's
+        except StreamRejected:
+            if upload_id is not None:
+                self._abort_sync(url, upload_id)
+            raise # Answered by the caller
+        except (S3Error, requests.exceptions.RequestException) as e:
+            result = self._failure(e, filename)
+        finally:
+            reporter.finish(success)
+        if upload_id is not None and not success:
+            self._abort_sync(url, upload_id)
+        circuit_breakers.record(self.endpoint_url, success, result)
+        return success, result
+
+    @staticmethod
+    def _part_url(url: str, upload_id: str, number: int = None) -> str:
+        """URL of a multipart upload (or of one of its parts)."""
+        upload = f"uploadId={quote(upload_id, safe='')}"
+        return f"{url}?partNumber={number}&{upload}" if number is not None else f"{url}?{upload}"
+
+    def _abort_sync(self, url: str, upload_id: str) -> None:
+        """Discard the parts of a failed multipart upload (best effort)."""
+        try:
+            self._request_sync("DELETE", self._part_url(url, upload_id), "AbortMultipartUpload")
+        except (S3Error, requests.exceptions.RequestException) as e:
+            app_logger.warning("Could not abort S3 multipart upload {}: {}", upload_id, e)
+
+    # --- Event loop transfers (aiohttp, ASGI path) ---
+
+    async def _request_async(self, method: str, url: str, operation: str, data=None,
+                             headers: Dict[str, str] = None) -> Tuple[bytes, Dict[str, str]]:
+        session = await http_client.aio_session()
+        async with session.request(
+            method, url, data=data, headers=self.signer.sign_headers(method, url, headers),
+            timeout=aiohttp.ClientTimeout(total=300),
+        ) as response:
+            body = await response.read()
+            self._check(response.status, body, operation)
+            return body, dict(response.headers)
+
+    async def store_stream_async(self, chunks: AsyncIterable[bytes], filename: str, progress_id: str = None) -> Result:
+        if not circuit_breakers.allow(self.endpoint_url):
+            return False, circuit_open_error(self.endpoint_url)
+        key = f"{new_file_code()}/{filename}"
+        url = self._object_url(key)
+        reporter = progress_tracker.reporter(progress_id, None, self.endpoint_url)
+        content_type = {"Content-Type": mimetypes.guess_type(filename)[0] or "application/octet-stream"}
+        success, result, upload_id = False, {}, None
+        try:
+            parts = aiter_parts(reporter.awrap(chunks), self.part_size)
+            first = await anext(parts, b"")
+            if len(first) < self.part_size: # The whole stream fits in one request
+                await self._request_async("PUT", url, "PutObject", first, content_type)
+                size = len(first)
+            else:
+                body, _ = await self._request_async("POST", f"{url}?uploads", "CreateMultipartUpload", headers=content_type)
+                upload_id = self._upload_id(body)
+                etags, size, number, part = [], 0, 1, first
+                while part is not None:
+                    _, headers = await self._request_async("PUT", self._part_url(url, upload_id, number), "UploadPart", part)
+                    etags.append(headers.get("ETag", ""))
+                    size += len(part)
+                    number += 1
+                    part = await anext(parts, None)
+                await self._request_async("POST", self._part_url(url, upload_id), "CompleteMultipartUpload",
+                                          self._complete_body(etags))
+            success, result = self._stored(key, filename, size)
+        except MultipartStreamError as e:
+            app_logger.warning("Malformed upload stream for '{}': {}", filename, e)
+            if upload_id is not None:
+                await self._abort_async(url, upload_id)
+            return False, {"error": "Invalid upload request body"} # The client's fault, not the store's
+        except StreamRejected:
+            if upload_id is not None:
+                await self._abort_async(url, upload_id)
+            raise # Answered by the caller
+        except (S3Error, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            result = self._failure(e, filename)
+        finally:
+            reporter.finish(success)
+        if upload_id is not None and not success:
+            await self._abort_async(url, upload_id)
+        circuit_breakers.record(self.endpoint_url, success, result)
+        return success, result
+
+    async def _abort_async(self, url: str, upload_id: str) -> None:
+        """Async version of _abort_sync."""
+        try:
+            await self._request_async("DELETE", self._part_url(url, upload_id), "AbortMultipartUpload")
+        except (S3Error, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            app_logger.warning("Could not abort S3 multipart upload {}: {}", upload_id, e)
+
+
+class StorageRouter:
+    """
+    Picks the backend of each upload.
+
+    Rules are tried in order and the first match wins; uploads no rule
+    matches go to the default backend. A rule names a ``backend`` and any of
+    ``max_size`` / ``min_size`` (bytes) and ``extensions``; a size bound
+    never matches an upload whose size is not known up front.
+    """
+
+    def __init__(self, backends: Dict[str, StorageBackend], routes: List[Dict[str, Any]] = None, default: str = None):
+        """
+        Args:
+            backends: Backends by name.
+            routes: Routing rules (defaults to STORAGE_ROUTES).
+            default: Name of the default backend (defaults to STORAGE_DEFAULT_BACKEND).
+        """
+        self.backends = backends
+        default = default or settings.STORAGE_DEFAULT_BACKEND
+        if default != "ddownload" and not self._usable(default, "default backend"):
+            default = "ddownload" # The fallback; a missing API key is reported when it is used
+        self.default = backends[default]
+        self.routes = [
+            dict(rule, extensions={ext.lower().lstrip(".") for ext in rule.get("extensions") or ()})
+            for rule in (routes if routes is not None else settings.STORAGE_ROUTES)
+            if isinstance(rule, dict) and self._usable(rule.get("backend"), f"route {rule}")
+        ]
+
+    def _usable(self, name: str, what: str) -> bool:
+        backend = self.backends.get(name)
+        if backend is None:
+            app_logger.warning("Ignoring storage {}: unknown backend '{}'", what, name)
+            return False
+        if not backend.configured:
+            app_logger.warning("Ignoring storage {}: backend '{}' is not configured", what, name)
+            return False
+        return True
+
+    def route(self, filename: str, size: Optional[int]) -> StorageBackend:
+        """Backend for an upload of ``filename`` (``size`` bytes, None if unknown)."""
+        ext = filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+        for rule in self.routes:
+            if rule.get("max_size") is not None and (size is None or size > rule["max_size"]):
+                continue
+            if rule.get("min_size") is not None and (size is None or size < rule["min_size"]):
+                continue
+            if rule["extensions"] and ext not in rule["extensions"]:
+                continue
+            return self.backends[rule["backend"]]
+        return self.default
+
+# Create storage backend instances for use in the application
+local_storage = LocalStorageBackend()
+s3_storage = S3StorageBackend()
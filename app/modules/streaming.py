@@ -0,0 +1,333 @@
+"""
+Streaming multipart module.
+Parses incoming multipart/form-data bodies incrementally and re-encodes the
+file part as a chunked multipart body for the DDownload upload server, so
+uploads can be proxied without spooling the whole file to local disk.
+"""
+import uuid
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Optional
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+from ..config import settings
+
+
+class MultipartStreamError(ValueError):
+    """Raised when the incoming multipart body is malformed or truncated."""
+
+
+class StreamRejected(Exception):
+    """
+    Raised from an upload's incoming stream to refuse the rest of it.
+
+    Storage backends abort the transfer and pass it on, for the caller to
+    answer the client.
+    """
+
+
+class RequestTooLarge(StreamRejected):
+    """Raised when the request body exceeds MAX_CONTENT_LENGTH."""
+
+
+class _MultipartReaderBase:
+    """Decoder state shared by the blocking and the asyncio readers."""
+
+    def __init__(self, boundary: bytes, chunk_size: int = None, max_field_size: int = 64 * 1024):
+        """
+        Args:
+            boundary: Multipart boundary taken from the Content-Type header.
+            chunk_size: Number of bytes to read from the stream at a time.
+            max_field_size: Maximum size of a non-file form field.
+        """
+        self.chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+        self.max_field_size = max_field_size
+        self.decoder = MultipartDecoder(boundary)
+        self.fields: Dict[str, str] = {}
+        self.bytes_read = 0
+        self._in_file = False
+
+    @staticmethod
+    def parse_boundary(content_type: Optional[str]) -> bytes:
+        """
+        Extract the boundary from a request's Content-Type header.
+
+        Raises:
+            MultipartStreamError: If the body is not multipart/form-data with a boundary.
+        """
+        mimetype, options = parse_options_header(content_type or "")
+        boundary = options.get("boundary")
+        if mimetype != "multipart/form-data" or not boundary:
+            raise MultipartStreamError("Request body is not multipart/form-data")
+        return boundary.encode("latin-1")
+
+    def _decode(self):
+        """Return the next decoder event (may be NeedData)."""
+        try:
+            return self.decoder.next_event()
+        except ValueError as e:
+            raise MultipartStreamError(f"Malformed multipart body: {e}") from e
+
+    def _receive(self, chunk: bytes) -> None:
+        """Feed a chunk read from the client into the decoder."""
+        if chunk:
+            self.bytes_read += len(chunk)
+            self.decoder.receive_data(chunk)
+        else:
+            self.decoder.receive_data(None) # Signal end of input
+
+    def _append_field(self, name: str, value: bytearray, event: Data) -> bool:
+        """Accumulate field data; returns True once the field is complete."""
+        if not isinstance(event, Data):
+            raise MultipartStreamError(f"Unexpected event while reading field '{name}'")
+        value.extend(event.data)
+        if len(value) > self.max_field_size:
+            raise MultipartStreamError(f"Form field '{name}' is too large")
+        if event.more_data:
+            return False
+        self.fields[name] = value.decode("utf-8", errors="replace")
+        return True
+
+    def _file_chunk(self, event) -> bytes:
+        """Unwrap a data event of the current file part."""
+        if not isinstance(event, Data):
+            raise MultipartStreamError("Unexpected event while reading file data")
+        if not event.more_data:
+            self._in_file = False
+        return event.data
+
+
+class MultipartStreamReader(_MultipartReaderBase):
+    """
+    Incrementally decodes a multipart/form-data body read from a stream.
+
+    Only one read buffer of ``chunk_size`` bytes (plus the decoder's small
+    boundary look-behind) is held in memory at a time, regardless of the
+    size of the uploaded file.
+    """
+
+    def __init__(self, stream, boundary: bytes, **kwargs):
+        """
+        Args:
+            stream: Readable binary stream (e.g. ``request.stream``).
+            boundary: Multipart boundary taken from the Content-Type header.
+            **kwargs: ``chunk_size`` and ``max_field_size``.
+        """
+        super().__init__(boundary, **kwargs)
+        self.stream = stream
+
+    @classmethod
+    def from_content_type(cls, stream, content_type: Optional[str], **kwargs) -> "MultipartStreamReader":
+        """
+        Build a reader from a request's Content-Type header.
+
+        Raises:
+            MultipartStreamError: If the body is not multipart/form-data with a boundary.
+        """
+        return cls(stream, cls.parse_boundary(content_type), **kwargs)
+
+    def _next_event(self):
+        """Return the next decoder event, reading from the stream as needed."""
+        while True:
+            event = self._decode()
+            if not isinstance(event, NeedData):
+                return event
+            self._receive(self.stream.read(self.chunk_size))
+
+    def next_file(self) -> Optional[File]:
+        """
+        Advance to the next file part, collecting plain form fields on the way.
+
+        Any unread data of the current file part is discarded first.
+
+        Returns:
+            The ``File`` event (with ``name``, ``filename`` and ``headers``) or
+            None when the body contains no further file parts.
+        """
+        if self._in_file:
+            for _ in self.iter_file_data():
+                pass
+        while True:
+            event = self._next_event()
+            if isinstance(event, File):
+                self._in_file = True
+                return event
+            if isinstance(event, Field):
+                value = bytearray()
+                while not self._append_field(event.name, value, self._next_event()):
+                    pass
+            elif isinstance(event, Epilogue):
+                return None
+
+    def iter_file_data(self) -> Iterator[bytes]:
+        """Yield the payload of the current file part chunk by chunk."""
+        while self._in_file:
+            chunk = self._file_chunk(self._next_event())
+            if chunk:
+                yield chunk
+
+
+class AsyncMultipartStreamReader(_MultipartReaderBase):
+    """
+    asyncio counterpart of MultipartStreamReader.
+
+    Reads the body through an awaitable callable, e.g. one wrapping an ASGI
+    ``receive`` channel, that returns ``b""`` at the end of the body.
+    """
+
+    def __init__(self, read: Callable[[], Awaitable[bytes]], boundary: bytes, **kwargs):
+        """
+        Args:
+            read: Coroutine function returning the next body chunk.
+            boundary: Multipart boundary taken from the Content-Type header.
+            **kwargs: ``chunk_size`` and ``max_field_size``.
+        """
+        super().__init__(boundary, **kwargs)
+        self.read = read
+
+    async def _next_event(self):
+        """Return the next decoder event, awaiting body chunks as needed."""
+        while True:
+            event = self._decode()
+            if not isinstance(event, NeedData):
+                return event
+            self._receive(await self.read())
+
+    async def next_file(self) -> Optional[File]:
+        """Advance to the next file part (see MultipartStreamReader.next_file)."""
+        if self._in_file:
+            async for _ in self.iter_file_data():
+                pass
+        while True:
+            event = await self._next_event()
+            if isinstance(event, File):
+                self._in_file = True
+                return event
+            if isinstance(event, Field):
+                value = bytearray()
+                while not self._append_field(event.name, value, await self._next_event()):
+                    pass
+            elif isinstance(event, Epilogue):
+                return None
+
+    async def iter_file_data(self) -> AsyncIterator[bytes]:
+        """Yield the payload of the current file part chunk by chunk."""
+        while self._in_file:
+            chunk = self._file_chunk(await self._next_event())
+            if chunk:
+                yield chunk
+
+
+class MultipartStreamEncoder:
+    """
+    Encodes form fields and a single streamed file as a multipart/form-data body.
+
+    The body is produced as a generator so it can be sent with chunked
+    transfer encoding without knowing the file size in advance.
+    """
+
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str,
+                 content_type: str = "application/octet-stream", boundary: str = None):
+        self.fields = fields
+        self.file_field = file_field
+        self.filename = filename
+        self.file_content_type = content_type
+        self.boundary = boundary or uuid.uuid4().hex
+
+    @property
+    def content_type(self) -> str:
+        """Value for the outgoing request's Content-Type header."""
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    @staticmethod
+    def _quote(value: str) -> str:
+        """Escape a header parameter value the way browsers do."""
+        return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+    def preamble(self) -> bytes:
+        """Encoded form fields followed by the headers of the file part."""
+        parts = []
+        for name, value in self.fields.items():
+            parts.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{self._quote(name)}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        parts.append(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{self._quote(self.file_field)}"; '
+            f'filename="{self._quote(self.filename)}"\r\n'
+            f'Content-Type: {self.file_content_type}\r\n\r\n'
+        )
+        return "".join(parts).encode("utf-8")
+
+    def epilogue(self) -> bytes:
+        """Closing boundary that terminates the body."""
+        return f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+    def encoded_length(self, payload_size: int) -> int:
+        """Total body length for a file payload of ``payload_size`` bytes."""
+        return len(self.preamble()) + payload_size + len(self.epilogue())
+
+    def iter_body(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield the complete multipart body, streaming the file chunks through."""
+        yield self.preamble()
+        for chunk in chunks:
+            if chunk: # Empty chunks would terminate a chunked transfer early
+                yield chunk
+        yield self.epilogue()
+
+    async def aiter_body(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """Async version of iter_body for aiohttp request bodies."""
+        yield self.preamble()
+        async for chunk in chunks:
+            if chunk:
+                yield chunk
+        yield self.epilogue()
+
+
+class SizedBody:
+    """
+    Iterable request body with a known length.
+
+    requests sends a Content-Length header (instead of chunked transfer
+    encoding) for iterables that implement ``__len__``.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], length: int):
+        self._chunks = chunks
+        self._length = length
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self._chunks)
+
+    def __len__(self) -> int:
+        return self._length
+
+
+def iter_file_chunks(file_obj, chunk_size: int = None) -> Iterator[bytes]:
+    """Read a file object from its current position in chunks."""
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def remaining_size(file_obj) -> Optional[int]:
+    """Bytes left to read in a seekable file object, or None if unknown."""
+    try:
+        if not file_obj.seekable():
+            return None
+        position = file_obj.tell()
+        end = file_obj.seek(0, 2)
+        file_obj.seek(position)
+        return end - position
+    except (AttributeError, OSError, ValueError):
+        return None
@@ -1,194 +1,242 @@
 """
 File upload module.
-Handles file upload operations and DDownload API integration.
-Uses aiohttp for async server check and requests for blocking file upload.
+Validates uploads, answers repeat uploads from the dedup index and hands
+the rest to the storage backend the router picks for them: DDownload
+(app.modules.ddownload), local disk or an S3-compatible object store
+(app.modules.storage). Files are taken either as a spooled file, as a
+blocking chunk stream or as an async chunk stream (ASGI path).
 """
 import asyncio
-import aiohttp
-import requests # Using requests for the file upload part as in the brief
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, AsyncIterable, Iterable, List, Optional, Tuple
 from ..config import settings
 from ..modules.logger import app_logger
+from .ddownload import DDownloadBackend
+from .dedup import StreamHasher, dedup_index, hash_file
+from .metrics import metrics
+from .progress import progress_tracker
+from .server_pool import UploadServerPool
+from .storage import StorageBackend, StorageRouter, local_storage, run_blocking, s3_storage
+from .streaming import remaining_size
+
 
 class FileUploader:
-    """Handles file uploads to DDownload API."""
-    
-    def __init__(self):
-        """Initialize the uploader with API key and URLs."""
-        self.api_key = settings.DDOWNLOAD_API_KEY
-        self.api_url = settings.DDOWNLOAD_API_URL
-        self.download_url_base = settings.DDOWNLOAD_DOWNLOAD_URL
-    
+    """Validates uploads and stores them with the backend they are routed to."""
+
+    def __init__(self, api_key: str = None, api_url: str = None, download_url_base: str = None):
+        """
+        Initialize the uploader and its storage backends.
+
+        Args:
+            api_key: DDownload API key (defaults to DDOWNLOAD_API_KEY).
+            api_url: API base URL, e.g. a local stand-in for benchmarks (defaults to DDOWNLOAD_API_URL).
+            download_url_base: Base of generated download links (defaults to DDOWNLOAD_DOWNLOAD_URL).
+        """
+        self.ddownload = DDownloadBackend(api_key, api_url, download_url_base)
+        self.router = StorageRouter({
+            backend.name: backend for backend in (self.ddownload, local_storage, s3_storage)
+        })
+
+    @property
+    def server_pool(self) -> UploadServerPool:
+        """DDownload's warm pool of upload server assignments."""
+        return self.ddownload.server_pool
+
     def _validate_file(self, filename: str) -> bool:
         """
         Validate if the file has an allowed extension.
-        
+
         Args:
             filename: Name of the file to validate
-            
+
         Returns:
             bool: True if file extension is allowed, False otherwise
         """
         # Check if filename is not empty and contains a dot
         if not filename or '.' not in filename:
-            app_logger.warning(f"Invalid filename rejected (no extension): {filename}")
+            app_logger.warning("Invalid filename rejected (no extension): {}", filename)
             return False
-        
+
         # Extract extension and check against allowed set
         ext = filename.rsplit(".", 1)[1].lower()
         allowed = ext in settings.ALLOWED_EXTENSIONS
         if not allowed:
-            app_logger.warning(f"Invalid file type rejected: {filename} (extension: {ext})")
+            app_logger.warning("Invalid file type rejected: {} (extension: {})", filename, ext)
         return allowed
-    
-    async def get_upload_server(self) -> Tuple[bool, Dict[str, Any]]:
+
+    def _existing(self, digest: str, size: int, backend: StorageBackend) -> Optional[Dict[str, Any]]:
+        """
+        Earlier upload of the same content to ``backend``, if its link is still good.
+
+        Links that expire (presigned S3 URLs, local files past retention) are
+        only reused during the first half of their lifetime, so a link handed
+        out again stays valid for a while.
+        """
+        lifetime = backend.link_lifetime
+        max_age = settings.DEDUP_MAX_AGE if lifetime is None else min(settings.DEDUP_MAX_AGE, lifetime / 2)
+        return dedup_index.lookup(digest, size, backend.name, max_age)
+
+    def find_existing(self, digest: str, size: int, filename: str = "") -> Optional[Dict[str, Any]]:
         """
-        Asynchronously get upload server details from DDownload API.
-        
+        Earlier upload of the same content, looked up with the backend a new
+        upload of ``filename`` would be routed to (pre-upload handshake).
+
         Returns:
-            Tuple[bool, Dict]: Success status and server information or error message.
-        """
-        if not self.api_key:
-            app_logger.error("DDownload API Key is missing.")
-            return False, {"error": "API Key not configured"}
-
-        server_url = f"{self.api_url}/upload/server?key={self.api_key}"
-        app_logger.debug(f"Requesting upload server from: {server_url}")
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(server_url, timeout=30) as response: # Added timeout
-                    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                    server_info = await response.json()
-                    app_logger.debug(f"Upload server response: {server_info}")
-                    
-                    # DDownload API v2 uses 'msg' for status message and 'status' code
-                    if server_info.get('status') == 200 and server_info.get('result'):
-                        app_logger.info("Successfully obtained upload server.")
-                        return True, {
-                            "upload_url": server_info['result'],
-                            "sess_id": server_info.get('sess_id') # sess_id might not always be present
-                        }
-                    else:
-                        error_msg = server_info.get('msg', "Unknown error from DDownload API")
-                        app_logger.error(f"Failed to get upload server: {error_msg} (Status: {server_info.get('status')})")
-                        return False, {"error": f"API Error: {error_msg}"}
-                        
-        except aiohttp.ClientError as e:
-            app_logger.error(f"Network error getting upload server: {str(e)}")
-            return False, {"error": f"Network error: {str(e)}"}
-        except asyncio.TimeoutError:
-            app_logger.error("Timeout getting upload server.")
-            return False, {"error": "Request timed out"}
-        except Exception as e:
-            app_logger.error(f"Unexpected error getting upload server: {str(e)}", exc_info=True)
-            return False, {"error": "An unexpected error occurred"}
-    
-    # This part remains synchronous as per the brief, using requests
-    # It will block the event loop if run within an async context without care.
-    # Consider running this in a thread pool executor in a real async app.
-    def upload_file_sync(self, file_data, filename: str, upload_url: str, sess_id: str = None) -> Tuple[bool, Dict[str, Any]]:
-        """
-        Synchronously uploads file data using the requests library.
+            Dict with ``file_code`` and ``download_link``, or None.
+        """
+        return self._existing(digest, size, self.router.route(filename, size))
+
+    async def _finish(self, backend: StorageBackend, success: bool, result: Dict[str, Any],
+                      filename: str, digest: str = None, size: int = None) -> Tuple[bool, Dict[str, Any]]:
+        """Count the outcome per backend and index the content of a successful upload."""
+        metrics.storage_uploads.labels(backend.name, "success" if success else "error").inc()
+        if success and digest is not None:
+            await run_blocking(dedup_index.record, digest, size, filename, result, backend.name)
+        return success, result
+
+    @metrics.instrument_upload("file")
+    async def upload_file(self, file_data, filename: str, progress_id: str = None,
+                          server_info: Dict[str, Any] = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Orchestrates the file upload process: validates, routes, stores.
+
+        Args:
+            file_data: File data object (e.g., file stream).
+            filename: Name of the file.
+            progress_id: Client-supplied id to publish progress under (optional).
+            server_info: DDownload upload server assignment to use instead of acquiring one (optional).
+
+        Returns:
+            Tuple[bool, Dict]: Success status and upload results or error message.
+        """
+        if not self._validate_file(filename):
+            return False, {"error": "نوع الملف غير مسموح به"} # File type not allowed (Arabic)
+
+        backend = self.router.route(filename, remaining_size(file_data))
+        app_logger.info("Attempting to upload file: {} (storage: {})", filename, backend.name)
+
+        # Answer repeat uploads from the dedup index without storing them again
+        digest = size = None
+        if settings.DEDUP_ENABLED and getattr(file_data, "seekable", lambda: False)():
+            with metrics.time_stage("hash"):
+                digest, size = await run_blocking(hash_file, file_data)
+            existing = await run_blocking(self._existing, digest, size, backend)
+            if existing is not None:
+                app_logger.info("Duplicate of an earlier upload: '{}' ({} bytes). Link: {}", filename, size, existing['download_link'])
+                return True, dict(existing, deduplicated=True)
+
+        if backend is self.ddownload:
+            success, result = await backend.store_file(file_data, filename, progress_id, server_info=server_info)
+        else:
+            success, result = await backend.store_file(file_data, filename, progress_id)
+        return await self._finish(backend, success, result, filename, digest, size)
+
+    @metrics.instrument_upload("stream")
+    async def upload_stream(self, chunks: Iterable[bytes], filename: str, progress_id: str = None,
+                            size_hint: int = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Orchestrates a streaming upload: validates, routes, and stores the
+        chunks as they are produced (consumed in the executor).
 
         Args:
-            file_data: The file stream/data to upload.
-            filename: The name of the file.
-            upload_url: The URL provided by get_upload_server.
-            sess_id: The session ID from get_upload_server (optional).
+            chunks: Iterable yielding the file payload, e.g. MultipartStreamReader.iter_file_data().
+            filename: Name of the file.
+            progress_id: Client-supplied id to publish progress under (optional).
+            size_hint: Upper bound of the file size for routing, e.g. the request's Content-Length (optional).
 
         Returns:
             Tuple[bool, Dict]: Success status and upload results or error message.
         """
-        app_logger.debug(f"Starting synchronous upload for {filename} to {upload_url}")
-        data = {
-            'utype': 'prem', # Or 'anon' depending on API key type
-        }
-        if sess_id:
-            data['sess_id'] = sess_id
-            
-        files = {'file': (filename, file_data)}
-        
-        try:
-            # Using requests.post for the actual file upload (blocking)
-            upload_response = requests.post(upload_url, data=data, files=files, timeout=300) # 5 min timeout for upload
-            upload_response.raise_for_status()
-            upload_result = upload_response.json()
-            app_logger.debug(f"Upload response data: {upload_result}")
-
-            # Check response format - it's often a list
-            if isinstance(upload_result, list) and upload_result:
-                first_result = upload_result[0]
-                if first_result.get('file_status') == 'OK' and first_result.get('file_code'):
-                    file_code = first_result['file_code']
-                    download_link = f"{self.download_url_base}/{file_code}"
-                    app_logger.info(f"File '{filename}' uploaded successfully. Code: {file_code}")
-                    return True, {
-                        "file_code": file_code,
-                        "download_link": download_link
-                    }
-                else:
-                    error_msg = first_result.get('error', "Upload failed according to API status")
-                    app_logger.error(f"Upload failed for '{filename}': {error_msg}")
-                    return False, {"error": f"API Upload Error: {error_msg}"}
-            else:
-                 app_logger.error(f"Unexpected API response format during upload: {upload_result}")
-                 return False, {"error": "Unexpected API response format"}
-
-        except requests.exceptions.RequestException as e:
-            app_logger.error(f"Error during requests file upload for '{filename}': {str(e)}")
-            return False, {"error": f"Upload network error: {str(e)}"}
-        except Exception as e:
-            app_logger.error(f"Unexpected error during synchronous upload for '{filename}': {str(e)}", exc_info=True)
-            return False, {"error": "An unexpected error occurred during upload"}
-
-    async def upload_file(self, file_data, filename: str) -> Tuple[bool, Dict[str, Any]]:
-        """
-        Orchestrates the file upload process: validates, gets server (async), uploads (sync).
-        
+        if not self._validate_file(filename):
+            return False, {"error": "نوع الملف غير مسموح به"} # File type not allowed (Arabic)
+
+        backend = self.router.route(filename, size_hint)
+        app_logger.info("Attempting streaming upload of file: {} (storage: {})", filename, backend.name)
+
+        # The content is only known once it has been sent, so streamed
+        # uploads are hashed on the way through and indexed afterwards
+        hasher = StreamHasher()
+        success, result = await backend.store_stream(hasher.wrap(chunks), filename, progress_id)
+        if settings.DEDUP_ENABLED:
+            return await self._finish(backend, success, result, filename, hasher.hexdigest, hasher.size)
+        return await self._finish(backend, success, result, filename)
+
+    @metrics.instrument_upload("async")
+    async def upload_stream_async(self, chunks: AsyncIterable[bytes], filename: str, progress_id: str = None,
+                                  size_hint: int = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Fully asynchronous streaming upload for the ASGI entry point.
+
+        Backends with an async client (DDownload, S3) send the chunks from
+        the event loop, so concurrency is not capped by the default
+        executor's worker count.
+
         Args:
-            file_data: File data object (e.g., file stream).
+            chunks: Async iterable yielding the file payload.
             filename: Name of the file.
-            
+            progress_id: Client-supplied id to publish progress under (optional).
+            size_hint: Upper bound of the file size for routing, e.g. the request's Content-Length (optional).
+
         Returns:
             Tuple[bool, Dict]: Success status and upload results or error message.
         """
         if not self._validate_file(filename):
             return False, {"error": "نوع الملف غير مسموح به"} # File type not allowed (Arabic)
-        
-        app_logger.info(f"Attempting to upload file: {filename}")
-        
-        # Get upload server asynchronously
-        success, server_info = await self.get_upload_server()
-        if not success:
-            # server_info already contains the error message
-            return False, server_info 
-        
-        upload_url = server_info.get("upload_url")
-        sess_id = server_info.get("sess_id")
-
-        if not upload_url:
-             app_logger.error("Upload URL not found in server info response.")
-             return False, {"error": "Could not retrieve upload URL"}
-
-        # Run the synchronous upload part in a separate thread 
-        # to avoid blocking the main async event loop.
-        loop = asyncio.get_running_loop()
-        try:
-            # Use loop.run_in_executor to run the blocking requests.post call
-            success, result = await loop.run_in_executor(
-                None, # Use default thread pool executor
-                self.upload_file_sync, 
-                file_data, 
-                filename, 
-                upload_url, 
-                sess_id
-            )
-            return success, result
-        except Exception as e:
-            # Catch potential errors from run_in_executor itself
-            app_logger.error(f"Error running upload_file_sync in executor: {str(e)}", exc_info=True)
-            return False, {"error": "Failed to execute upload task"}
+
+        backend = self.router.route(filename, size_hint)
+        app_logger.info("Attempting async upload of file: {} (storage: {})", filename, backend.name)
+
+        hasher = StreamHasher()
+        success, result = await backend.store_stream_async(hasher.awrap(chunks), filename, progress_id)
+        if settings.DEDUP_ENABLED:
+            return await self._finish(backend, success, result, filename, hasher.hexdigest, hasher.size)
+        return await self._finish(backend, success, result, filename)
+
+    async def upload_batch(self, files: List[Tuple[Any, str]], progress_id: str = None) -> List[Tuple[bool, Dict[str, Any]]]:
+        """
+        Upload several files concurrently, at most BATCH_UPLOAD_PARALLELISM at a time.
+
+        One DDownload upload server assignment is acquired for the files
+        routed to DDownload and shared by their transfers, which also share
+        the pooled HTTP connections. If it cannot be had or the upload server
+        rejects it, the remaining files acquire their own.
+
+        Args:
+            files: ``(file_data, filename)`` pairs, as for upload_file.
+            progress_id: Client-supplied id to publish aggregate progress under (optional).
+
+        Returns:
+            List of ``(success, result)`` tuples, in the order of ``files``.
+        """
+        total = sum(remaining_size(file_data) or 0 for file_data, _ in files)
+        item_ids = progress_tracker.start_batch(progress_id, len(files), total)
+        app_logger.info("Attempting batch upload of {} file(s), {} bytes", len(files), total)
+
+        shared = {"server_info": None}
+        if any(self.router.route(filename, remaining_size(file_data)) is self.ddownload for file_data, filename in files):
+            success, server_info = await self.ddownload.acquire_upload_server()
+            if success:
+                shared["server_info"] = server_info
+            # Otherwise each DDownload file tries on its own; the other backends are unaffected
+        semaphore = asyncio.Semaphore(max(1, settings.BATCH_UPLOAD_PARALLELISM))
+
+        async def upload_one(file_data, filename: str, item_id: str) -> Tuple[bool, Dict[str, Any]]:
+            async with semaphore:
+                size = remaining_size(file_data)
+                assigned = shared["server_info"]
+                try:
+                    success, result = await self.upload_file(file_data, filename, item_id, server_info=assigned)
+                except Exception as e: # One file's failure must not cost the others their results
+                    app_logger.error("Unexpected error uploading '{}' in a batch: {}", filename, e, exc_info=True)
+                    success, result = False, {"error": "An unexpected error occurred during upload"}
+                if not success and assigned is not None and self.ddownload._server_rejected(result):
+                    shared["server_info"] = None # Evicted: later files acquire a fresh assignment
+                progress_tracker.mark_finished(item_id, success, size) # Duplicates never start a transfer
+                return success, result
+
+        return await asyncio.gather(*(
+            upload_one(file_data, filename, item_id)
+            for (file_data, filename), item_id in zip(files, item_ids)
+        ))
 
 # Create uploader instance for use in the application
 uploader = FileUploader()
@@ -0,0 +1,281 @@
+"""
+Upload validation module.
+Rejects disallowed uploads as early as possible: the file name and declared
+size are checked from the request and multipart part headers before any
+payload is read, and the leading bytes of the file ("magic numbers") are
+checked against its extension as soon as they arrive, so a bad upload is
+never spooled to the staging area or forwarded to storage.
+"""
+from itertools import chain
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional
+from flask import Request
+from werkzeug.utils import secure_filename
+from ..config import settings
+from .staging import StagingReservation, staging_area
+from .streaming import StreamRejected
+
+OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" # Legacy Office (.doc/.xls)
+ZIP_SIGNATURES = (b"PK\x03\x04", b"PK\x05\x06", b"PK\x07\x08") # Also .docx/.xlsx
+
+# Leading bytes each allowed extension must start with
+MAGIC_SIGNATURES = {
+    "pdf": (b"%PDF-",),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpg": (b"\xff\xd8\xff",),
+    "jpeg": (b"\xff\xd8\xff",),
+    "gif": (b"GIF87a", b"GIF89a"),
+    "zip": ZIP_SIGNATURES,
+    "docx": ZIP_SIGNATURES,
+    "xlsx": ZIP_SIGNATURES,
+    "rar": (b"Rar!\x1a\x07",),
+    "doc": (OLE2_SIGNATURE,),
+    "xls": (OLE2_SIGNATURE,),
+}
+
+# Executable formats, never accepted whatever the extension claims
+EXECUTABLE_SIGNATURES = (b"MZ", b"\x7fELF", b"\xcf\xfa\xed\xfe", b"\xce\xfa\xed\xfe", b"\xca\xfe\xba\xbe")
+
+class UploadValidationError(StreamRejected):
+    """
+    Rejected upload, with the (Arabic) client message and HTTP status code.
+
+    Streamed files are also checked as their chunks are read, so it is a
+    StreamRejected that storage backends pass on to the caller.
+    """
+
+    def __init__(self, message: str, status_code: int = 400, reason: str = ""):
+        super().__init__(reason or message)
+        self.message = message
+        self.status_code = status_code
+        self.reason = reason # English, for logs
+
+
+class UploadValidator:
+    """File name, size and content checks shared by all upload paths."""
+
+    def __init__(self, sniff_bytes: int = None):
+        """
+        Args:
+            sniff_bytes: Leading bytes inspected for content checks.
+        """
+        self.sniff_bytes = sniff_bytes or settings.UPLOAD_SNIFF_BYTES
+
+    @staticmethod
+    def extension(filename: str) -> Optional[str]:
+        if not filename or '.' not in filename:
+            return None
+        return filename.rsplit(".", 1)[1].lower()
+
+    def is_allowed(self, filename: str) -> bool:
+        return self.extension(filename) in settings.ALLOWED_EXTENSIONS
+
+    def check_filename(self, filename: str) -> str:
+        """
+        Check the file extension against ALLOWED_EXTENSIONS.
+
+        Returns:
+            str: The lower-cased extension.
+        """
+        ext = self.extension(filename)
+        if ext not in settings.ALLOWED_EXTENSIONS:
+            raise UploadValidationError(
+                "نوع الملف غير مسموح به", 400, # File type not allowed (Arabic)
+                reason=f"extension not allowed: {filename}"
+            )
+        return ext
+
+    def max_size(self, ext: str, default: int) -> int:
+        """Size limit for an extension: its MAX_FILE_SIZE_BY_TYPE entry, capped by ``default``."""
+        return min(settings.MAX_FILE_SIZE_BY_TYPE.get(ext, default), default)
+
+    def check_size(self, ext: str, size: Optional[int], default_limit: int) -> None:
+        """Check a declared or received size against the limit for the extension (unknown sizes pass)."""
+        if size is None:
+            return
+        limit = self.max_size(ext, default_limit)
+        if size > limit:
+            raise UploadValidationError(
+                f"الملف كبير جداً. الحد الأقصى هو {limit // (1024*1024)} ميجابايت.", 413, # File too large (Arabic)
+                reason=f"size {size} exceeds the {ext} limit of {limit} bytes"
+            )
+
+    def check_content(self, ext: str, head: bytes) -> None:
+        """Check the first bytes of a file against the signatures for its extension."""
+        if head.startswith(EXECUTABLE_SIGNATURES):
+            ok = False
+        elif ext in MAGIC_SIGNATURES:
+            ok = head.startswith(MAGIC_SIGNATURES[ext])
+        else:
+            # Plain text (and anything without a signature): no NUL bytes
+            ok = b"\x00" not in head[:self.sniff_bytes]
+        if not ok:
+            raise UploadValidationError(
+                "محتوى الملف لا يطابق نوعه", 415, # File content does not match its type (Arabic)
+                reason=f"content does not match .{ext} (starts with {head[:8]!r})"
+            )
+
+    def check_part(self, filename: str, declared_size: Optional[int], default_limit: int = None) -> str:
+        """Header-only checks for a file part: extension and declared size. Returns the extension."""
+        ext = self.check_filename(filename)
+        self.check_size(ext, declared_size, default_limit or settings.MAX_CONTENT_LENGTH)
+        return ext
+
+    def validate_chunks(self, ext: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Read the first ``sniff_bytes`` of a chunk stream and check them.
+
+        The head is read eagerly (so a bad file is rejected before anything is
+        sent on); the returned iterator yields the full, unchanged stream and
+        raises UploadValidationError once it outgrows the size limit for ``ext``.
+        """
+        chunks = iter(chunks)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= self.sniff_bytes:
+                break
+        self.check_content(ext, head)
+        return self._limited(ext, chain((head,) if head else (), chunks))
+
+    def _limited(self, ext: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass the chunks through, checking the running size against the limit for ``ext``."""
+        received = 0
+        for chunk in chunks:
+            received += len(chunk)
+            self.check_size(ext, received, settings.MAX_CONTENT_LENGTH)
+            yield chunk
+
+    async def avalidate_chunks(self, ext: str, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """Async version of validate_chunks."""
+        chunks = chunks.__aiter__()
+        head = b""
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= self.sniff_bytes:
+                break
+        self.check_content(ext, head)
+
+        async def rest():
+            received = len(head)
+            self.check_size(ext, received, settings.MAX_CONTENT_LENGTH)
+            if head:
+                yield head
+            async for chunk in chunks:
+                received += len(chunk)
+                self.check_size(ext, received, settings.MAX_CONTENT_LENGTH)
+                yield chunk
+        return rest()
+
+    def read_head(self, ext: str, stream, limit: Optional[int] = None) -> "PrefixedStream":
+        """
+        Read and check the first bytes of a readable stream.
+
+        Returns:
+            PrefixedStream: Reads the checked bytes back before the rest of ``stream``.
+        """
+        wanted = self.sniff_bytes if limit is None else min(self.sniff_bytes, limit)
+        head = b""
+        while len(head) < wanted:
+            data = stream.read(wanted - len(head))
+            if not data:
+                break
+            head += data
+        self.check_content(ext, head)
+        return PrefixedStream(head, stream)
+
+
+class PrefixedStream:
+    """Readable stream that returns ``prefix`` before continuing with ``stream``."""
+
+    def __init__(self, prefix: bytes, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if self._prefix:
+            if size is None or size < 0:
+                data, self._prefix = self._prefix + self._stream.read(), b""
+                return data
+            data, self._prefix = self._prefix[:size], self._prefix[size:]
+            return data
+        return self._stream.read(size)
+
+
+class SniffingFile:
+    """
+    Writable file wrapper used by Werkzeug's multipart parser: checks the
+    first bytes written before more of the part is spooled, and stops the
+    part once it outgrows the size limit for its type.
+    """
+
+    def __init__(self, file, ext: str, validator: UploadValidator):
+        self._file = file
+        self._ext = ext
+        self._validator = validator
+        self._head = b""
+        self._checked = False
+        self._written = 0
+
+    def write(self, data: bytes) -> int:
+        self._written += len(data)
+        self._validator.check_size(self._ext, self._written, settings.MAX_CONTENT_LENGTH)
+        if not self._checked:
+            self._head += data[:self._validator.sniff_bytes]
+            if len(self._head) >= self._validator.sniff_bytes:
+                self._check()
+        return self._file.write(data)
+
+    def seek(self, *args):
+        # The parser rewinds the file once the part is complete; files shorter
+        # than the sniff window are checked here
+        if not self._checked:
+            self._check()
+        return self._file.seek(*args)
+
+    def _check(self) -> None:
+        self._checked = True
+        self._validator.check_content(self._ext, self._head)
+        self._head = b""
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class ValidatingRequest(Request):
+    """
+    Request whose multipart parser validates each file part before spooling it.
+
+    The extension and the part's declared size (browsers rarely send one) are
+    checked when its headers have been parsed, the content once its first
+    bytes arrive and the size as it is written; failures raise
+    UploadValidationError out of ``request.files``. Parts are spooled to
+    staging area spill files charged to the request's staging reservation,
+    which is released when the request is closed.
+    """
+
+    staging_reservation: Optional[StagingReservation] = None
+
+    def reserve_staging(self, nbytes: int) -> None:
+        """Reserve staging space for the request's files before the body is read (raises StagingQuotaExceeded)."""
+        if self.staging_reservation is None:
+            self.staging_reservation = staging_area.request_reservation(nbytes)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        self.reserve_staging(0)
+        stream = staging_area.spill_file(self.staging_reservation)
+        if not filename:
+            return stream # No file chosen; the route reports that itself
+        # The request's total length covers every part, so it says nothing about this one
+        ext = upload_validator.check_part(secure_filename(filename), content_length)
+        return SniffingFile(stream, ext, upload_validator)
+
+    def close(self) -> None:
+        super().close()
+        if self.staging_reservation is not None:
+            self.staging_reservation.release()
+
+# Create validator instance for use in the application
+upload_validator = UploadValidator()
@@ -0,0 +1,18 @@
+/**
+ * Web Worker computing SHA-256 digests of files and file chunks, so reading
+ * and hashing large data never blocks the page.
+ *
+ * Message in:  { id, blob }          (a File or a Blob slice of one)
+ * Message out: { id, sha256 }        (lowercase hex digest)
+ *          or: { id, error }
+ */
+self.addEventListener('message', async (event) => {
+    const { id, blob } = event.data;
+    try {
+        const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        const sha256 = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+        self.postMessage({ id, sha256 });
+    } catch (err) {
+        self.postMessage({ id, error: String(err) });
+    }
+});
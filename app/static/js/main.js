@@ -14,10 +14,31 @@ document.addEventListener('DOMContentLoaded', function() {
     const downloadLinkInput = document.getElementById('download-link');
     const copyButton = document.getElementById('copy-button');
     const uploadAnotherButton = document.getElementById('upload-another');
+    const successText = document.getElementById('success-text');
+    const batchResultsList = document.getElementById('batch-results');
     const toast = document.getElementById('toast');
     const toastMessage = document.getElementById('toast-message');
 
     let currentXhr = null; // To hold the current upload request
+    let currentUpload = null; // Cancellation token of the current chunked/queued upload
+    const activeChunkXhrs = new Set(); // Chunk requests of a parallel upload
+
+    // Files larger than this use the resumable chunked protocol (/uploads)
+    const RESUMABLE_THRESHOLD = 8 * 1024 * 1024; // 8MB
+    const MAX_CHUNK_RETRIES = 8; // Consecutive failures before giving up
+    // Files up to this size are hashed first to ask the server for an existing link
+    const PREHASH_MAX_SIZE = 256 * 1024 * 1024; // 256MB
+    // How often the server -> DDownload transfer progress is polled
+    const PROGRESS_POLL_INTERVAL = 500; // ms
+    const TRANSFER_LABEL = 'جارٍ النقل إلى خادم التخزين'; // Transferring to storage server
+    // Most files sent in one /upload/batch request (the server's BATCH_MAX_FILES)
+    const BATCH_MAX_FILES = 50;
+    // Chunks of a parallel upload in flight at once; tuned between these from the throughput
+    const MIN_PARALLEL_CHUNKS = 1;
+    const MAX_PARALLEL_CHUNKS = 8;
+    const INITIAL_PARALLEL_CHUNKS = 2;
+    // Hashing runs in this Web Worker (fingerprinted URL from the page)
+    const HASH_WORKER_URL = document.querySelector('script[data-hash-worker]')?.dataset.hashWorker;
 
     // --- Event Listeners Setup --- //
 
@@ -82,13 +103,24 @@ document.addEventListener('DOMContentLoaded', function() {
     // --- Core Logic Functions --- //
 
     /**
-     * Handles the selection of a file (either by browse or drag/drop).
+     * Handles the selection of files (either by browse or drag/drop).
      * @param {FileList} files - The list of files selected.
      */
     function handleFileSelection(files) {
         if (!files || files.length === 0) return;
-        
-        const file = files[0]; // Handle only the first file
+
+        // Several files are sent together through the batch endpoint
+        if (files.length > 1) {
+            const selected = Array.from(files);
+            const totalSize = selected.reduce((sum, f) => sum + f.size, 0);
+            if (fileInfoDisplay) {
+                fileInfoDisplay.textContent = `الملفات المحددة: ${selected.length} (${formatFileSize(totalSize)})`;
+            }
+            uploadBatch(selected);
+            return;
+        }
+
+        const file = files[0];
 
         // Optional: Basic client-side validation (e.g., file size)
         // const maxSize = 500 * 1024 * 1024; // 500MB (example)
@@ -101,8 +133,34 @@ document.addEventListener('DOMContentLoaded', function() {
             fileInfoDisplay.textContent = `الملف المحدد: ${file.name} (${formatFileSize(file.size)})`;
         }
         
-        // Start the upload process
-        uploadFile(file);
+        // Ask the server whether this exact file was uploaded before,
+        // then start the upload process only if it was not
+        findExistingUpload(file).then((link) => {
+            if (link) {
+                showResult(link);
+            } else {
+                uploadFile(file);
+            }
+        });
+    }
+
+    /**
+     * Pre-upload dedup handshake: hashes the file with SHA-256 and asks the
+     * server for an existing download link for the same content.
+     * @param {File} file - The file to check.
+     * @returns {Promise<string|null>} - Existing download link, or null.
+     */
+    async function findExistingUpload(file) {
+        // WebCrypto is only available in secure contexts (HTTPS/localhost)
+        if (!window.crypto?.subtle || file.size > PREHASH_MAX_SIZE) return null;
+        try {
+            const sha256 = await sha256Hex(file);
+            const response = await requestJSON('POST', '/upload/lookup', { sha256, size: file.size, filename: file.name });
+            return response.found ? response.download_link : null;
+        } catch (err) {
+            console.warn('Dedup lookup skipped:', err);
+            return null; // Never block the upload on the handshake
+        }
     }
 
     /**
@@ -115,6 +173,17 @@ document.addEventListener('DOMContentLoaded', function() {
             currentXhr.abort();
             currentXhr = null;
         }
+        if (currentUpload) {
+            currentUpload.cancelled = true;
+            currentUpload = null;
+        }
+        activeChunkXhrs.forEach(xhr => xhr.abort());
+
+        // Large files are sent in resumable chunks instead of one request
+        if (file.size > RESUMABLE_THRESHOLD) {
+            uploadResumable(file);
+            return;
+        }
         
         // Prepare FormData
         const formData = new FormData();
@@ -123,6 +192,8 @@ document.addEventListener('DOMContentLoaded', function() {
         // Create and configure XMLHttpRequest
         const xhr = new XMLHttpRequest();
         currentXhr = xhr;
+        const uploadId = newUploadId();
+        let stopWatching = () => {};
 
         // Progress event listener
         xhr.upload.addEventListener('progress', (e) => {
@@ -131,6 +202,12 @@ document.addEventListener('DOMContentLoaded', function() {
                 updateProgress(percentComplete);
             }
         });
+
+        // Browser -> server leg finished: follow the server -> DDownload leg
+        xhr.upload.addEventListener('load', () => {
+            stopWatching = watchTransfer(uploadId);
+        });
+        xhr.addEventListener('loadend', () => stopWatching());
         
         // Load (success) event listener
         xhr.addEventListener('load', () => {
@@ -138,7 +215,23 @@ document.addEventListener('DOMContentLoaded', function() {
             if (xhr.status >= 200 && xhr.status < 300) {
                 try {
                     const response = JSON.parse(xhr.responseText);
-                    if (response.status === 'success' && response.download_link) {
+                    if (xhr.status === 202 && response.status_url) {
+                        // Queued on the server: wait for the transfer to DDownload
+                        const token = { cancelled: false };
+                        currentUpload = token;
+                        waitForJob(response.status_url, token)
+                            .then((link) => {
+                                if (token.cancelled) return;
+                                currentUpload = null;
+                                showResult(link);
+                            })
+                            .catch((err) => {
+                                if (token.cancelled) return;
+                                currentUpload = null;
+                                showToast(err.message || 'فشل رفع الملف.', 'error');
+                                resetUploadForm();
+                            });
+                    } else if (response.status === 'success' && response.download_link) {
                         showResult(response.download_link);
                     } else {
                         // Use error message from server response
@@ -182,6 +275,7 @@ document.addEventListener('DOMContentLoaded', function() {
         xhr.open('POST', '/upload', true); // Use true for asynchronous
         // Optional: Set headers if needed (e.g., CSRF token)
         // xhr.setRequestHeader('X-CSRFToken', getCookie('csrftoken')); 
+        xhr.setRequestHeader('X-Upload-Id', uploadId);
         xhr.send(formData);
         
         // Update UI to show progress
@@ -191,6 +285,607 @@ document.addEventListener('DOMContentLoaded', function() {
         updateProgress(0); // Start progress at 0%
     }
 
+    // --- Multi-file (Batch) Upload --- //
+
+    /**
+     * Uploads several files through /upload/batch, which sends them on to
+     * DDownload concurrently. Large files are first sent in resumable chunks
+     * and referenced by session id; the rest travel in one multipart request.
+     * The progress bar covers all files together.
+     * @param {File[]} files - The files to upload.
+     */
+    async function uploadBatch(files) {
+        if (files.length > BATCH_MAX_FILES) {
+            showToast(`يمكن رفع ${BATCH_MAX_FILES} ملفاً كحد أقصى في المرة الواحدة.`, 'error');
+            resetUploadForm();
+            return;
+        }
+        resetUploadForm(); // Cancel any ongoing upload
+        const token = { cancelled: false };
+        currentUpload = token;
+
+        if (uploadArea) uploadArea.style.display = 'none';
+        if (resultContainer) resultContainer.style.display = 'none';
+        if (progressContainer) progressContainer.style.display = 'block';
+        updateProgress(0);
+
+        const large = files.filter(f => f.size > RESUMABLE_THRESHOLD);
+        const small = files.filter(f => f.size <= RESUMABLE_THRESHOLD);
+        const totalSize = files.reduce((sum, f) => sum + f.size, 0) || 1;
+        let sentBefore = 0; // Bytes of large files already on the server
+
+        try {
+            const formData = new FormData();
+            small.forEach(f => formData.append('files', f));
+            for (const file of large) {
+                const sessionId = await sendResumableChunks(file, token, (done) => {
+                    updateProgress(Math.round(((sentBefore + done) / totalSize) * 100));
+                });
+                if (token.cancelled) return;
+                formData.append('upload_id', sessionId);
+                sentBefore += file.size;
+            }
+
+            const batchId = newUploadId();
+            const response = await sendBatch(formData, batchId, (loaded, total) => {
+                const smallSent = total ? (loaded / total) * (totalSize - sentBefore) : 0;
+                updateProgress(Math.round(((sentBefore + smallSent) / totalSize) * 100));
+            });
+            if (token.cancelled) return;
+
+            // Results come back in request order: form parts, then sessions
+            const ordered = small.concat(large);
+            let results = response.results || [];
+            results.forEach((result, i) => {
+                if (ordered[i] && result.status !== 'error' && ordered[i].size > RESUMABLE_THRESHOLD) {
+                    localStorage.removeItem(resumableStorageKey(ordered[i]));
+                }
+            });
+            if (response.status === 'accepted' || results.some(r => r.status === 'accepted')) {
+                results = await waitForBatchJobs(results, token);
+                if (token.cancelled) return;
+            }
+            if (currentUpload === token) currentUpload = null;
+            showBatchResult(results);
+        } catch (err) {
+            if (token.cancelled) return;
+            console.error('Batch upload failed:', err);
+            if (currentUpload === token) currentUpload = null;
+            showToast(err.message || 'حدث خطأ في الشبكة أثناء محاولة الرفع.', 'error');
+            resetUploadForm();
+        }
+    }
+
+    /**
+     * Posts the batch form with XMLHttpRequest (for upload progress events),
+     * following the server -> DDownload leg once the body is sent.
+     * @param {FormData} formData - The ``files`` parts and ``upload_id`` fields.
+     * @param {string} batchId - Id the server publishes aggregate progress under.
+     * @param {Function} onProgress - Called with (loaded, total) bytes of the request body.
+     * @returns {Promise<Object>} - The batch response (rejects if nothing was uploaded).
+     */
+    function sendBatch(formData, batchId, onProgress) {
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            currentXhr = xhr;
+            let stopWatching = () => {};
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) onProgress(e.loaded, e.total);
+            });
+            xhr.upload.addEventListener('load', () => {
+                stopWatching = watchTransfer(batchId);
+            });
+            xhr.addEventListener('loadend', () => stopWatching());
+            xhr.addEventListener('load', () => {
+                currentXhr = null;
+                let response = {};
+                try { response = JSON.parse(xhr.responseText); } catch (e) { /* Ignore */ }
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(response);
+                } else if (response.results) {
+                    resolve(response); // Every file failed: still show why
+                } else {
+                    reject(new Error(response.message || `فشل الرفع: ${xhr.statusText} (${xhr.status})`));
+                }
+            });
+            xhr.addEventListener('error', () => { currentXhr = null; reject(new Error('حدث خطأ في الشبكة أثناء محاولة الرفع.')); });
+            xhr.addEventListener('abort', () => { currentXhr = null; reject(new Error('Upload aborted')); });
+            xhr.open('POST', '/upload/batch', true);
+            xhr.setRequestHeader('X-Upload-Id', batchId);
+            xhr.send(formData);
+        });
+    }
+
+    /**
+     * Waits for the jobs of a batch queued on the server to finish.
+     * @param {Object[]} results - Batch results, queued files carry a status_url.
+     * @param {Object} token - Cancellation token.
+     * @returns {Promise<Object[]>} - The results with each job's final outcome.
+     */
+    async function waitForBatchJobs(results, token) {
+        if (progressText) progressText.textContent = 'جارٍ نقل الملفات إلى خادم التخزين...'; // Transferring to storage
+        return Promise.all(results.map(async (result) => {
+            if (!result.status_url) return result;
+            try {
+                const link = await waitForJob(result.status_url, token);
+                return { filename: result.filename, status: 'success', download_link: link };
+            } catch (err) {
+                return { filename: result.filename, status: 'error', message: err.message };
+            }
+        }));
+    }
+
+    // --- Resumable (Chunked) Upload --- //
+
+    /**
+     * Uploads a large file in chunks through the resumable protocol.
+     * Failed chunks are retried with backoff, resuming from the offset the
+     * server last acknowledged. The session id is kept in localStorage so an
+     * upload interrupted by a page reload continues where it stopped.
+     * @param {File} file - The file to upload.
+     */
+    async function uploadResumable(file) {
+        const token = { cancelled: false };
+        currentUpload = token;
+        const storageKey = resumableStorageKey(file);
+
+        if (uploadArea) uploadArea.style.display = 'none';
+        if (resultContainer) resultContainer.style.display = 'none';
+        if (progressContainer) progressContainer.style.display = 'block';
+        updateProgress(0);
+
+        try {
+            const sessionId = await sendResumableChunks(file, token, (done) => {
+                updateProgress(Math.round((done / file.size) * 100));
+            });
+            if (token.cancelled) return;
+            const uploadId = newUploadId();
+            const stopWatching = watchTransfer(uploadId);
+            let response;
+            try {
+                response = await requestJSON('POST', `/uploads/${sessionId}/complete`, undefined, { 'X-Upload-Id': uploadId });
+            } finally {
+                stopWatching();
+            }
+            localStorage.removeItem(storageKey);
+            const link = response.status_url ? await waitForJob(response.status_url, token) : response.download_link;
+            if (token.cancelled) return;
+            if (currentUpload === token) currentUpload = null;
+            showResult(link);
+        } catch (err) {
+            if (token.cancelled) return;
+            console.error('Resumable upload failed:', err);
+            if (err.status === 404) localStorage.removeItem(storageKey);
+            if (currentUpload === token) currentUpload = null;
+            showToast(err.message || 'حدث خطأ في الشبكة أثناء محاولة الرفع.', 'error');
+            resetUploadForm();
+        }
+    }
+
+    /**
+     * Sends all chunks of a file through a resumable session, without
+     * completing it.
+     * @param {File} file - The file to upload.
+     * @param {Object} token - Cancellation token; sending stops when cancelled.
+     * @param {Function} onProgress - Called with the number of bytes the server holds.
+     * @returns {Promise<string>} - The resumable session id.
+     */
+    async function sendResumableChunks(file, token, onProgress) {
+        const session = await getOrCreateSession(file, resumableStorageKey(file));
+        if (session.parallel) return sendParallelChunks(session, file, token, onProgress);
+        let offset = session.offset;
+        let failures = 0;
+
+        while (offset < file.size && !token.cancelled) {
+            const chunk = file.slice(offset, offset + session.chunk_size);
+            const chunkStart = offset;
+            try {
+                offset = await sendChunk(session.upload_id, offset, chunk, (loaded) => onProgress(chunkStart + loaded));
+                failures = 0;
+            } catch (err) {
+                if (token.cancelled) break;
+                if (err.status === 429) {
+                    // Rate limited: wait as asked, without counting it as a failure
+                    await sleep(Math.max(err.retryAfter, 1) * 1000);
+                    continue;
+                }
+                if (err.fatal || ++failures > MAX_CHUNK_RETRIES) throw err;
+                console.warn(`Chunk at ${offset} failed (attempt ${failures}), resuming...`, err);
+                await sleep(Math.min(1000 * 2 ** (failures - 1), 30000));
+                // Resume from whatever the server actually stored
+                try {
+                    offset = (await requestJSON('GET', `/uploads/${session.upload_id}`)).offset;
+                } catch (statusErr) {
+                    if (statusErr.status === 404) throw statusErr; // Session expired
+                    // Still offline: retry the same offset on the next pass
+                }
+            }
+            onProgress(offset);
+        }
+        return session.upload_id;
+    }
+
+    /**
+     * Sends the missing chunks of a parallel session, several at a time.
+     * Each chunk is hashed in the Web Worker while others are on the wire,
+     * and written by the server at its own position, so chunks may finish in
+     * any order. The number in flight follows the measured throughput
+     * (see ConcurrencyTuner), which keeps long, fast links full.
+     * @param {Object} session - Parallel session with upload_id, chunk_size and missing.
+     * @param {File} file - The file to upload.
+     * @param {Object} token - Cancellation token; sending stops when cancelled.
+     * @param {Function} onProgress - Called with the number of bytes sent or stored.
+     * @returns {Promise<string>} - The resumable session id.
+     */
+    function sendParallelChunks(session, file, token, onProgress) {
+        const chunkSize = session.chunk_size;
+        const chunkLength = (index) => Math.min(chunkSize, file.size - index * chunkSize);
+        const pending = [...session.missing];
+        const inFlight = new Map(); // Chunk index -> bytes of it sent so far
+        const tuner = new ConcurrencyTuner(INITIAL_PARALLEL_CHUNKS);
+        let stored = file.size - pending.reduce((sum, index) => sum + chunkLength(index), 0);
+        let failures = 0;
+        let active = 0;
+
+        const report = () => {
+            let sending = 0;
+            inFlight.forEach(bytes => { sending += bytes; });
+            onProgress(stored + sending);
+        };
+
+        return new Promise((resolve, reject) => {
+            let failed = false;
+            const pump = () => {
+                if (failed) return;
+                if (token.cancelled || (!pending.length && !active)) {
+                    resolve(session.upload_id);
+                    return;
+                }
+                while (active < tuner.concurrency && pending.length) {
+                    const index = pending.shift();
+                    active++;
+                    inFlight.set(index, 0);
+                    sendPart(session.upload_id, file.slice(index * chunkSize, index * chunkSize + chunkLength(index)), index,
+                        (loaded) => { inFlight.set(index, loaded); report(); })
+                        .then(() => {
+                            stored += chunkLength(index);
+                            tuner.record(chunkLength(index));
+                            failures = 0;
+                        }, async (err) => {
+                            if (token.cancelled) return;
+                            if (err.status === 429) {
+                                // Rate limited: fewer streams, wait as asked, not a failure
+                                tuner.backOff();
+                                await sleep(Math.max(err.retryAfter, 1) * 1000);
+                            } else if (err.fatal || ++failures > MAX_CHUNK_RETRIES) {
+                                failed = true;
+                                reject(err);
+                                return;
+                            } else {
+                                console.warn(`Chunk ${index} failed (attempt ${failures}), retrying...`, err);
+                                await sleep(Math.min(1000 * 2 ** (failures - 1), 30000));
+                            }
+                            pending.unshift(index);
+                        })
+                        .finally(() => {
+                            inFlight.delete(index);
+                            active--;
+                            report();
+                            pump();
+                        });
+                }
+            };
+            report();
+            pump();
+        });
+    }
+
+    /**
+     * Hashes one chunk and sends it to its numbered slot of a parallel session.
+     * @param {string} uploadId - The resumable session id.
+     * @param {Blob} chunk - The chunk data.
+     * @param {number} index - The chunk number.
+     * @param {Function} onProgress - Called with the bytes of the chunk sent so far.
+     * @returns {Promise<void>}
+     */
+    async function sendPart(uploadId, chunk, index, onProgress) {
+        const sha256 = await sha256Hex(chunk).catch(() => null); // Unhashed chunks are still accepted
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            activeChunkXhrs.add(xhr);
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) onProgress(e.loaded);
+            });
+            xhr.addEventListener('loadend', () => activeChunkXhrs.delete(xhr));
+            xhr.addEventListener('load', () => {
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve();
+                    return;
+                }
+                let response = {};
+                try { response = JSON.parse(xhr.responseText); } catch (e) { /* Ignore */ }
+                const err = new Error(response.message || `فشل الرفع: ${xhr.statusText} (${xhr.status})`);
+                err.status = xhr.status;
+                err.retryAfter = parseInt(xhr.getResponseHeader('Retry-After'), 10) || 0;
+                // 460 (checksum mismatch) and 429 (rate limited) are worth sending again
+                err.fatal = xhr.status >= 400 && xhr.status < 500 && xhr.status !== 429 && xhr.status !== 460;
+                reject(err);
+            });
+            xhr.addEventListener('error', () => reject(new Error('حدث خطأ في الشبكة أثناء محاولة الرفع.')));
+            xhr.addEventListener('abort', () => reject(new Error('Upload aborted')));
+            xhr.open('PUT', `/uploads/${uploadId}/chunks/${index}`, true);
+            xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+            if (sha256) xhr.setRequestHeader('X-Chunk-Sha256', sha256);
+            xhr.send(chunk);
+        });
+    }
+
+    /**
+     * Picks how many chunks to keep in flight by hill climbing on throughput.
+     * After each round (as many chunks as are in flight) the round's
+     * throughput is compared with the previous one: if it rose by more than
+     * 10% one more stream is added, if it fell by more than 10% one is
+     * dropped, otherwise the level is kept.
+     */
+    class ConcurrencyTuner {
+        constructor(initial) {
+            this.concurrency = initial;
+            this.lastRate = 0;
+            this.startRound();
+        }
+
+        startRound() {
+            this.roundBytes = 0;
+            this.roundChunks = 0;
+            this.roundStart = performance.now();
+        }
+
+        /** @param {number} bytes - Size of a chunk that was stored. */
+        record(bytes) {
+            this.roundBytes += bytes;
+            if (++this.roundChunks < this.concurrency) return;
+            const rate = this.roundBytes / Math.max(performance.now() - this.roundStart, 1);
+            if (rate > this.lastRate * 1.1) {
+                this.concurrency = Math.min(this.concurrency + 1, MAX_PARALLEL_CHUNKS);
+            } else if (rate < this.lastRate * 0.9) {
+                this.concurrency = Math.max(this.concurrency - 1, MIN_PARALLEL_CHUNKS);
+            }
+            this.lastRate = rate;
+            this.startRound();
+        }
+
+        /** Halve the streams, e.g. after the server asked to slow down. */
+        backOff() {
+            this.concurrency = Math.max(Math.floor(this.concurrency / 2), MIN_PARALLEL_CHUNKS);
+            this.lastRate = 0;
+            this.startRound();
+        }
+    }
+
+    /**
+     * localStorage key remembering the resumable session of a file.
+     * @param {File} file
+     * @returns {string}
+     */
+    function resumableStorageKey(file) {
+        return `resumable:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    /**
+     * Resumes a stored upload session for this file or starts a new one.
+     * @param {File} file - The file being uploaded.
+     * @param {string} storageKey - localStorage key identifying the file.
+     * @returns {Promise<Object>} - Session with upload_id, offset and chunk_size.
+     */
+    async function getOrCreateSession(file, storageKey) {
+        const savedId = localStorage.getItem(storageKey);
+        if (savedId) {
+            try {
+                return await requestJSON('GET', `/uploads/${savedId}`);
+            } catch (err) {
+                localStorage.removeItem(storageKey); // Expired or unknown, start over
+            }
+        }
+        const session = await requestJSON('POST', '/uploads', { filename: file.name, size: file.size, parallel: true });
+        localStorage.setItem(storageKey, session.upload_id);
+        return session;
+    }
+
+    /**
+     * Sends one chunk with XMLHttpRequest (for progress events).
+     * @param {string} uploadId - The resumable session id.
+     * @param {number} offset - Offset of the chunk within the file.
+     * @param {Blob} chunk - The chunk data.
+     * @param {Function} onProgress - Called with the bytes of the chunk sent so far.
+     * @returns {Promise<number>} - The new offset acknowledged by the server.
+     */
+    function sendChunk(uploadId, offset, chunk, onProgress) {
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            currentXhr = xhr;
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) onProgress(e.loaded);
+            });
+            xhr.addEventListener('load', () => {
+                currentXhr = null;
+                let response = {};
+                try { response = JSON.parse(xhr.responseText); } catch (e) { /* Ignore */ }
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(response.offset);
+                } else {
+                    const err = new Error(response.message || `فشل الرفع: ${xhr.statusText} (${xhr.status})`);
+                    err.status = xhr.status;
+                    err.retryAfter = parseInt(xhr.getResponseHeader('Retry-After'), 10) || 0;
+                    // 409 (offset mismatch) is recoverable by re-reading the offset, 429 by waiting
+                    err.fatal = xhr.status >= 400 && xhr.status < 500 && xhr.status !== 409 && xhr.status !== 429;
+                    reject(err);
+                }
+            });
+            xhr.addEventListener('error', () => { currentXhr = null; reject(new Error('حدث خطأ في الشبكة أثناء محاولة الرفع.')); });
+            xhr.addEventListener('abort', () => { currentXhr = null; reject(new Error('Upload aborted')); });
+            xhr.open('PUT', `/uploads/${uploadId}`, true);
+            xhr.setRequestHeader('Upload-Offset', String(offset));
+            xhr.setRequestHeader('Content-Type', 'application/offset+octet-stream');
+            xhr.send(chunk);
+        });
+    }
+
+    /**
+     * Small fetch wrapper for the JSON endpoints of the resumable protocol.
+     * @param {string} method - HTTP method.
+     * @param {string} url - Endpoint URL.
+     * @param {Object} [body] - Optional JSON body.
+     * @param {Object} [headers] - Optional extra request headers.
+     * @returns {Promise<Object>} - Parsed JSON response (rejects on non-2xx).
+     */
+    async function requestJSON(method, url, body, headers = {}) {
+        const options = { method, headers: { ...headers } };
+        if (body !== undefined) {
+            options.headers['Content-Type'] = 'application/json';
+            options.body = JSON.stringify(body);
+        }
+        const res = await fetch(url, options);
+        let data = {};
+        try { data = await res.json(); } catch (e) { /* Ignore if response is not JSON */ }
+        if (!res.ok) {
+            const err = new Error(data.message || `فشل الرفع: ${res.statusText} (${res.status})`);
+            err.status = res.status;
+            err.fatal = res.status >= 400 && res.status < 500;
+            throw err;
+        }
+        return data;
+    }
+
+    /**
+     * Polls a queued upload job until the server finishes the transfer.
+     * @param {string} statusUrl - The job status URL returned with 202 Accepted.
+     * @param {Object} [token] - Cancellation token; polling stops when cancelled.
+     * @returns {Promise<string>} - The download link (rejects if the job failed).
+     */
+    async function waitForJob(statusUrl, token = null) {
+        if (progressText) progressText.textContent = 'جارٍ نقل الملف إلى خادم التخزين...'; // Transferring to storage
+        let failures = 0;
+        while (!token?.cancelled) {
+            await sleep(1000);
+            let job;
+            try {
+                job = await requestJSON('GET', statusUrl);
+                failures = 0;
+            } catch (err) {
+                if (err.status === 404 || ++failures > MAX_CHUNK_RETRIES) throw err;
+                continue;
+            }
+            if (job.state === 'done') return job.download_link;
+            if (job.state === 'failed') throw new Error(job.message || 'فشل رفع الملف.');
+            if (job.progress) showTransferProgress(job.progress);
+        }
+        throw new Error('Upload cancelled');
+    }
+
+    /**
+     * Generates the id the server publishes transfer progress under.
+     * @returns {string}
+     */
+    function newUploadId() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Date.now().toString(36) + Math.random().toString(36).slice(2, 12);
+    }
+
+    /**
+     * Polls /progress/<id> while the server forwards the file to DDownload.
+     * @param {string} uploadId - The id sent in the X-Upload-Id header.
+     * @returns {Function} - Call to stop polling.
+     */
+    function watchTransfer(uploadId) {
+        let stopped = false;
+        if (progressText) progressText.textContent = TRANSFER_LABEL + '...';
+        (async () => {
+            while (!stopped) {
+                await sleep(PROGRESS_POLL_INTERVAL);
+                if (stopped) break;
+                try {
+                    const res = await fetch(`/progress/${uploadId}`, { cache: 'no-store' });
+                    if (res.ok && !stopped) showTransferProgress(await res.json());
+                } catch (e) { /* Transient; the next poll retries */ }
+            }
+        })();
+        return () => { stopped = true; };
+    }
+
+    /**
+     * Shows a server-side progress record from /progress or a job status.
+     * @param {Object} progress - Record with bytes_sent, percent and phase.
+     */
+    function showTransferProgress(progress) {
+        if (progress.phase !== 'transferring') return;
+        if (progress.percent !== null && progress.percent !== undefined) {
+            updateProgress(progress.percent, TRANSFER_LABEL);
+        } else if (progressText) {
+            // Streaming uploads: the total is not known on the server
+            progressText.textContent = `${TRANSFER_LABEL} ${formatFileSize(progress.bytes_sent)}`;
+        }
+    }
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    // --- Hashing --- //
+
+    let hashWorker = null;
+    let hashWorkerFailed = false;
+    let nextHashId = 0;
+    const pendingHashes = new Map(); // Message id -> { resolve, reject }
+
+    /**
+     * SHA-256 of a File or Blob as lowercase hex, computed in the hash Web
+     * Worker (on the page itself where workers are unavailable).
+     * @param {Blob} blob - The data to hash.
+     * @returns {Promise<string>}
+     */
+    function sha256Hex(blob) {
+        const worker = getHashWorker();
+        if (!worker) {
+            return blob.arrayBuffer()
+                .then(buffer => crypto.subtle.digest('SHA-256', buffer))
+                .then(digest => Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join(''));
+        }
+        return new Promise((resolve, reject) => {
+            const id = ++nextHashId;
+            pendingHashes.set(id, { resolve, reject });
+            worker.postMessage({ id, blob });
+        });
+    }
+
+    /**
+     * Starts the hash worker on first use.
+     * @returns {Worker|null}
+     */
+    function getHashWorker() {
+        if (hashWorker || hashWorkerFailed || !HASH_WORKER_URL || !window.Worker) return hashWorker;
+        try {
+            hashWorker = new Worker(HASH_WORKER_URL);
+        } catch (err) {
+            hashWorkerFailed = true;
+            return null;
+        }
+        hashWorker.addEventListener('message', (e) => {
+            const request = pendingHashes.get(e.data.id);
+            if (!request) return;
+            pendingHashes.delete(e.data.id);
+            if (e.data.error) request.reject(new Error(e.data.error));
+            else request.resolve(e.data.sha256);
+        });
+        hashWorker.addEventListener('error', () => {
+            // Worker could not load: fail what is pending, hash on the page from now on
+            hashWorkerFailed = true;
+            hashWorker = null;
+            pendingHashes.forEach(request => request.reject(new Error('Hash worker failed')));
+            pendingHashes.clear();
+        });
+        return hashWorker;
+    }
+
     /**
      * Copies the download link to the clipboard.
      */
@@ -240,14 +935,15 @@ document.addEventListener('DOMContentLoaded', function() {
     /**
      * Updates the progress bar and text.
      * @param {number} percent - The percentage complete (0-100).
+     * @param {string} [label] - Optional phase label shown before the percentage.
      */
-    function updateProgress(percent) {
+    function updateProgress(percent, label = '') {
         if (progressBar) {
             progressBar.style.width = percent + '%';
             progressBar.setAttribute('aria-valuenow', percent); // Accessibility
         }
         if (progressText) {
-            progressText.textContent = percent + '%';
+            progressText.textContent = label ? `${label} ${percent}%` : percent + '%';
         }
     }
 
@@ -255,10 +951,59 @@ document.addEventListener('DOMContentLoaded', function() {
      * Shows the result section with the download link.
      * @param {string} link - The download link received from the server.
      */
+    /**
+     * Files kept on this server get links relative to it; make them
+     * absolute so they can be copied and shared.
+     * @param {string} link - Download link from the server.
+     * @returns {string} - Absolute download link.
+     */
+    function absoluteLink(link) {
+        return new URL(link, window.location.href).href;
+    }
+
     function showResult(link) {
         if (progressContainer) progressContainer.style.display = 'none';
         if (resultContainer) resultContainer.style.display = 'block';
-        if (downloadLinkInput) downloadLinkInput.value = link;
+        if (downloadLinkInput) downloadLinkInput.value = absoluteLink(link);
+        if (successText) successText.textContent = 'تم رفع الملف بنجاح!'; // File uploaded successfully
+        if (batchResultsList) batchResultsList.style.display = 'none';
+    }
+
+    /**
+     * Shows the per-file results of a batch upload. The link field holds
+     * all download links, so the copy button copies them together.
+     * @param {Object[]} results - Entries with filename, status and download_link or message.
+     */
+    function showBatchResult(results) {
+        const uploaded = results.filter(r => r.status === 'success');
+        if (progressContainer) progressContainer.style.display = 'none';
+        if (resultContainer) resultContainer.style.display = 'block';
+        if (successText) successText.textContent = `تم رفع ${uploaded.length} من ${results.length} ملفات`; // Uploaded X of Y files
+        if (downloadLinkInput) downloadLinkInput.value = uploaded.map(r => absoluteLink(r.download_link)).join(' ');
+        if (!batchResultsList) return;
+        batchResultsList.replaceChildren(...results.map((result) => {
+            const item = document.createElement('li');
+            const name = document.createElement('span');
+            name.textContent = result.filename;
+            item.appendChild(name);
+            if (result.status === 'success') {
+                const link = document.createElement('a');
+                link.href = link.textContent = absoluteLink(result.download_link);
+                link.target = '_blank';
+                link.rel = 'noopener';
+                item.appendChild(link);
+            } else {
+                const error = document.createElement('span');
+                error.className = 'error';
+                error.textContent = result.message || 'فشل رفع الملف.';
+                item.appendChild(error);
+            }
+            return item;
+        }));
+        batchResultsList.style.display = 'block';
+        if (uploaded.length < results.length) {
+            showToast(`تعذر رفع ${results.length - uploaded.length} من الملفات.`, 'error');
+        }
     }
 
     /**
@@ -272,12 +1017,22 @@ document.addEventListener('DOMContentLoaded', function() {
         if (progressContainer) progressContainer.style.display = 'none';
         if (resultContainer) resultContainer.style.display = 'none';
         if (downloadLinkInput) downloadLinkInput.value = '';
+        if (successText) successText.textContent = 'تم رفع الملف بنجاح!'; // File uploaded successfully
+        if (batchResultsList) {
+            batchResultsList.replaceChildren();
+            batchResultsList.style.display = 'none';
+        }
         
         // If an upload was in progress, abort it
+        if (currentUpload) {
+            currentUpload.cancelled = true;
+            currentUpload = null;
+        }
         if (currentXhr) {
             currentXhr.abort();
             currentXhr = null;
         }
+        activeChunkXhrs.forEach(xhr => xhr.abort());
     }
 
     /**
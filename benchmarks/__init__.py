@@ -0,0 +1,5 @@
+"""
+Benchmark harness for the upload pipeline.
+A local DDownload stand-in (fake_ddownload) and a load generator (run) that
+drives the app under different server configurations.
+"""
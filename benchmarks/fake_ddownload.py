@@ -0,0 +1,136 @@
+"""
+Fake DDownload service.
+Implements the two endpoints the uploader talks to, ``GET /api/upload/server``
+and the multipart upload URL it hands out, with configurable latency,
+bandwidth and error rates, so the app can be load-tested offline.
+
+Run standalone with:
+
+    python -m benchmarks.fake_ddownload --port 8765 --latency 0.05 --bandwidth 50M
+
+and point the app at it with ``DDOWNLOAD_API_URL=http://127.0.0.1:8765/api``.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Optional
+from aiohttp import web
+
+def parse_size(value: str) -> int:
+    """Parse sizes like ``512``, ``64K``, ``8M``, ``1G`` or ``50MB`` into bytes."""
+    value = value.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class FakeDDownload:
+    """Request handlers plus counters of the fake service."""
+
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[int] = None,
+                 error_rate: float = 0.0, server_error_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            latency: Seconds added before answering each request.
+            bandwidth: Upload bandwidth per connection in bytes/second (None = unlimited).
+            error_rate: Fraction of uploads answered with an API upload error.
+            server_error_rate: Fraction of /upload/server calls answered with an API error.
+            seed: Seed for the error sampling, for repeatable runs.
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self._random = random.Random(seed)
+        self.stats = {"server_lookups": 0, "uploads": 0, "upload_errors": 0, "bytes_received": 0}
+
+    async def upload_server(self, request: web.Request) -> web.Response:
+        """``GET /api/upload/server``: hand out an upload URL and session id."""
+        self.stats["server_lookups"] += 1
+        await asyncio.sleep(self.latency)
+        if not request.query.get("key"):
+            return web.json_response({"status": 403, "msg": "Invalid key"})
+        if self._random.random() < self.server_error_rate:
+            return web.json_response({"status": 500, "msg": "Simulated server assignment error"})
+        return web.json_response({
+            "status": 200,
+            "msg": "OK",
+            "result": f"{request.url.origin()}/upload/01",
+            "sess_id": uuid.uuid4().hex,
+        })
+
+    async def upload(self, request: web.Request) -> web.Response:
+        """Upload URL: consume the multipart body at the configured bandwidth."""
+        await asyncio.sleep(self.latency)
+        reader = await request.multipart()
+        started = time.monotonic()
+        received = 0
+        filename = None
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            if not part.filename:
+                await part.release()
+                continue
+            filename = part.filename
+            while True:
+                chunk = await part.read_chunk(64 * 1024)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if self.bandwidth:
+                    ahead = received / self.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+
+        self.stats["uploads"] += 1
+        self.stats["bytes_received"] += received
+        if filename is None:
+            return web.json_response([{"file_status": "No file", "error": "No file"}])
+        if self._random.random() < self.error_rate:
+            self.stats["upload_errors"] += 1
+            return web.json_response([{"file_status": "Error", "error": "Simulated upload error"}])
+        return web.json_response([{"file_status": "OK", "file_code": uuid.uuid4().hex[:12]}])
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def create_fake_app(**options) -> web.Application:
+    """Build the aiohttp application (options as for FakeDDownload)."""
+    fake = FakeDDownload(**options)
+    app = web.Application(client_max_size=0) # No body size limit
+    app.router.add_get("/api/upload/server", fake.upload_server)
+    app.router.add_post("/upload/01", fake.upload)
+    app.router.add_get("/stats", fake.get_stats)
+    app["fake"] = fake
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local DDownload stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=parse_size, default=None, help="per-upload bytes/second, e.g. 50M")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of uploads that fail")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction of /upload/server calls that fail")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_fake_app(
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        server_error_rate=args.server_error_rate,
+        seed=args.seed,
+    )
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Fake S3-compatible object store.
+Implements the calls the S3 storage backend makes, path-style
+(``/<bucket>/<key>``): PutObject, the multipart upload calls
+(CreateMultipartUpload, UploadPart, CompleteMultipartUpload,
+AbortMultipartUpload) and GetObject for presigned links, keeping objects in
+memory. Requests must be signed (or presigned), but signatures are not
+checked. Latency and bandwidth are configurable like the fake DDownload.
+
+Run standalone with:
+
+    python -m benchmarks.fake_s3 --port 9000
+
+and point the app at it with ``S3_ENDPOINT_URL=http://127.0.0.1:9000 S3_BUCKET=uploads``
+(plus ``STORAGE_DEFAULT_BACKEND=s3`` or a STORAGE_ROUTES rule).
+"""
+import argparse
+import asyncio
+import hashlib
+import re
+import time
+import uuid
+from typing import Dict, Optional
+from aiohttp import web
+from .fake_ddownload import parse_size
+
+def _error(status: int, code: str) -> web.Response:
+    return web.Response(status=status, content_type="application/xml",
+                        text=f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{code}</Code></Error>")
+
+
+class FakeS3:
+    """Request handlers plus objects and counters of the fake store."""
+
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[int] = None):
+        """
+        Args:
+            latency: Seconds added before answering each request.
+            bandwidth: Upload bandwidth per connection in bytes/second (None = unlimited).
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.objects: Dict[str, bytes] = {}
+        self.uploads: Dict[str, Dict[int, bytes]] = {} # Multipart upload id -> parts by number
+        self.stats = {"puts": 0, "multipart_uploads": 0, "parts": 0, "aborts": 0, "gets": 0, "bytes_received": 0}
+
+    async def _read_body(self, request: web.Request) -> bytes:
+        """Read the request body at the configured bandwidth."""
+        started = time.monotonic()
+        chunks = []
+        received = 0
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            received += len(chunk)
+            if self.bandwidth:
+                ahead = received / self.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        self.stats["bytes_received"] += received
+        return b"".join(chunks)
+
+    @staticmethod
+    def _signed(request: web.Request) -> bool:
+        return "Authorization" in request.headers or "X-Amz-Signature" in request.query
+
+    async def put(self, request: web.Request) -> web.Response:
+        """PutObject, or UploadPart with ``?partNumber=&uploadId=``."""
+        await asyncio.sleep(self.latency)
+        if not self._signed(request):
+            return _error(403, "AccessDenied")
+        body = await self._read_body(request)
+        etag = f"\"{hashlib.md5(body).hexdigest()}\""
+        upload_id = request.query.get("uploadId")
+        if upload_id is not None:
+            if upload_id not in self.uploads:
+                return _error(404, "NoSuchUpload")
+            self.uploads[upload_id][int(request.query.get("partNumber", 0))] = body
+            self.stats["parts"] += 1
+        else:
+            self.objects[request.path] = body
+            self.stats["puts"] += 1
+        return web.Response(headers={"ETag": etag})
+
+    async def post(self, request: web.Request) -> web.Response:
+        """CreateMultipartUpload (``?uploads``) or CompleteMultipartUpload (``?uploadId=``)."""
+        await asyncio.sleep(self.latency)
+        if not self._signed(request):
+            return _error(403, "AccessDenied")
+        if "uploads" in request.query:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            self.stats["multipart_uploads"] += 1
+            return web.Response(content_type="application/xml",
+                                text=f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        parts = self.uploads.pop(request.query.get("uploadId", ""), None)
+        if parts is None:
+            return _error(404, "NoSuchUpload")
+        numbers = [int(n) for n in re.findall(r"<PartNumber>(\d+)</PartNumber>", await request.text())]
+        if not numbers or any(n not in parts for n in numbers):
+            return _error(400, "InvalidPart")
+        self.objects[request.path] = b"".join(parts[n] for n in numbers)
+        return web.Response(content_type="application/xml",
+                            text=f"<CompleteMultipartUploadResult><Key>{request.path}</Key></CompleteMultipartUploadResult>")
+
+    async def delete(self, request: web.Request) -> web.Response:
+        """AbortMultipartUpload (``?uploadId=``) or DeleteObject."""
+        if not self._signed(request):
+            return _error(403, "AccessDenied")
+        if "uploadId" in request.query:
+            self.uploads.pop(request.query["uploadId"], None)
+            self.stats["aborts"] += 1
+        else:
+            self.objects.pop(request.path, None)
+        return web.Response(status=204)
+
+    async def get(self, request: web.Request) -> web.Response:
+        """GetObject (presigned links)."""
+        if not self._signed(request):
+            return _error(403, "AccessDenied")
+        body = self.objects.get(request.path)
+        if body is None:
+            return _error(404, "NoSuchKey")
+        self.stats["gets"] += 1
+        return web.Response(body=body, content_type="application/octet-stream")
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats, objects=len(self.objects), open_uploads=len(self.uploads)))
+
+
+def create_fake_app(**options) -> web.Application:
+    """Build the aiohttp application (options as for FakeS3)."""
+    fake = FakeS3(**options)
+    app = web.Application(client_max_size=0) # No body size limit
+    app.router.add_get("/stats", fake.get_stats)
+    app.router.add_put("/{bucket}/{key:.+}", fake.put)
+    app.router.add_post("/{bucket}/{key:.+}", fake.post)
+    app.router.add_delete("/{bucket}/{key:.+}", fake.delete)
+    app.router.add_get("/{bucket}/{key:.+}", fake.get)
+    app["fake"] = fake
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local S3-compatible stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=parse_size, default=None, help="per-request bytes/second, e.g. 50M")
+    args = parser.parse_args()
+
+    app = create_fake_app(latency=args.latency, bandwidth=args.bandwidth)
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Upload load test.
+Starts the fake DDownload service, then for each server configuration starts
+the app, fires concurrent uploads of mixed sizes at ``/upload`` and reports
+p50/p95/p99 latency, uploads/sec, MB/s and peak RSS of the server processes.
+
+    python -m benchmarks.run --requests 200 --concurrency 32 --sizes 64K,1M,8M
+    python -m benchmarks.run --configs gevent,asgi --workers 4 --latency 0.05 --bandwidth 20M --json results.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import aiohttp
+from .fake_ddownload import parse_size
+
+ROOT = Path(__file__).resolve().parent.parent
+ZIP_MAGIC = b"PK\x03\x04" # Uploads are named .zip and must look like one
+
+# name -> (command, extra environment); {port} and {workers} are filled in
+CONFIGS = {
+    "gevent": (["gunicorn", "--config", "gunicorn.conf.py", "app:create_app()"], {"WORKER_CLASS": "gevent"}),
+    "gevent-stream": (["gunicorn", "--config", "gunicorn.conf.py", "app:create_app()"],
+                      {"WORKER_CLASS": "gevent", "STREAMING_UPLOADS": "true"}),
+    "gthread": (["gunicorn", "--config", "gunicorn.conf.py", "--threads", "4", "app:create_app()"], {"WORKER_CLASS": "gthread"}),
+    "asgi": (["uvicorn", "--factory", "app.asgi:create_asgi_app", "--host", "127.0.0.1", "--port", "{port}",
+              "--workers", "{workers}", "--log-level", "warning"], {}),
+}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def process_tree_rss(root_pid: int) -> Dict[int, int]:
+    """Resident set size in bytes of a process and all its descendants (Linux /proc)."""
+    children = {}
+    rss = {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{entry}/statm") as f:
+                resident = int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry)) # fields[1] is the parent pid
+        rss[int(entry)] = resident
+
+    tree = {}
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        if pid in rss:
+            tree[pid] = rss[pid]
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+class RSSSampler(threading.Thread):
+    """Background sampler recording the peak total and per-process RSS of a process tree."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_process = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            tree = process_tree_rss(self.pid)
+            if tree:
+                self.peak_total = max(self.peak_total, sum(tree.values()))
+                self.peak_process = max(self.peak_process, max(tree.values()))
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def start_process(command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        command,
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True, # Own process group, so workers are stopped too
+    )
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+async def wait_until_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+async def drive_uploads(base_url: str, sizes: List[int], total: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Send ``total`` uploads with at most ``concurrency`` in flight.
+
+    Sizes are used round-robin; every payload gets a random prefix so
+    deduplication never short-circuits a transfer, after a zip signature so
+    it passes the upload content check.
+    """
+    payloads = {size: os.urandom(size) for size in set(sizes)}
+    latencies = []
+    failures = {}
+    sent_bytes = 0
+    counter = iter(range(total))
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        nonlocal sent_bytes
+        for i in counter:
+            size = sizes[i % len(sizes)]
+            body = ZIP_MAGIC + os.urandom(16) + payloads[size][len(ZIP_MAGIC) + 16:]
+            form = aiohttp.FormData()
+            form.add_field("file", body, filename=f"bench_{i}.zip", content_type="application/octet-stream")
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{base_url}/upload", data=form) as response:
+                    result = await response.json(content_type=None)
+                    ok = response.status == 200 and result.get("status") == "success"
+                    reason = f"HTTP {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                ok, reason = False, type(e).__name__
+            elapsed = time.perf_counter() - started
+            if ok:
+                latencies.append(elapsed)
+                sent_bytes += len(body)
+            else:
+                failures[reason] = failures.get(reason, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "ok": len(latencies),
+        "failures": failures,
+        "wall_seconds": round(wall, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "uploads_per_sec": round(len(latencies) / wall, 2) if wall else 0.0,
+        "mb_per_sec": round(sent_bytes / wall / (1024 * 1024), 2) if wall else 0.0,
+    }
+
+
+def run_config(name: str, workers: int, args, fake_url: str) -> Dict[str, Any]:
+    """Start one app configuration, load it and tear it down."""
+    command, extra_env = CONFIGS[name]
+    port = free_port()
+    command = [part.format(port=port, workers=workers) for part in command]
+    env = dict(
+        os.environ,
+        DDOWNLOAD_API_KEY="benchmark",
+        DDOWNLOAD_API_URL=f"{fake_url}/api",
+        DEDUP_ENABLED="true" if args.dedup else "false",
+        RATE_LIMIT_ENABLED="true" if args.rate_limit else "false",
+        BIND=f"127.0.0.1:{port}",
+        WEB_CONCURRENCY=str(workers),
+        **extra_env,
+    )
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    base_url = f"http://127.0.0.1:{port}"
+    process = start_process(command, env)
+    sampler = RSSSampler(process.pid)
+    try:
+        asyncio.run(wait_until_ready(base_url + "/"))
+        sampler.start()
+        result = asyncio.run(drive_uploads(base_url, args.sizes, args.requests, args.concurrency))
+    finally:
+        if sampler.is_alive():
+            sampler.stop()
+        stop_process(process)
+
+    result.update(
+        config=f"{name}-w{workers}",
+        peak_rss_mb=round(sampler.peak_total / (1024 * 1024), 1),
+        peak_process_rss_mb=round(sampler.peak_process / (1024 * 1024), 1),
+    )
+    return result
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    header = f"{'config':<20} {'ok':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'up/s':>8} {'MB/s':>8} {'RSS MB':>8} {'max/proc':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['config']:<20} {str(r['ok']) + '/' + str(r['requests']):>9} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+            f"{r['p99_ms']:>9} {r['uploads_per_sec']:>8} {r['mb_per_sec']:>8} {r['peak_rss_mb']:>8} {r['peak_process_rss_mb']:>9}"
+        )
+        if r["failures"]:
+            print(f"{'':<20} failures: {r['failures']}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load test the upload pipeline against a fake DDownload")
+    parser.add_argument("--configs", default="gevent,gevent-stream,asgi",
+                        help=f"comma-separated server configurations ({', '.join(CONFIGS)})")
+    parser.add_argument("--workers", default="2", help="comma-separated worker counts to try, e.g. 1,2,4")
+    parser.add_argument("--requests", type=int, default=200, help="uploads per configuration")
+    parser.add_argument("--concurrency", type=int, default=32, help="uploads in flight at once")
+    parser.add_argument("--sizes", default="64K,1M,8M",
+                        type=lambda value: [parse_size(s) for s in value.split(",")],
+                        help="comma-separated upload sizes, used round-robin")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake DDownload latency per request (s)")
+    parser.add_argument("--bandwidth", default=None, help="fake DDownload bandwidth per upload, e.g. 20M")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake uploads that fail")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction of fake server lookups that fail")
+    parser.add_argument("--dedup", action="store_true", help="keep content deduplication enabled")
+    parser.add_argument("--rate-limit", action="store_true", help="keep per-client rate limiting enabled")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    fake_port = free_port()
+    fake_command = [sys.executable, "-m", "benchmarks.fake_ddownload", "--port", str(fake_port),
+                    "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+                    "--server-error-rate", str(args.server_error_rate), "--seed", "1"]
+    if args.bandwidth:
+        fake_command += ["--bandwidth", args.bandwidth]
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    fake = start_process(fake_command, dict(os.environ))
+
+    results = []
+    try:
+        asyncio.run(wait_until_ready(fake_url + "/stats"))
+        for name in args.configs.split(","):
+            if name not in CONFIGS:
+                parser.error(f"unknown configuration: {name}")
+            for workers in (int(w) for w in args.workers.split(",")):
+                print(f"Running {name} with {workers} worker(s)...", file=sys.stderr)
+                results.append(run_config(name, workers, args, fake_url))
+    finally:
+        stop_process(fake)
+
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
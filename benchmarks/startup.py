@@ -0,0 +1,210 @@
+"""
+Startup benchmark.
+Reports how long a fresh interpreter takes to ``import app`` and to run
+create_app() (plus the heaviest imports with --top), then for each server
+configuration the cold start: time from launch to the first answered request
+and to the first completed upload, and the memory of the process tree once
+warm (PSS, which splits shared pages between the processes sharing them).
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --top 15 --configs gevent,gevent-preload --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+from .run import CONFIGS, ROOT, drive_uploads, free_port, process_tree_rss, start_process, stop_process, wait_until_ready
+
+STARTUP_CONFIGS = {
+    **CONFIGS,
+    "gevent-preload": (CONFIGS["gevent"][0], {**CONFIGS["gevent"][1], "PRELOAD_APP": "true"}),
+    "gthread-preload": (CONFIGS["gthread"][0], {**CONFIGS["gthread"][1], "PRELOAD_APP": "true"}),
+}
+
+# Timed in a fresh interpreter; prints one JSON line
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "modules": len(sys.modules),
+    "aiohttp": "aiohttp" in sys.modules,
+    "requests": "requests" in sys.modules,
+}))
+"""
+
+
+def app_env(extra: Dict[str, str] = None) -> Dict[str, str]:
+    return dict(os.environ, DDOWNLOAD_API_KEY="benchmark", PYTHONPATH=str(ROOT), **(extra or {}))
+
+
+def measure_imports(runs: int) -> Dict[str, Any]:
+    """Median import and create_app() times over ``runs`` fresh interpreters."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, env=app_env(),
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "runs": runs,
+        "import_ms": round(statistics.median(s["import_ms"] for s in samples), 1),
+        "create_app_ms": round(statistics.median(s["create_app_ms"] for s in samples), 1),
+        "modules": samples[-1]["modules"],
+        "aiohttp_loaded": samples[-1]["aiohttp"],
+        "requests_loaded": samples[-1]["requests"],
+    }
+
+
+def heaviest_imports(top: int) -> List[Dict[str, Any]]:
+    """The ``top`` imports of ``import app`` by cumulative time (-X importtime)."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=app_env(),
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        rows.append({"module": name, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def process_tree_memory(root_pid: int) -> Dict[str, int]:
+    """Summed PSS and private (unshared) bytes of a process tree (Linux smaps_rollup)."""
+    totals = {"pss": 0, "private": 0}
+    for pid in process_tree_rss(root_pid):
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key == "Pss":
+                        totals["pss"] += int(value.split()[0]) * 1024
+                    elif key in ("Private_Clean", "Private_Dirty"):
+                        totals["private"] += int(value.split()[0]) * 1024
+        except (OSError, ValueError):
+            continue
+    return totals
+
+
+def wait_for_first_response(url: str, timeout: float = 60.0) -> float:
+    """Poll ``url`` every 10ms; seconds until it answers below 500."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                if response.status < 500:
+                    return time.perf_counter() - started
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+def cold_start(name: str, workers: int, fake_url: str) -> Dict[str, Any]:
+    """Launch one configuration and time its first response and first upload."""
+    command, extra_env = STARTUP_CONFIGS[name]
+    port = free_port()
+    command = [part.format(port=port, workers=workers) for part in command]
+    env = app_env(dict(
+        extra_env,
+        DDOWNLOAD_API_URL=f"{fake_url}/api",
+        DEDUP_ENABLED="false",
+        RATE_LIMIT_ENABLED="false",
+        BIND=f"127.0.0.1:{port}",
+        WEB_CONCURRENCY=str(workers),
+    ))
+    base_url = f"http://127.0.0.1:{port}"
+    launched = time.perf_counter()
+    process = start_process(command, env)
+    try:
+        first_response = wait_for_first_response(base_url + "/")
+        upload = asyncio.run(drive_uploads(base_url, [64 * 1024], 1, 1))
+        first_upload = time.perf_counter() - launched
+        # Let every worker finish booting before the memory is read
+        asyncio.run(drive_uploads(base_url, [64 * 1024], 4 * workers, workers))
+        memory = process_tree_memory(process.pid)
+    finally:
+        stop_process(process)
+    return {
+        "config": f"{name}-w{workers}",
+        "first_response_ms": round(first_response * 1000, 1),
+        "first_upload_ms": round(first_upload * 1000, 1),
+        "first_upload_ok": upload["ok"] == 1,
+        "pss_mb": round(memory["pss"] / (1024 * 1024), 1),
+        "private_mb": round(memory["private"] / (1024 * 1024), 1),
+    }
+
+
+def print_report(imports: Dict[str, Any], heaviest: List[Dict[str, Any]], starts: List[Dict[str, Any]]) -> None:
+    print(f"import app:   {imports['import_ms']} ms (median of {imports['runs']})")
+    print(f"create_app(): {imports['create_app_ms']} ms")
+    print(f"modules:      {imports['modules']} (aiohttp loaded: {imports['aiohttp_loaded']}, "
+          f"requests loaded: {imports['requests_loaded']})")
+    if heaviest:
+        print()
+        print(f"{'module':<48} {'cumulative ms':>14} {'self ms':>9}")
+        for row in heaviest:
+            print(f"{row['module']:<48} {row['cumulative_ms']:>14.1f} {row['self_ms']:>9.1f}")
+    if starts:
+        print()
+        header = f"{'config':<22} {'1st response ms':>16} {'1st upload ms':>14} {'PSS MB':>8} {'private MB':>11}"
+        print(header)
+        print("-" * len(header))
+        for r in starts:
+            upload = f"{r['first_upload_ms']}" if r["first_upload_ok"] else "failed"
+            print(f"{r['config']:<22} {r['first_response_ms']:>16} {upload:>14} {r['pss_mb']:>8} {r['private_mb']:>11}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Measure import time and server cold start")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters timed for the import figures")
+    parser.add_argument("--top", type=int, default=0, help="also list the N heaviest imports of `import app`")
+    parser.add_argument("--configs", default="gevent,gevent-preload,asgi",
+                        help=f"comma-separated server configurations ({', '.join(STARTUP_CONFIGS)}); empty to skip")
+    parser.add_argument("--workers", type=int, default=2, help="workers per server configuration")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    configs = [name for name in args.configs.split(",") if name]
+    for name in configs:
+        if name not in STARTUP_CONFIGS:
+            parser.error(f"unknown configuration: {name}")
+
+    imports = measure_imports(args.runs)
+    heaviest = heaviest_imports(args.top) if args.top else []
+    starts = []
+    if configs:
+        fake_port = free_port()
+        fake_url = f"http://127.0.0.1:{fake_port}"
+        fake = start_process([sys.executable, "-m", "benchmarks.fake_ddownload", "--port", str(fake_port)], dict(os.environ))
+        try:
+            asyncio.run(wait_until_ready(fake_url + "/stats"))
+            for name in configs:
+                print(f"Starting {name} with {args.workers} worker(s)...", file=sys.stderr)
+                starts.append(cold_start(name, args.workers, fake_url))
+        finally:
+            stop_process(fake)
+
+    print_report(imports, heaviest, starts)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"imports": imports, "heaviest_imports": heaviest, "cold_start": starts}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
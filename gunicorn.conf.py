@@ -0,0 +1,142 @@
+"""
+Gunicorn configuration.
+Worker settings plus lifecycle hooks that keep per-process resources
+(such as the outbound HTTP connection pool) fork-safe.
+
+PRELOAD_APP=true is the startup-optimised mode: the master imports and
+builds the app once and forks ready workers from it, sharing the loaded
+code and built assets with them copy-on-write. Otherwise the master never
+imports the app (whose locks and thread-locals the gevent workers would
+inherit unpatched): its hooks clean up by path instead.
+"""
+import gc
+import glob
+import os
+import shutil
+import sqlite3
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = os.getenv("WORKER_CLASS", "gevent") # Using gevent worker as per original brief
+preload_app = os.getenv("PRELOAD_APP", "False").lower() == "true"
+
+if preload_app:
+    if worker_class == "gevent":
+        # The app is imported here in the master, so patch before it is, as
+        # the gevent worker would have done after the fork
+        from gevent import monkey
+        monkey.patch_all()
+    # Collections while the app is imported would leave holes in the pages
+    # the workers share; collection resumes once it is frozen (when_ready)
+    gc.disable()
+
+STAGING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "staging")
+
+# Workers share metrics through files in this directory; it has to be set
+# before the app (and prometheus_client) is imported in the workers
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(STAGING_DIR, "metrics"))
+
+# Rate limits must hold across workers, not per worker
+os.environ.setdefault("RATE_LIMIT_BACKEND", "sqlite")
+
+
+def _rate_limit_db_path() -> str:
+    return os.getenv("RATE_LIMIT_DB_PATH", os.path.join(STAGING_DIR, "ratelimit.sqlite3"))
+
+
+def on_starting(server):
+    """
+    Start every server run with empty metrics and rate limiter state, and
+    clear what the workers of an earlier run left in the staging area.
+
+    Without preload_app the master never imports the app, so the limiter's
+    database is deleted by path and the staging area is left to the first
+    pass of each worker's reaper.
+    """
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    if not server.cfg.preload_app:
+        db_path = _rate_limit_db_path()
+        for path in (db_path, db_path + "-wal", db_path + "-shm"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return
+    from app.modules.ratelimit import rate_limiter
+    from app.modules.staging import staging_area
+    rate_limiter.backend.reset()
+    staging_area.reap()
+
+
+def when_ready(server):
+    """With preload_app, finish loading shared state before the first worker is forked."""
+    if not server.cfg.preload_app:
+        return
+    # Workers send uploads through requests: import it once here rather
+    # than in every worker on its first upload
+    import requests # noqa: F401
+    # Keep everything loaded so far out of every later collection: a worker
+    # collecting would otherwise write to (and so copy) the pages it shares
+    gc.freeze()
+    gc.enable()
+
+
+def pre_fork(server, worker):
+    """Close the master's log files so a worker opens its own (see configure_sinks)."""
+    if not server.cfg.preload_app:
+        return # The master has not loaded the logger, so it has no files open
+    from app.modules.logger import close_sinks
+    close_sinks()
+
+
+def post_fork(server, worker):
+    """Make sure a worker never reuses connections opened before the fork."""
+    if not server.cfg.preload_app:
+        return # Nothing was opened, and the gevent worker has not patched threading yet
+    from app.modules.http_client import http_client
+    http_client.reset()
+
+
+def post_worker_init(worker):
+    """
+    Start a worker's background threads once the gevent worker has patched
+    threading, so they run as greenlets on the worker's hub rather than on
+    whichever thread first needed them.
+    """
+    from app.modules.staging import staging_area
+    from app.modules.uploader import uploader
+    uploader.server_pool.start()
+    staging_area.start()
+
+
+def child_exit(server, worker):
+    """
+    Drop the live gauges, held rate limit slots and staged files of a worker
+    that has exited. Without preload_app the gauges and slots are removed by
+    path, and the staged files are left to the other workers' reapers, which
+    clean up after dead processes.
+    """
+    if not server.cfg.preload_app:
+        for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], f"gauge_live*_{worker.pid}.db")):
+            os.remove(path)
+        if os.environ["RATE_LIMIT_BACKEND"] == "sqlite" and os.path.exists(_rate_limit_db_path()):
+            try:
+                with sqlite3.connect(_rate_limit_db_path(), timeout=5) as conn:
+                    conn.execute("DELETE FROM slots WHERE pid = ?", (worker.pid,))
+            except sqlite3.Error as e:
+                server.log.error("Rate limit cleanup for worker %s failed: %s", worker.pid, e)
+        return
+    from app.modules.metrics import mark_process_dead
+    from app.modules.ratelimit import rate_limiter
+    from app.modules.staging import staging_area
+    mark_process_dead(worker.pid)
+    rate_limiter.backend.forget_process(worker.pid)
+    staging_area.forget_process(worker.pid)
+
+
+def worker_exit(server, worker):
+    """Close pooled keep-alive connections when a worker shuts down."""
+    from app.modules.http_client import http_client
+    http_client.close()